@@ -0,0 +1,12 @@
+"""Ядро генератора музыки без графического интерфейса.
+
+Используется окном приложения (main.py) и командной строкой:
+python -m aimusic generate --preset "Бас-гитара" --count 10 --out dir/
+"""
+from .constants import SCALES, INSTRUMENTS, RHYTHMS, DRUM_PATTERNS, DEFAULT_PRESETS, FAST_CPU_MODES
+from .cancel import CancelToken, GenerationCancelled
+from .notes import NOTE_DTYPE, NoteBuffer
+from .midi_io import MidiFileWriter, write_midi
+from .generator import MusicGenerator, default_orchestra, drum_kit, output_prefix, parse_instrument
+from .registry import ModelRegistry
+from .paths import get_output_path, generate_unique_filename
@@ -0,0 +1,48 @@
+"""Кооперативная отмена и бюджет времени генерации"""
+import threading
+import time
+
+
+class GenerationCancelled(Exception):
+    """Генерация отменена пользователем"""
+
+
+class CancelToken:
+    """Флаг отмены и ограничение по времени для одной генерации.
+
+    Генератор проверяет should_stop() на каждом шаге модели и между
+    фрагментами. После cancel() генерация прерывается исключением
+    GenerationCancelled, а по истечении бюджета time_budget (с, отсчёт от
+    start()) возвращает то, что успела сгенерировать.
+    """
+
+    def __init__(self, time_budget=None):
+        self.time_budget = float(time_budget) if time_budget else None
+        self.deadline = None
+        self._cancelled = threading.Event()
+
+    def start(self):
+        """Начинает отсчёт бюджета времени, возвращает сам токен"""
+        if self.time_budget:
+            self.deadline = time.monotonic() + self.time_budget
+        return self
+
+    def cancel(self):
+        """Просит генерацию остановиться (можно вызывать из любого потока)"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self):
+        """Бюджет времени исчерпан"""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def should_stop(self):
+        return self.cancelled or self.expired
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled("Генерация отменена")
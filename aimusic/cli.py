@@ -0,0 +1,279 @@
+"""Командная строка: python -m aimusic generate --preset ... --count 500 --out dir/"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from .cancel import CancelToken
+from .constants import DEFAULT_PRESETS, SCALES, RHYTHMS, INSTRUMENTS, FAST_CPU_MODES
+from .generator import MusicGenerator, drum_kit, default_orchestra
+from .jobs import JobQueue, sweep_settings
+from .presets import PRESETS_FILE, find_preset, load_preset_file, load_user_presets
+from .registry import ModelRegistry, load_model_names
+from .sweep import SweepPlan, TimingHistory
+from .timing import format_time_signature, parse_time_signature
+
+
+def resolve_preset(args):
+    """Пресет из файла JSON или по имени (встроенный либо из presets.json)"""
+    return resolve_preset_ref(args.preset, args.name, args.presets_file)
+
+
+def resolve_preset_ref(preset_ref, name=None, presets_file=PRESETS_FILE):
+    """Пресет по пути к JSON-файлу или по имени"""
+    if os.path.isfile(preset_ref):
+        return load_preset_file(preset_ref, name)
+
+    preset = find_preset(preset_ref, presets_file)
+    if preset is None:
+        raise KeyError(f"Пресет '{preset_ref}' не найден")
+    return preset
+
+
+def apply_overrides(preset, args):
+    """Переопределяет параметры пресета аргументами командной строки"""
+    settings = dict(preset)
+    if args.instrument is not None:
+        program = int(args.instrument)
+        settings['instrument'] = f"{program}: {INSTRUMENTS.get(program, 'Program ' + str(program))}"
+    if args.key is not None:
+        settings['key'] = args.key
+    if args.tempo is not None:
+        settings['tempo'] = args.tempo
+    if args.num_notes is not None:
+        settings['num_notes'] = args.num_notes
+        settings['notes_per_instrument'] = args.num_notes
+    if args.temperature is not None:
+        settings['temperature'] = args.temperature
+    if args.bpm is not None:
+        settings['bpm'] = args.bpm
+    if args.time_signature is not None:
+        settings['time_signature'] = format_time_signature(parse_time_signature(args.time_signature))
+    if args.stream:
+        settings['stream'] = True
+    if args.time_budget is not None:
+        settings['time_budget'] = args.time_budget
+    if args.seed_midi is not None:
+        settings['seed_type'] = "midi"
+        settings['seed_file'] = args.seed_midi
+
+    if settings['track_type'] == "orchestra" and not settings.get('orchestra'):
+        settings['orchestra'] = default_orchestra() + (drum_kit() if args.drums else [])
+    return settings
+
+
+def create_generator(args):
+    """MusicGenerator с моделью и режимом вычислений из аргументов"""
+    generator = MusicGenerator()
+    generator.fast_cpu = args.fast_cpu
+    generator.cpu_threads = args.threads
+    if args.model:
+        print(generator.load_model(args.model, on_status=print))
+    return generator
+
+
+def command_generate(args):
+    preset = resolve_preset(args)
+    settings = apply_overrides(preset, args)
+
+    generator = create_generator(args)
+
+    started = time.perf_counter()
+    try:
+        for index in range(args.count):
+            # Для воспроизводимости у каждого файла своё зерно
+            rng = np.random.default_rng([args.seed, index]) if args.seed is not None else None
+            cancel = CancelToken(settings.get('time_budget')).start()
+            if settings.get('stream'):
+                writer = generator.generate_to_file(settings, args.out, rng=rng, cancel=cancel)
+                filename, note_count = writer.filename, writer.note_count
+            else:
+                notes = generator.generate(settings, rng=rng, cancel=cancel)
+                filename, note_count = generator.save(notes, settings, args.out), len(notes)
+            print(filename)
+            if cancel.expired:
+                print(f"⏱ Бюджет времени исчерпан: {filename} - нот {note_count}", file=sys.stderr)
+    finally:
+        generator.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Сгенерировано файлов: {args.count} за {elapsed:.1f} с", file=sys.stderr)
+    return 0
+
+
+def command_batch(args):
+    preset = resolve_preset(args)
+    settings = apply_overrides(preset, args)
+    keys = "all" if args.keys == ["all"] else args.keys
+    settings_list = sweep_settings(settings, keys, args.temperatures, args.repeat)
+
+    generator = create_generator(args)
+
+    def on_job_done(job):
+        if job.status == "done":
+            print(job.path)
+            if job.truncated:
+                print(f"⏱ Задание {job.id}: бюджет времени исчерпан, нот меньше заказанного", file=sys.stderr)
+        elif job.status == "failed":
+            print(f"❌ Задание {job.id} ({job.settings['key']}, T={job.settings['temperature']}): {job.error}",
+                  file=sys.stderr)
+
+    started = time.perf_counter()
+    jobs = JobQueue(generator, workers=args.workers, output_dir=args.out, on_job_done=on_job_done)
+    try:
+        jobs.submit_many(settings_list, args.seed)
+        jobs.wait()
+    finally:
+        # При прерывании (Ctrl+C) текущие задания останавливаются, а не дожидаются
+        jobs.shutdown(cancel_pending=True)
+        generator.close()
+
+    counts = jobs.counts()
+    elapsed = time.perf_counter() - started
+    print(f"✅ Готово: {counts['done']}, ошибок: {counts['failed']} за {elapsed:.1f} с", file=sys.stderr)
+    return 0 if counts['failed'] == 0 else 1
+
+
+def command_sweep(args):
+    with open(args.spec, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    if not spec.get('preset'):
+        raise Exception(f"В спецификации {args.spec} не указан пресет (ключ \"preset\")")
+    base = resolve_preset_ref(spec['preset'], spec.get('name'), args.presets_file)
+
+    timings = TimingHistory()
+    plan = SweepPlan(base, spec, timings, args.model or '')
+    print(plan.describe(args.workers), file=sys.stderr)
+
+    if args.dry_run:
+        for index, (settings, estimate) in enumerate(zip(plan.settings_list, plan.estimates), 1):
+            pitch_range = ("регистр ролей" if settings['track_type'] == "orchestra"
+                           else f"{settings.get('pitch_min', 0)}-{settings.get('pitch_max', 127)}")
+            seconds = "?" if estimate is None else f"~{estimate:.1f} с"
+            print(f"{index}. {settings.get('model') or '-'} | {settings['key']} | T={settings['temperature']} | "
+                  f"{settings['tempo']} | нот {settings.get('num_notes')} | {pitch_range} | {seconds}")
+        return 0
+
+    generator = create_generator(args)
+
+    def on_job_done(job):
+        if job.status == "done":
+            print(job.path)
+        elif job.status == "failed":
+            print(f"❌ Задание {job.id} ({job.settings['key']}, T={job.settings['temperature']}): {job.error}",
+                  file=sys.stderr)
+
+    started = time.perf_counter()
+    jobs = JobQueue(generator, workers=args.workers, output_dir=args.out, on_job_done=on_job_done, timings=timings)
+    try:
+        jobs.submit_many(plan.settings_list, args.seed)
+        jobs.wait()
+    finally:
+        jobs.shutdown(cancel_pending=True)
+        generator.close()
+
+    counts = jobs.counts()
+    elapsed = time.perf_counter() - started
+    print(f"✅ Готово: {counts['done']}, ошибок: {counts['failed']} за {elapsed:.1f} с", file=sys.stderr)
+    return 0 if counts['failed'] == 0 else 1
+
+
+def command_presets(args):
+    for name in DEFAULT_PRESETS:
+        print(name)
+    for name in load_user_presets(args.presets_file):
+        if name not in DEFAULT_PRESETS:
+            print(f"👤 {name}")
+    return 0
+
+
+def command_models(args):
+    if args.add:
+        name, path = args.add
+        if not os.path.isfile(path):
+            raise Exception(f"Файл модели не найден: {path}")
+        ModelRegistry().register(name, path)
+        print(f"🏷 {name}: {os.path.abspath(path)}")
+        return 0
+    for name, path in sorted(load_model_names().items()):
+        print(f"{name}: {path}")
+    return 0
+
+
+def add_generation_arguments(parser):
+    """Общие аргументы команд генерации: пресет, модель, вывод и переопределения"""
+    parser.add_argument('--preset', required=True,
+                        help="имя пресета или путь к JSON-файлу пресета (формат save_preset)")
+    parser.add_argument('--name', help="имя пресета внутри JSON-файла с несколькими пресетами")
+    parser.add_argument('--out', help="папка для результатов (по умолчанию Outputs/<дата>)")
+    parser.add_argument('--model', help="файл модели .h5 или её имя из models.json; без неё - генерация по правилам")
+    parser.add_argument('--seed', type=int, help="зерно генератора случайных чисел")
+    parser.add_argument('--instrument', type=int, help="программа инструмента General MIDI")
+    parser.add_argument('--key', choices=list(SCALES), help="тональность")
+    parser.add_argument('--tempo', choices=list(RHYTHMS), help="темп")
+    parser.add_argument('--num-notes', type=int, help="количество нот (на инструмент для оркестра)")
+    parser.add_argument('--temperature', type=float, help="температура генерации")
+    parser.add_argument('--bpm', type=float, help="темп композиции, ударов в минуту")
+    parser.add_argument('--time-signature', help="размер, например 3/4")
+    parser.add_argument('--fast-cpu', choices=FAST_CPU_MODES,
+                        help="быстрый режим CPU: квантование модели в TFLite")
+    parser.add_argument('--threads', type=int, help="число потоков вычислений модели")
+    parser.add_argument('--stream', action='store_true',
+                        help="потоковая запись фрагментами: память не растёт с --num-notes (одна партия)")
+    parser.add_argument('--time-budget', type=float,
+                        help="ограничение времени генерации одного файла, с: по истечении сохраняется сгенерированное")
+    parser.add_argument('--seed-midi', help="MIDI-файл затравки, продолжение которого генерирует модель")
+    parser.add_argument('--drums', action='store_true', help="добавить ударные в базовый состав оркестра")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="aimusic", description="Генератор музыки без графического интерфейса")
+    parser.add_argument('--presets-file', default=PRESETS_FILE, help="файл пользовательских пресетов")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="сгенерировать MIDI-файлы по пресету")
+    add_generation_arguments(generate)
+    generate.add_argument('--count', type=int, default=1, help="количество файлов")
+    generate.set_defaults(handler=command_generate)
+
+    batch = commands.add_parser('batch', help="пакетная генерация по сетке тональностей и температур")
+    add_generation_arguments(batch)
+    batch.add_argument('--keys', nargs='+', help="тональности или all - все тональности")
+    batch.add_argument('--temperatures', nargs='+', type=float, help="список температур")
+    batch.add_argument('--repeat', type=int, default=1, help="файлов на каждую точку сетки")
+    batch.add_argument('--workers', type=int, default=2, help="количество рабочих потоков")
+    batch.set_defaults(handler=command_batch)
+
+    sweep = commands.add_parser('sweep', help="сетка по спецификации: тональности, температуры, темпы, "
+                                              "число нот и диапазоны высот")
+    sweep.add_argument('spec', help="JSON-файл спецификации сетки (пресет и оси)")
+    sweep.add_argument('--dry-run', action='store_true', help="только показать план и оценку времени")
+    sweep.add_argument('--out', help="папка для результатов (по умолчанию Outputs/<дата>)")
+    sweep.add_argument('--model', help="файл модели .h5 или её имя из models.json; без неё - генерация по правилам")
+    sweep.add_argument('--seed', type=int, help="зерно генератора случайных чисел")
+    sweep.add_argument('--workers', type=int, default=2, help="количество рабочих потоков")
+    sweep.add_argument('--fast-cpu', choices=FAST_CPU_MODES,
+                       help="быстрый режим CPU: квантование модели в TFLite")
+    sweep.add_argument('--threads', type=int, help="число потоков вычислений модели")
+    sweep.set_defaults(handler=command_sweep)
+
+    presets = commands.add_parser('presets', help="показать доступные пресеты")
+    presets.set_defaults(handler=command_presets)
+
+    models = commands.add_parser('models', help="показать модели, доступные по имени")
+    models.add_argument('--add', nargs=2, metavar=('NAME', 'PATH'),
+                        help="сохранить имя модели в models.json")
+    models.set_defaults(handler=command_models)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except Exception as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
@@ -0,0 +1,243 @@
+"""Музыкальные константы: тональности, инструменты, ритмы и пресеты"""
+
+# Тональности: ноты гаммы (MIDI)
+SCALES = {
+    'C Major': [60, 62, 64, 65, 67, 69, 71],
+    'A Minor': [57, 59, 60, 62, 64, 65, 67],
+    'G Major': [67, 69, 71, 72, 74, 76, 78],
+    'E Minor': [64, 66, 67, 69, 71, 72, 74],
+    'F Major': [65, 67, 69, 70, 72, 74, 76],
+    'D Minor': [62, 64, 65, 67, 69, 70, 72],
+    'Bb Major': [70, 72, 74, 75, 77, 79, 81],
+    'Chromatic': list(range(60, 73))
+}
+
+# Инструменты General MIDI, доступные в интерфейсе
+INSTRUMENTS = {
+    0: 'Acoustic Grand Piano', 1: 'Bright Acoustic Piano', 2: 'Electric Grand Piano',
+    24: 'Acoustic Guitar (nylon)', 25: 'Acoustic Guitar (steel)', 26: 'Electric Guitar (jazz)',
+    27: 'Electric Guitar (clean)', 32: 'Acoustic Bass', 33: 'Electric Bass (finger)',
+    40: 'Violin', 41: 'Viola', 42: 'Cello', 56: 'Trumpet', 57: 'Trombone',
+    64: 'Soprano Sax', 65: 'Alto Sax', 73: 'Flute', 80: 'Lead 1 (square)', 81: 'Lead 2 (sawtooth)'
+}
+
+# Ритмические параметры: шаг между нотами и длительность, с при 120 BPM
+# (0.5 - одна доля; темп пресета 'bpm' растягивает или сжимает их)
+RHYTHMS = {
+    'Медленно': {'step_min': 0.8, 'step_max': 2.0, 'duration_min': 1.0, 'duration_max': 3.0},
+    'Умеренно': {'step_min': 0.4, 'step_max': 1.2, 'duration_min': 0.6, 'duration_max': 2.0},
+    'Быстро': {'step_min': 0.2, 'step_max': 0.8, 'duration_min': 0.3, 'duration_max': 1.5},
+    'Пользовательский': {'step_min': 0.1, 'step_max': 4.0, 'duration_min': 0.1, 'duration_max': 4.0}
+}
+
+# Паттерны для ударных
+DRUM_PATTERNS = {
+    'kick': [36],
+    'snare': [38, 40],
+    'hihat': [42, 44],
+    'crash': [49, 57],
+    'ride': [51]
+}
+
+# Базовый состав оркестра: (программа, название, роль)
+DEFAULT_ORCHESTRA = [
+    (48, "String Ensemble 1", "strings"),
+    (0, "Acoustic Grand Piano", "piano"),
+    (56, "Trumpet", "brass"),
+    (40, "Violin", "strings"),
+    (33, "Electric Bass (finger)", "bass")
+]
+
+# Регистры партий (MIDI) по типу партии или роли в оркестре: ограничивают
+# высоты, когда диапазон из настроек не применяется
+ROLE_RANGES = {
+    'melody': (55, 96),
+    'solo': (55, 100),
+    'harmony': (48, 79),
+    'chords': (48, 79),
+    'bass': (28, 55),
+    'strings': (40, 96),
+    'piano': (36, 96),
+    'brass': (46, 84),
+}
+
+# Ударная установка для оркестра
+DRUM_KIT = [
+    {'program': 0, 'name': 'Kick Drum', 'role': 'drums', 'drum_notes': [36], 'velocity': 120},
+    {'program': 0, 'name': 'Snare Drum', 'role': 'drums', 'drum_notes': [38, 40], 'velocity': 110},
+    {'program': 0, 'name': 'Hi-Hat', 'role': 'drums', 'drum_notes': [42, 44], 'velocity': 100},
+    {'program': 0, 'name': 'Crash Cymbal', 'role': 'drums', 'drum_notes': [49, 57], 'velocity': 110},
+]
+
+# Предопределенные пресеты
+DEFAULT_PRESETS = {
+    "🎹 Классическое пианино": {
+        "instrument": "0: Acoustic Grand Piano",
+        "track_type": "melody",
+        "key": "C Major",
+        "num_notes": 300,
+        "temperature": 0.8,
+        "tempo": "Умеренно",
+        "bpm": 96,
+        "time_signature": "4/4",
+        "pitch_min": 60,
+        "pitch_max": 84,
+        "use_scale": True,
+        "smooth_melody": True,
+        "quantize_rhythm": True
+    },
+    "🎸 Блюзовая гитара": {
+        "instrument": "27: Electric Guitar (clean)",
+        "track_type": "melody",
+        "key": "A Minor",
+        "num_notes": 250,
+        "temperature": 1.2,
+        "tempo": "Умеренно",
+        "bpm": 88,
+        "time_signature": "4/4",
+        "pitch_min": 48,
+        "pitch_max": 72,
+        "use_scale": True,
+        "smooth_melody": True,
+        "quantize_rhythm": False
+    },
+    "🎺 Джазовая труба": {
+        "instrument": "56: Trumpet",
+        "track_type": "melody",
+        "key": "Bb Major",
+        "num_notes": 200,
+        "temperature": 1.1,
+        "tempo": "Быстро",
+        "bpm": 132,
+        "time_signature": "4/4",
+        "pitch_min": 60,
+        "pitch_max": 96,
+        "use_scale": False,
+        "smooth_melody": False,
+        "quantize_rhythm": True
+    },
+    "🎻 Лирическая скрипка": {
+        "instrument": "40: Violin",
+        "track_type": "melody",
+        "key": "G Major",
+        "num_notes": 350,
+        "temperature": 0.9,
+        "tempo": "Медленно",
+        "bpm": 72,
+        "time_signature": "3/4",
+        "pitch_min": 67,
+        "pitch_max": 108,
+        "use_scale": True,
+        "smooth_melody": True,
+        "quantize_rhythm": True
+    },
+    "🎸 Бас-гитара": {
+        "instrument": "33: Electric Bass (finger)",
+        "track_type": "bass",
+        "key": "E Minor",
+        "num_notes": 150,
+        "temperature": 0.7,
+        "tempo": "Умеренно",
+        "bpm": 110,
+        "time_signature": "4/4",
+        "pitch_min": 24,
+        "pitch_max": 48,
+        "use_scale": True,
+        "smooth_melody": False,
+        "quantize_rhythm": True
+    },
+    "🎹 Аккордовое сопровождение": {
+        "instrument": "0: Acoustic Grand Piano",
+        "track_type": "chords",
+        "key": "F Major",
+        "num_notes": 100,
+        "temperature": 0.6,
+        "tempo": "Медленно",
+        "bpm": 90,
+        "time_signature": "4/4",
+        "pitch_min": 48,
+        "pitch_max": 72,
+        "use_scale": True,
+        "smooth_melody": False,
+        "quantize_rhythm": True
+    },
+    "🎷 Саксофон соло": {
+        "instrument": "65: Alto Sax",
+        "track_type": "melody",
+        "key": "D Minor",
+        "num_notes": 280,
+        "temperature": 1.3,
+        "tempo": "Умеренно",
+        "bpm": 120,
+        "time_signature": "4/4",
+        "pitch_min": 55,
+        "pitch_max": 84,
+        "use_scale": False,
+        "smooth_melody": True,
+        "quantize_rhythm": False
+    },
+    "💫 Электронный синтез": {
+        "instrument": "80: Lead 1 (square)",
+        "track_type": "melody",
+        "key": "Chromatic",
+        "num_notes": 400,
+        "temperature": 1.5,
+        "tempo": "Быстро",
+        "bpm": 128,
+        "time_signature": "4/4",
+        "pitch_min": 36,
+        "pitch_max": 96,
+        "use_scale": False,
+        "smooth_melody": False,
+        "quantize_rhythm": True
+    },
+    "🎼 Симфонический оркестр": {
+        "instrument": "48: String Ensemble 1",
+        "track_type": "orchestra",
+        "key": "C Major",
+        "num_notes": 500,
+        "temperature": 0.9,
+        "tempo": "Умеренно",
+        "bpm": 100,
+        "time_signature": "4/4",
+        "pitch_min": 36,
+        "pitch_max": 108,
+        "use_scale": True,
+        "smooth_melody": True,
+        "quantize_rhythm": True
+    },
+    "🎭 Драматический оркестр": {
+        "instrument": "49: String Ensemble 2",
+        "track_type": "orchestra",
+        "key": "D Minor",
+        "num_notes": 600,
+        "temperature": 1.1,
+        "tempo": "Медленно",
+        "bpm": 72,
+        "time_signature": "3/4",
+        "pitch_min": 24,
+        "pitch_max": 108,
+        "use_scale": True,
+        "smooth_melody": True,
+        "quantize_rhythm": True
+    },
+    "🌟 Торжественный марш": {
+        "instrument": "61: Brass Section",
+        "track_type": "orchestra",
+        "key": "Bb Major",
+        "num_notes": 400,
+        "temperature": 0.8,
+        "tempo": "Умеренно",
+        "bpm": 112,
+        "time_signature": "2/4",
+        "pitch_min": 48,
+        "pitch_max": 96,
+        "use_scale": True,
+        "smooth_melody": False,
+        "quantize_rhythm": True
+    }
+}
+
+# Быстрый режим CPU: dynamic - веса int8 с динамическим диапазоном,
+# float16 - веса в половинной точности
+FAST_CPU_MODES = ("dynamic", "float16")
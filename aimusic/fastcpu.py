@@ -0,0 +1,188 @@
+"""Быстрый режим CPU: квантование модели в TFLite и сэмплер на интерпретаторе"""
+import contextlib
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .constants import FAST_CPU_MODES
+from .models import converted_candidates
+from .paths import atomic_write
+from .sampler import ModelSampler, PrimedContext
+
+# Допустимое расхождение распределений высот с моделью float32 (полная вариация)
+MAX_TOTAL_VARIATION = 0.05
+
+
+def configure_threads(threads):
+    """Число потоков TensorFlow; возвращает False, если среда уже запущена"""
+    if not threads:
+        return True
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+        return True
+    except RuntimeError:
+        return False  # Потоки задаются до первой операции TensorFlow
+
+
+def _interpreter_class():
+    """Интерпретатор LiteRT, если установлен, иначе встроенный в TensorFlow"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def _convert(converter, mode):
+    """Конвертирует в TFLite с квантованием весов"""
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    with contextlib.redirect_stdout(io.StringIO()):  # Конвертер печатает сводку экспорта
+        return converter.convert()
+
+
+def quantize_model(model, mode, model_path=None):
+    """Квантованная TFLite-модель (байты).
+
+    Результат кэшируется в папке преобразованной копии модели, если она есть.
+    """
+    if mode not in FAST_CPU_MODES:
+        raise ValueError(f"Неизвестный режим квантования: {mode}")
+
+    cache_path = None
+    if model_path:
+        for directory in converted_candidates(model_path):
+            if os.path.isdir(directory):
+                cache_path = os.path.join(directory, f"{mode}.tflite")
+                break
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return f.read()
+
+    try:
+        content = _convert(tf.lite.TFLiteConverter.from_keras_model(model), mode)
+    except Exception:
+        # Рекуррентные слои (LSTM, GRU) конвертируются только с фиксированным пакетом
+        input_tensor = model.inputs[0]
+        inputs = tf.keras.Input(batch_shape=(1,) + tuple(input_tensor.shape[1:]), dtype=input_tensor.dtype)
+        content = _convert(tf.lite.TFLiteConverter.from_keras_model(tf.keras.Model(inputs, model(inputs))), mode)
+
+    if cache_path:
+        atomic_write(cache_path, content)
+    return content
+
+
+class TFLiteSampler(ModelSampler):
+    """Сэмплер, выполняющий квантованную модель интерпретатором TFLite.
+
+    Выборка, ритм и работа с затравкой - как у ModelSampler; отличается
+    только прямой проход. Интерпретатор не потокобезопасен, поэтому вызовы
+    из рабочих потоков пакетной генерации выполняются по очереди.
+
+    Выигрыш по скорости проверяется на пакете из одной строки, поэтому
+    пакет из нескольких строк (партии оркестра) генерирует reference -
+    сэмплер float32, если он передан.
+    """
+
+    def __init__(self, model, content, mode, num_threads=None, vocab_size=128, reference=None):
+        self.mode = mode
+        self.reference = reference
+        self.size_bytes = len(content)
+        self.interpreter = _interpreter_class()(model_content=content, num_threads=num_threads)
+        self._runner = self.interpreter.get_signature_runner()
+        self._input_key = next(iter(self._runner.get_input_details()))
+        self._input_dtype = self._runner.get_input_details()[self._input_key]['dtype']
+        # Модель с фиксированным пакетом из одной строки выполняется построчно
+        self.single_row = self.interpreter.get_input_details()[0]['shape_signature'][0] == 1
+        self._lock = threading.Lock()
+        super().__init__(model, vocab_size)
+
+    def _forward(self, inputs):
+        inputs = np.asarray(inputs, dtype=self._input_dtype)
+        with self._lock:
+            if self.single_row:
+                rows = [self._runner(**{self._input_key: inputs[i:i + 1]}) for i in range(len(inputs))]
+                outputs = {key: np.concatenate([row[key] for row in rows]) for key in rows[0]}
+            else:
+                outputs = self._runner(**{self._input_key: inputs})
+
+        # Выходы списком приходят как output_0, output_1, ...
+        if all(key.startswith('output_') for key in outputs):
+            outputs = [outputs[key] for key in sorted(outputs, key=lambda key: int(key.split('_')[-1]))]
+        return self._parse_outputs(outputs)
+
+    def generate(self, context, num_steps, temperature=1.0, rhythm=None, rng=None, logits_mask=None, stop=None):
+        """Как ModelSampler.generate; пакет из нескольких строк - через reference"""
+        if isinstance(rng, (list, tuple)):
+            batch_size = len(rng)
+        else:
+            batch_size = 1 if isinstance(context, PrimedContext) else len(context)
+        sampler = self.reference if self.reference is not None and batch_size > 1 else super()
+        return sampler.generate(context, num_steps, temperature, rhythm, rng, logits_mask, stop)
+
+    def compile(self, batch_size=1, steps=10):
+        """Прогревает интерпретатор и замеряет шаг (граф TensorFlow не нужен)"""
+        self.warmup_seconds = self._time_steps(self._sample_step, batch_size, 1)
+        self.step_seconds = self._time_steps(self._sample_step, batch_size, steps)
+        self.compiled = True
+
+
+def distribution_gap(reference, candidate, windows=16, seed=0):
+    """Расхождение распределений высот двух сэмплеров на случайных окнах.
+
+    Возвращает (средняя полная вариация, средняя KL(reference || candidate)).
+    """
+    rng = np.random.default_rng(seed)
+    window = np.empty((windows, reference.seq_length, 3), dtype=np.float32)
+    window[..., 0] = rng.integers(36, 96, size=window.shape[:2])
+    window[..., 1] = rng.uniform(0.1, 1.0, size=window.shape[:2])
+    window[..., 2] = rng.uniform(0.1, 1.0, size=window.shape[:2])
+
+    inputs = reference._model_input(window)
+    p = tf.nn.softmax(reference._forward(inputs)[0], axis=-1).numpy().astype(np.float64)
+    q = tf.nn.softmax(candidate._forward(inputs)[0], axis=-1).numpy().astype(np.float64)
+
+    total_variation = 0.5 * np.abs(p - q).sum(axis=-1).mean()
+    kl = (p * (np.log(p + 1e-12) - np.log(q + 1e-12))).sum(axis=-1).mean()
+    return float(total_variation), float(kl)
+
+
+def build_fast_sampler(model, reference, mode, model_path=None, num_threads=None):
+    """Квантует модель и сравнивает её с reference (сэмплер float32).
+
+    Возвращает (сэмплер или None, текст отчёта). Сэмплер возвращается,
+    только если распределения близки и шаг быстрее, чем у float32.
+    """
+    started = time.perf_counter()
+    content = quantize_model(model, mode, model_path)
+    convert_seconds = time.perf_counter() - started
+
+    sampler = TFLiteSampler(model, content, mode, num_threads, reference=reference)
+    sampler.compile()
+    total_variation, kl = distribution_gap(reference, sampler)
+
+    reference_seconds = reference.step_seconds or 0.0
+    if reference.incremental_seconds is not None and reference.decoder is not None:
+        reference_seconds = min(reference_seconds, reference.incremental_seconds)
+    reference_size = model.count_params() * 4
+
+    report = (
+        f"🚀 Быстрый режим CPU ({mode}):\n"
+        f"  • Размер: {reference_size / 1e6:.2f} МБ → {sampler.size_bytes / 1e6:.2f} МБ\n"
+        f"  • Шаг: {reference_seconds * 1000:.2f} мс → {sampler.step_seconds * 1000:.2f} мс\n"
+        f"  • Расхождение распределения высот: TV {total_variation:.4f}, KL {kl:.4f} "
+        f"(допуск TV {MAX_TOTAL_VARIATION})\n"
+        f"  • Квантование: {convert_seconds:.1f} с\n"
+        f"  • Пакет из нескольких партий: float32 (скорость сравнивалась на одной партии)\n"
+    )
+    if total_variation > MAX_TOTAL_VARIATION:
+        return None, report + "  • ❌ Распределение заметно отличается - используется float32\n\n"
+    if reference_seconds and sampler.step_seconds >= reference_seconds:
+        return None, report + "  • ⚠️ Не быстрее float32 - используется float32\n\n"
+    return sampler, report + "  • ✅ Включён\n\n"
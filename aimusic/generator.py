@@ -0,0 +1,515 @@
+"""Генерация композиций без графического интерфейса"""
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from .cancel import CancelToken
+from .constants import SCALES, RHYTHMS, DEFAULT_ORCHESTRA, DRUM_KIT
+from .notes import (
+    NOTE_DTYPE, NoteBuffer, make_notes, onsets_from_steps, durations_to_ticks,
+    sample_note_attributes, sample_note_chunk, sample_drum_pattern,
+)
+from .midi_io import MidiStreamWriter, write_midi
+from .paths import get_output_path, reserve_unique_filename
+from .registry import ModelRegistry
+from .rules import apply_rules, pitch_constraints
+from .seeds import load_seed_tokens
+from .timing import tempo_from_settings
+
+
+# Минимальный объём работы (нот на все партии), при котором генерация
+# по правилам распределяется по процессам - иначе запуск пула дороже
+PARALLEL_MIN_NOTES = 20000
+
+# Нот во фрагменте потоковой генерации: столько держится в памяти одновременно
+STREAM_CHUNK_NOTES = 512
+
+# Как часто ожидание пула процессов проверяет отмену, с
+CANCEL_POLL_SECONDS = 0.1
+
+
+def _generate_rule_part(task):
+    """Генерирует партию по правилам (выполняется в процессе пула)"""
+    kind, params, seed = task
+    rng = np.random.default_rng(seed)
+    if kind == 'drums':
+        return sample_drum_pattern(*params, rng)
+    return sample_note_attributes(*params, rng)
+
+
+def parse_instrument(value):
+    """Номер программы из строки вида "0: Acoustic Grand Piano" или числа"""
+    if isinstance(value, str):
+        return int(value.split(':')[0])
+    return int(value)
+
+
+def default_orchestra():
+    """Базовый состав оркестра в виде списка описаний инструментов"""
+    return [
+        {'program': program, 'name': name, 'role': role, 'is_drum': False}
+        for program, name, role in DEFAULT_ORCHESTRA
+    ]
+
+
+def drum_kit():
+    """Ударная установка в виде списка описаний инструментов"""
+    return [
+        {
+            'program': int(drum.get('program', 0)),
+            'name': str(drum.get('name', 'Drum')),
+            'role': str(drum.get('role', 'drums')),
+            'is_drum': True,
+            'drum_notes': list(drum.get('drum_notes', [36])),
+            'velocity': int(drum.get('velocity', 100))
+        }
+        for drum in DRUM_KIT
+    ]
+
+
+def output_prefix(settings):
+    """Префикс имени файла по параметрам генерации"""
+    track_type = settings['track_type']
+    if track_type == "orchestra":
+        instrument_name = "ensemble"
+    else:
+        instrument_name = str(settings['instrument']).split(': ')[-1].replace(' ', '_')
+    key_name = settings['key'].replace(' ', '_')
+    return f"{track_type}_{instrument_name}_{key_name}"
+
+
+class MusicGenerator:
+    """Генератор музыки: модель, сэмплер и правила генерации.
+
+    Не зависит от Tk - используется и окном приложения, и командной строкой.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or ModelRegistry()  # Кэш загруженных моделей
+        self.active = None  # LoadedModel, используемая по умолчанию
+        self.model = None
+        self.sampler = None  # Авторегрессионный сэмплер активной модели
+        self.model_path = ""
+        self.fast_cpu = None  # Режим квантования для быстрого режима CPU (None - float32)
+        self.cpu_threads = None  # Потоки TensorFlow и интерпретатора (None - по умолчанию)
+        self._process_pool = None  # Пул процессов для партий без модели, создаётся по требованию
+
+    def load_model(self, model_path, on_status=None):
+        """Делает модель активной; загружает и прогревает её, если её нет в реестре.
+
+        model_path - путь к файлу или имя модели. Возвращает текстовое
+        описание модели для панели информации. on_status(text) вызывается
+        перед долгими этапами загрузки.
+        """
+        threads_info = ""
+        if self.cpu_threads:
+            from .fastcpu import configure_threads
+            if not configure_threads(self.cpu_threads):
+                threads_info = (
+                    f"⚠️ Потоки TensorFlow: {self.cpu_threads} не применены - TensorFlow уже запущен, "
+                    f"число его потоков меняется только при перезапуске программы"
+                )
+                if self.fast_cpu:
+                    threads_info += ". Интерпретатор быстрого режима использует новое значение"
+                threads_info += "\n\n"
+
+        loaded = self.registry.get(model_path, on_status, self.fast_cpu, self.cpu_threads)
+        if self.registry.name_of(loaded.path) is None:
+            # Имя на время сеанса, чтобы вернуться к модели из списка; в models.json
+            # оно попадает только через явное register
+            self.registry.register(self.registry.unique_name(loaded.name), loaded.path, save=False)
+
+        self.active = loaded
+        self.model = loaded.model
+        self.sampler = loaded.sampler
+        self.model_path = loaded.path
+        return threads_info + loaded.describe()
+
+    def model_for(self, name=None):
+        """LoadedModel по имени из пресета или партии; без имени - активная модель"""
+        if not name:
+            return self.active
+        return self.registry.get(name, fast_cpu=self.fast_cpu, threads=self.cpu_threads)
+
+    def build_seed_context(self, scale, rhythm_params, rng, length):
+        """Создаёт случайную затравку [pitch, step, duration] из нот тональности"""
+        context = np.empty((length, 3), dtype=np.float32)
+        context[:, 0] = rng.choice(scale, size=length)
+        context[:, 1] = rng.uniform(rhythm_params['step_min'], rhythm_params['step_max'], size=length)
+        context[:, 2] = rng.uniform(rhythm_params['duration_min'], rhythm_params['duration_max'], size=length)
+        return context
+
+    def prime_seed(self, seed_file, loaded):
+        """Затравка из MIDI-файла, прогнанная через модель loaded.
+
+        Возвращает PrimedContext или None, если файла нет или у модели нет
+        сэмплера. Файл разбирается и прогоняется один раз на модель.
+        """
+        if not seed_file or loaded is None or loaded.sampler is None:
+            return None
+
+        digest, tokens = load_seed_tokens(seed_file)
+        primed = loaded.primed.get(digest)
+        if primed is None:
+            primed = loaded.primed[digest] = loaded.sampler.prime(tokens)
+        return primed
+
+    def _notes_from_generated(self, generated, rng, offset=0.0):
+        """Ноты NOTE_DTYPE (время в тиках) из строк модели [pitch, step, duration].
+
+        offset - начало первой ноты, с при REFERENCE_BPM. Возвращает ноты и
+        начало следующей ноты.
+        """
+        # Шаги модели - интервалы между началами нот, в секундах при REFERENCE_BPM
+        steps = generated[:, 1].astype(np.float64)
+        starts = onsets_from_steps(steps, offset)
+        velocities = rng.integers(60, 100, size=len(generated))
+        notes = make_notes(generated[:, 0], starts, starts + durations_to_ticks(generated[:, 2]), velocities)
+        return notes, offset + float(steps.sum())
+
+    def iter_notes_with_model(self, num_notes, temperature, key, tempo, track_type, rng=None, primed=None,
+                              loaded=None, rules=None, chunk_size=STREAM_CHUNK_NOTES, cancel=None):
+        """Генерирует ноты фрагментами до chunk_size нот: по массиву NOTE_DTYPE на фрагмент.
+
+        Окно контекста модели скользит через границы фрагментов, время нот
+        продолжается, а плавность мелодии учитывает последнюю ноту прошлого
+        фрагмента - в памяти одновременно только один фрагмент. Параметры -
+        как у generate_notes_with_model. cancel (CancelToken) проверяется на
+        каждом шаге модели: при остановке последний фрагмент короче, а
+        следующих нет.
+        """
+        scale = SCALES[key]
+        rhythm_params = RHYTHMS[tempo]
+        rng = rng if rng is not None else np.random.default_rng()
+        loaded = loaded or self.active
+        sampler = loaded.sampler if loaded is not None else None
+        stop = cancel.should_stop if cancel is not None else None
+
+        constraints = pitch_constraints(rules, track_type) if rules else None
+        mask = None
+        if sampler is not None and constraints is not None:
+            mask = constraints.logits_mask(sampler.logits_size)
+
+        window = None  # Последние seq_length строк модели - затравка следующего фрагмента
+        offset = 0.0
+        previous_pitch = None
+        for done in range(0, num_notes, chunk_size):
+            if stop is not None and stop():
+                break
+
+            count = min(chunk_size, num_notes - done)
+            if sampler is not None:
+                if window is None and primed is not None:
+                    generated = sampler.generate(primed, count, temperature, rhythm_params, [rng], mask, stop)[0]
+                    window = primed.window
+                else:
+                    if window is None:
+                        window = self.build_seed_context(scale, rhythm_params, rng, sampler.seq_length)
+                    generated = sampler.generate(window[None], count, temperature, rhythm_params, rng, mask,
+                                                 stop)[0]
+                if not len(generated):
+                    break  # Остановлено до первой ноты фрагмента
+                window = np.concatenate([window, generated])[-sampler.seq_length:]
+                notes, offset = self._notes_from_generated(generated, rng, offset)
+            else:
+                # Генерация по правилам, если модель не загружена или не подходит для авторегрессии:
+                # высоты выбираются сразу из разрешённых
+                pitches = constraints.pitches if constraints else scale
+                notes, offset = sample_note_chunk(count, pitches, rhythm_params, rng, offset)
+
+            if rules:
+                notes = apply_rules(notes, rules, track_type, previous_pitch=previous_pitch)
+                previous_pitch = int(notes['pitch'][-1])
+            yield notes
+
+    def generate_notes_with_model(self, num_notes, temperature, key, tempo, track_type, rng=None, primed=None,
+                                  loaded=None, rules=None, cancel=None):
+        """Генерирует ноты с помощью модели, возвращает массив NOTE_DTYPE.
+
+        primed - затравка из prime_seed; без неё затравка случайная из нот
+        тональности. loaded - модель из реестра, по умолчанию активная.
+        rules - настройки пресета с музыкальными правилами (см. rules.apply_rules):
+        при выборке они маскируют логиты, после - обрабатывают ноты; без
+        диапазона в настройках высоты ограничиваются регистром track_type.
+        cancel - CancelToken: после остановки возвращаются уже выбранные ноты.
+        """
+        chunks = list(self.iter_notes_with_model(
+            num_notes, temperature, key, tempo, track_type, rng, primed, loaded, rules, max(num_notes, 1), cancel
+        ))
+        return chunks[0] if chunks else np.empty(0, dtype=NOTE_DTYPE)
+
+    def generate_drum_pattern(self, drum_notes, velocity, num_hits, rng=None):
+        """Генерирует паттерн для ударных инструментов"""
+        rng = rng if rng is not None else np.random.default_rng()
+        return sample_drum_pattern(drum_notes, velocity, num_hits, rng)
+
+    def notes_to_midi(self, notes, instrument_program, track_type):
+        """Конвертирует ноты в MIDI объект"""
+        return NoteBuffer.from_notes(notes, instrument_program).to_pretty_midi()
+
+    def _generate_model_parts(self, sampler, indices, seeds, key, tempo, temperature, notes_per_inst,
+                              primed=None, mask=None, cancel=None):
+        """Генерирует мелодические партии одним пакетом: строка пакета - инструмент"""
+        scale = SCALES[key]
+        rhythm_params = RHYTHMS[tempo]
+        rngs = [np.random.default_rng(seeds[index]) for index in indices]
+
+        if primed is not None:
+            # Все партии продолжают одну затравку, посчитанную один раз
+            contexts = primed
+        else:
+            contexts = np.stack([
+                self.build_seed_context(scale, rhythm_params, rng, sampler.seq_length)
+                for rng in rngs
+            ])
+        stop = cancel.should_stop if cancel is not None else None
+        generated = sampler.generate(contexts, notes_per_inst, temperature, rhythm_params, rngs, mask, stop)
+
+        return {
+            index: self._notes_from_generated(generated[row], rngs[row])[0]
+            for row, index in enumerate(indices)
+        }
+
+    def _part_mask(self, rules, inst_data, logits_size):
+        """Маска логитов партии оркестра (нулевая, если ограничений нет)"""
+        mask = pitch_constraints(rules, inst_data.get('role'), use_range=False).logits_mask(logits_size)
+        return np.zeros(logits_size, dtype=np.float32) if mask is None else mask
+
+    def _generate_rule_parts(self, instruments, indices, seeds, key, tempo, notes_per_inst, rules=None,
+                             cancel=None):
+        """Генерирует партии по правилам, при большом объёме - в пуле процессов.
+
+        Отмена проверяется между партиями и во время ожидания пула: ещё не
+        начатые задачи пула снимаются. Исчерпанный бюджет времени партии по
+        правилам не прерывает - без них композиция неполна, а они быстрые.
+        """
+        tasks = []
+        for index in indices:
+            inst_data = instruments[index]
+            if inst_data.get('is_drum', False):
+                params = (inst_data.get('drum_notes', [36]), inst_data.get('velocity', 100), notes_per_inst)
+                tasks.append(('drums', params, seeds[index]))
+            else:
+                pitches = SCALES[key]
+                if rules:
+                    pitches = pitch_constraints(rules, inst_data.get('role'), use_range=False).pitches
+                params = (notes_per_inst, pitches, RHYTHMS[tempo])
+                tasks.append(('notes', params, seeds[index]))
+
+        if cancel is None:
+            cancel = CancelToken()
+        if len(tasks) > 1 and len(tasks) * notes_per_inst >= PARALLEL_MIN_NOTES:
+            futures = [self.process_pool().submit(_generate_rule_part, task) for task in tasks]
+            pending = set(futures)
+            try:
+                while pending:
+                    cancel.raise_if_cancelled()
+                    _, pending = wait(pending, timeout=CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+            finally:
+                for future in pending:
+                    future.cancel()  # Уже начатые задачи процесс доделает, их результат не нужен
+            results = [future.result() for future in futures]
+        else:
+            results = []
+            for task in tasks:
+                cancel.raise_if_cancelled()
+                results.append(_generate_rule_part(task))
+        return dict(zip(indices, results))
+
+    def process_pool(self):
+        """Пул процессов для генерации по правилам (spawn - безопасно рядом с Tk)"""
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._process_pool
+
+    def close(self):
+        """Освобождает пул процессов"""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(cancel_futures=True)
+            self._process_pool = None
+
+    def generate_orchestra(self, instruments, key, tempo, temperature, notes_per_inst, rng=None, progress=None,
+                           seed_file=None, rules=None, cancel=None):
+        """Генерирует оркестровую композицию.
+
+        Партии генерируются одновременно: мелодические - пакетным вызовом
+        модели (по пакету на каждую модель, указанную в партиях ключом
+        'model'), остальные - по правилам (параллельно по процессам).
+        У каждой партии своё зерно, поэтому результат детерминирован при
+        заданном rng. seed_file - общая MIDI-затравка мелодических партий.
+        rules - музыкальные правила пресета для мелодических партий; вместо
+        диапазона высот из настроек у каждой партии регистр её роли.
+        cancel - CancelToken: при отмене выбрасывается GenerationCancelled, по
+        истечении бюджета времени партии модели короче notes_per_inst.
+        Возвращает NoteBuffer со всеми партиями и словарь партий по номеру
+        инструмента.
+        """
+        if not instruments:
+            raise ValueError("Добавьте инструменты в оркестр перед генерацией!")
+
+        rng = rng if rng is not None else np.random.default_rng()
+        seeds = np.random.SeedSequence(rng.integers(2 ** 63)).spawn(len(instruments))
+
+        # Мелодические партии группируются по модели: одна группа - один пакет
+        groups = {}
+        for index, inst in enumerate(instruments):
+            if not inst.get('is_drum', False):
+                groups.setdefault(inst.get('model') or None, []).append(index)
+
+        notes = {}
+        for model_name, melodic in groups.items():
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            loaded = self.model_for(model_name)
+            if loaded is None or loaded.sampler is None:
+                continue
+            primed = self.prime_seed(seed_file, loaded)
+            mask = None
+            if rules:
+                # Своя маска у каждой строки пакета: партии разных ролей в одном вызове модели
+                mask = np.stack([
+                    self._part_mask(rules, instruments[index], loaded.sampler.logits_size)
+                    for index in melodic
+                ])
+            notes.update(self._generate_model_parts(
+                loaded.sampler, melodic, seeds, key, tempo, temperature, notes_per_inst, primed, mask, cancel
+            ))
+            if progress:
+                progress(100 * len(notes) / len(instruments))
+
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        remaining = [i for i in range(len(instruments)) if i not in notes]
+        notes.update(self._generate_rule_parts(
+            instruments, remaining, seeds, key, tempo, notes_per_inst, rules, cancel
+        ))
+        if rules:
+            for index, inst_data in enumerate(instruments):
+                if not inst_data.get('is_drum', False):
+                    notes[index] = apply_rules(notes[index], rules, inst_data.get('role'), use_range=False)
+        if progress:
+            progress(100)
+
+        parts = {
+            index: NoteBuffer.from_notes(
+                notes[index], inst_data['program'], inst_data.get('is_drum', False), inst_data.get('name', '')
+            )
+            for index, inst_data in enumerate(instruments)
+        }
+
+        # Собираем партии в одну композицию
+        return NoteBuffer.concatenate(parts.values()), parts
+
+    def generate(self, settings, orchestra=None, rng=None, progress=None, cancel=None):
+        """Генерирует композицию по настройкам в формате пресета.
+
+        orchestra - состав оркестра для track_type "orchestra"; если не указан,
+        берётся из settings['orchestra'] или базовый состав. При seed_type
+        "midi" генерация продолжает затравку из settings['seed_file'].
+        settings['model'] - имя или путь модели вместо активной.
+        Музыкальные правила пресета (pitch_min, pitch_max, use_scale,
+        smooth_melody, quantize_rhythm) применяются ко всем мелодическим партиям.
+        Время нот - в тиках; темп и размер композиции - из settings['bpm'] и
+        settings['time_signature'].
+        cancel - запущенный CancelToken; без него бюджет времени берётся из
+        settings['time_budget'] (с). По истечении бюджета возвращается то,
+        что успело сгенерироваться, при отмене - GenerationCancelled.
+        """
+        if cancel is None:
+            cancel = CancelToken(settings.get('time_budget')).start()
+        track_type = settings['track_type']
+        key = settings['key']
+        tempo = settings['tempo']
+        temperature = settings['temperature']
+        bpm, time_signature = tempo_from_settings(settings)
+        seed_file = settings.get('seed_file') if settings.get('seed_type') == "midi" else None
+
+        if track_type == "orchestra":
+            if orchestra is None:
+                orchestra = settings.get('orchestra') or default_orchestra()
+            notes_per_inst = settings.get('notes_per_instrument', 150)
+            if settings.get('model'):
+                # Модель пресета - для партий, где своя модель не указана
+                orchestra = [dict(inst, model=inst.get('model') or settings['model']) for inst in orchestra]
+            notes, _ = self.generate_orchestra(
+                orchestra, key, tempo, temperature, notes_per_inst, rng, progress, seed_file, settings, cancel
+            )
+            cancel.raise_if_cancelled()
+            notes.bpm, notes.time_signature = bpm, time_signature
+            return notes
+
+        instrument = parse_instrument(settings['instrument'])
+        loaded = self.model_for(settings.get('model'))
+        notes = self.generate_notes_with_model(
+            settings['num_notes'], temperature, key, tempo, track_type, rng,
+            self.prime_seed(seed_file, loaded), loaded, settings, cancel
+        )
+        cancel.raise_if_cancelled()
+        if progress:
+            progress(100)
+        return NoteBuffer.from_notes(notes, instrument, bpm=bpm, time_signature=time_signature)
+
+    def _output_filename(self, settings, output_dir=None):
+        """Резервирует уникальное имя файла для композиции"""
+        if output_dir is None:
+            output_dir = get_output_path()
+        else:
+            os.makedirs(output_dir, exist_ok=True)
+        return reserve_unique_filename(output_dir, output_prefix(settings))
+
+    def save(self, notes, settings, output_dir=None):
+        """Сохраняет композицию под уникальным именем, возвращает путь к файлу"""
+        filename = self._output_filename(settings, output_dir)
+        write_midi(notes, filename)
+        return filename
+
+    def generate_to_file(self, settings, output_dir=None, rng=None, progress=None, chunk_size=STREAM_CHUNK_NOTES,
+                         cancel=None):
+        """Потоковая генерация одной партии сразу в MIDI-файл.
+
+        Ноты генерируются фрагментами по chunk_size и дописываются в файл,
+        так что память не растёт с длиной пьесы; progress(проценты)
+        вызывается после каждого фрагмента. Возвращает MidiStreamWriter
+        закрытого файла (путь - filename, note_count, get_end_time()).
+        cancel - как в generate: по истечении бюджета файл закрывается на
+        сгенерированных нотах. При отмене или ошибке недописанный файл
+        удаляется.
+        """
+        if settings['track_type'] == "orchestra":
+            raise Exception("Потоковая генерация доступна только для одной партии, не для оркестра")
+
+        seed_file = settings.get('seed_file') if settings.get('seed_type') == "midi" else None
+        bpm, time_signature = tempo_from_settings(settings)
+        loaded = self.model_for(settings.get('model'))
+        num_notes = settings['num_notes']
+        if cancel is None:
+            cancel = CancelToken(settings.get('time_budget')).start()
+
+        filename = self._output_filename(settings, output_dir)
+        try:
+            writer = MidiStreamWriter(filename, parse_instrument(settings['instrument']), bpm=bpm,
+                                      time_signature=time_signature)
+            try:
+                for notes in self.iter_notes_with_model(
+                    num_notes, settings['temperature'], settings['key'], settings['tempo'], settings['track_type'],
+                    rng, self.prime_seed(seed_file, loaded), loaded, settings, chunk_size, cancel
+                ):
+                    writer.write_chunk(notes)
+                    if progress:
+                        progress(100 * writer.note_count / max(num_notes, 1))
+            finally:
+                writer.close()
+            cancel.raise_if_cancelled()
+        except BaseException:
+            # Недописанный файл - без конца дорожки - не оставляем в папке результатов
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            raise
+        return writer
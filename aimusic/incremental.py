@@ -0,0 +1,272 @@
+"""Инкрементальное декодирование трансформеров с KV-кэшем"""
+import numpy as np
+import tensorflow as tf
+
+layers = tf.keras.layers
+
+# Слои, которые обрабатывают каждую позицию независимо: для новой ноты их
+# достаточно применить к одной позиции
+POSITIONWISE_LAYERS = (
+    layers.Embedding,
+    layers.Dense,
+    layers.EinsumDense,
+    layers.LayerNormalization,
+    layers.Activation,
+    layers.ReLU,
+    layers.Dropout,
+)
+
+# Слои, объединяющие несколько входов поэлементно
+MERGE_LAYERS = (layers.Add, layers.Multiply)
+
+# Окон в одном вызове модели при самопроверке
+CHECK_BATCH_WINDOWS = 32
+
+
+class IncrementalDecoder:
+    """Пошаговое выполнение функциональной Keras-модели с кэшем ключей и значений.
+
+    Граф модели разбирается по слоям: позиционно-независимые слои для новой
+    ноты считаются на одной позиции, а каузальное самовнимание
+    (MultiHeadAttention с use_causal_mask=True) берёт ключи и значения
+    предыдущих нот из кэша. Прочие слои с одним входом (позиционные
+    кодировки, эмбеддинги токена и позиции) считаются позиционными: для
+    новой ноты они выполняются на окне, где нота стоит на своей позиции.
+
+    Кэш работает в одном из двух режимов:
+
+    - скользящий (sliding): в кэше последние seq_length - 1 позиций, новая
+      нота видит полное окно. Точен только для одного слоя внимания без
+      позиционных слоёв - в следующих слоях ключи старых нот зависят от нот,
+      выпавших из окна;
+    - блоками: окно заполняется от начала блока до seq_length нот, затем
+      заново заполняется последними restart_length нотами (prefill). Каждое
+      предсказание совпадает с моделью на окне от начала блока, но контекст
+      колеблется от restart_length до seq_length нот.
+
+    Если модель не удаётся разобрать (некаузальное внимание, маски, общие
+    слои, слои с несколькими входами) или результат разбора расходится с
+    самой моделью, конструктор выбрасывает исключение - сэмплер тогда
+    пересчитывает окно целиком.
+    """
+
+    def __init__(self, model, seq_length):
+        self.model = model
+        self.seq_length = seq_length
+        self.attention_layers = []
+        self.positional_layers = []
+        self._program = self._build_program(model)
+        self.sliding = len(self.attention_layers) == 1 and not self.positional_layers
+        self.cache_length = seq_length - 1 if self.sliding else seq_length
+        self.restart_length = max(1, seq_length // 2)
+        self._check_against_model()
+
+    def _build_program(self, model):
+        """Список операций (слой, имена входов, имя выхода) в порядке графа"""
+        if len(model.inputs) != 1:
+            raise ValueError("поддерживаются только модели с одним входом")
+        self._input_name = model.inputs[0].name
+        self._output_names = [tensor.name for tensor in model.outputs]
+
+        program = []
+        for layer in model.layers:
+            if isinstance(layer, layers.InputLayer):
+                continue
+            nodes = getattr(layer, '_inbound_nodes', [])
+            if len(nodes) != 1:
+                raise ValueError(f"слой {layer.name} используется в графе несколько раз")
+            node = nodes[0]
+
+            kwargs = dict(getattr(node.arguments, 'kwargs', {}) or {})
+            kwargs.pop('training', None)
+            inputs = [tensor.name for tensor in node.input_tensors]
+            outputs = [tensor.name for tensor in node.output_tensors]
+            if len(outputs) != 1:
+                raise ValueError(f"слой {layer.name} имеет несколько выходов")
+
+            if isinstance(layer, layers.MultiHeadAttention):
+                if len(set(inputs)) != 1:
+                    raise ValueError(f"{layer.name}: поддерживается только самовнимание")
+                if not kwargs.pop('use_causal_mask', False):
+                    raise ValueError(f"{layer.name}: внимание не каузальное, кэш невозможен")
+                if kwargs or tuple(layer._attention_axes) != (1,):
+                    raise ValueError(f"{layer.name}: неподдерживаемые параметры внимания")
+                self.attention_layers.append(layer)
+                kind = 'attention'
+            elif isinstance(layer, POSITIONWISE_LAYERS):
+                if kwargs or len(inputs) != 1:
+                    raise ValueError(f"{layer.name}: неподдерживаемые аргументы вызова")
+                if isinstance(layer, layers.Embedding) and layer.mask_zero:
+                    raise ValueError(f"{layer.name}: маскирование нулей не поддерживается")
+                if isinstance(layer, layers.LayerNormalization) and list(layer.axis) not in ([-1], [2]):
+                    raise ValueError(f"{layer.name}: нормализация не по последней оси")
+                kind = 'positionwise'
+            elif isinstance(layer, MERGE_LAYERS):
+                if kwargs:
+                    raise ValueError(f"{layer.name}: неподдерживаемые аргументы вызова")
+                kind = 'merge'
+            else:
+                # Позиционная кодировка и подобные слои; что выход позиции зависит
+                # только от её входа и номера, проверяет _check_against_model
+                if kwargs or len(inputs) != 1:
+                    raise ValueError(f"слой {layer.__class__.__name__} не поддерживается")
+                self.positional_layers.append(layer)
+                kind = 'positional'
+
+            program.append((kind, layer, inputs, outputs[0]))
+
+        if not self.attention_layers:
+            raise ValueError("в модели нет слоёв внимания")
+        return program
+
+    def _attend(self, layer, query, keys, values, causal, valid=None):
+        """Многоголовое внимание по спроецированным q, k, v.
+
+        valid - (keys,) bool: какие позиции кэша уже заполнены.
+        """
+        query = query * (1.0 / np.sqrt(float(layer._key_dim)))
+        scores = tf.einsum('bqhd,bkhd->bhqk', query, keys)
+        fill = tf.fill(tf.shape(scores), tf.constant(-1e9, scores.dtype))
+        if causal:
+            length = tf.shape(scores)[-1]
+            mask = tf.linalg.band_part(tf.ones((length, length), dtype=tf.bool), -1, 0)
+            scores = tf.where(mask, scores, fill)
+        if valid is not None:
+            scores = tf.where(valid[None, None, None, :], scores, fill)
+        weights = tf.nn.softmax(scores, axis=-1)
+        return layer._output_dense(tf.einsum('bhqk,bkhd->bqhd', weights, values))
+
+    def _at_position(self, x, position):
+        """Окно seq_length, в котором x (batch, 1, ...) стоит на позиции position, остальное - нули"""
+        shape = [1, self.seq_length] + [1] * (len(x.shape) - 2)
+        where = tf.reshape(tf.equal(tf.range(self.seq_length), position), shape)
+        return tf.where(where, x, tf.zeros_like(x))
+
+    def _run(self, inputs, caches=None, position=None):
+        """Выполняет граф; без кэшей - для всей последовательности (prefill)"""
+        values = {self._input_name: inputs}
+        new_caches = []
+        attention_index = 0
+
+        for kind, layer, input_names, output_name in self._program:
+            if kind == 'positionwise':
+                values[output_name] = layer(values[input_names[0]], training=False)
+            elif kind == 'merge':
+                values[output_name] = layer([values[name] for name in input_names])
+            elif kind == 'positional':
+                x = values[input_names[0]]
+                if caches is None:
+                    values[output_name] = layer(x, training=False)
+                else:
+                    output = layer(self._at_position(x, position), training=False)
+                    values[output_name] = tf.gather(output, tf.reshape(position, [1]), axis=1)
+            else:
+                x = values[input_names[0]]
+                query = layer._query_dense(x)
+                keys = layer._key_dense(x)
+                attended_values = layer._value_dense(x)
+
+                if caches is None:
+                    output = self._attend(layer, query, keys, attended_values, causal=True)
+                    if self.sliding:
+                        # Кэш хранит последние cache_length позиций окна
+                        keys, attended_values = keys[:, -self.cache_length:], attended_values[:, -self.cache_length:]
+                    else:
+                        # Буфер блока фиксированной длины, позиции после prefill пока пусты
+                        padding = [[0, 0], [0, self.cache_length - tf.shape(keys)[1]], [0, 0], [0, 0]]
+                        keys, attended_values = tf.pad(keys, padding), tf.pad(attended_values, padding)
+                else:
+                    cached_keys, cached_values = caches[2 * attention_index], caches[2 * attention_index + 1]
+                    if self.sliding:
+                        keys = tf.concat([cached_keys, keys], axis=1)
+                        attended_values = tf.concat([cached_values, attended_values], axis=1)
+                        # Новая нота видит все позиции кэша - маска не нужна
+                        output = self._attend(layer, query, keys, attended_values, causal=False)
+                        keys, attended_values = keys[:, -self.cache_length:], attended_values[:, -self.cache_length:]
+                    else:
+                        slot = tf.reshape(tf.equal(tf.range(self.cache_length), position), [1, -1, 1, 1])
+                        keys = tf.where(slot, keys, cached_keys)
+                        attended_values = tf.where(slot, attended_values, cached_values)
+                        valid = tf.range(self.cache_length) <= position
+                        output = self._attend(layer, query, keys, attended_values, causal=False, valid=valid)
+
+                new_caches += [keys, attended_values]
+                values[output_name] = output
+                attention_index += 1
+
+        outputs = [values[name] for name in self._output_names]
+        # Та же структура выходов (тензор, список или словарь), что и у модели
+        structure = getattr(self.model, '_outputs_struct', None)
+        if structure is not None:
+            outputs = tf.nest.pack_sequence_as(structure, outputs)
+        elif len(outputs) == 1:
+            outputs = outputs[0]
+        return outputs, new_caches
+
+    def prefill(self, inputs):
+        """Прогоняет окно целиком: выходы модели и кэши всех слоёв внимания.
+
+        После prefill следующая нота встаёт на позицию, равную длине окна.
+        """
+        return self._run(inputs)
+
+    def step(self, inputs, caches, position):
+        """Один шаг: inputs - только новая нота, (batch, 1[, features]), position - её позиция в блоке"""
+        return self._run(inputs, caches, position)
+
+    def needs_restart(self, position):
+        """Буфер блока заполнен: следующую ноту считает prefill последних restart_length нот"""
+        return not self.sliding and position >= self.cache_length
+
+    def cache_signature(self):
+        """TensorSpec кэшей (ключи и значения по каждому слою внимания)"""
+        specs = []
+        for layer in self.attention_layers:
+            heads = layer._num_heads
+            specs.append(tf.TensorSpec((None, self.cache_length, heads, layer._key_dim), tf.float32))
+            specs.append(tf.TensorSpec((None, self.cache_length, heads, layer._value_dim), tf.float32))
+        return specs
+
+    def _check_against_model(self):
+        """Сверяет разобранный граф с моделью на случайной последовательности.
+
+        После prefill первого окна делается 2 * seq_length шагов по тому же
+        расписанию, что и при генерации (со сбросом блоков), и выход каждого
+        шага сравнивается с моделью на окне, от которого он считается.
+        """
+        window_length = self.seq_length
+        steps = 2 * window_length
+        input_shape = self.model.inputs[0].shape
+        rng = np.random.default_rng(0)
+        # Хвост в окно длиной, чтобы окно последнего блока целиком помещалось в последовательность
+        total = 2 * window_length + steps
+        if len(input_shape) == 2:
+            sequence = rng.integers(0, 128, size=(1, total)).astype(np.int32)
+        else:
+            sequence = rng.uniform(0, 1, size=(1, total, int(input_shape[2]))).astype(np.float32)
+
+        # (выходы декодера, начало окна, позиция в окне) для каждого предсказания
+        outputs, caches = self.prefill(tf.convert_to_tensor(sequence[:, :window_length]))
+        predictions = [(outputs, 0, window_length - 1)]
+        position, start = window_length, 0
+        for index in range(window_length, window_length + steps):
+            if self.needs_restart(position):
+                start = index + 1 - self.restart_length
+                outputs, caches = self.prefill(tf.convert_to_tensor(sequence[:, start:index + 1]))
+                position = self.restart_length
+            else:
+                token = tf.convert_to_tensor(sequence[:, index:index + 1])
+                outputs, caches = self.step(token, caches, tf.constant(position, tf.int32))
+                position += 1
+                if self.sliding:
+                    start = index + 1 - window_length
+            predictions.append((outputs, start, index - start))
+
+        for first in range(0, len(predictions), CHECK_BATCH_WINDOWS):
+            chunk = predictions[first:first + CHECK_BATCH_WINDOWS]
+            windows = np.concatenate([sequence[:, start:start + window_length] for _, start, _ in chunk])
+            expected = tf.nest.flatten(self.model(windows, training=False))
+            for row, (outputs, _, offset) in enumerate(chunk):
+                for want, got in zip(expected, tf.nest.flatten(outputs)):
+                    if not np.allclose(want.numpy()[row, offset], got.numpy()[0, -1], rtol=1e-3, atol=1e-4):
+                        raise ValueError(f"шаг {first + row} расходится с моделью")
@@ -0,0 +1,182 @@
+"""Очередь заданий пакетной генерации с ограниченным пулом рабочих потоков"""
+import itertools
+import queue
+import threading
+import time
+
+import numpy as np
+
+from .cancel import CancelToken, GenerationCancelled
+from .constants import SCALES
+
+
+def sweep_settings(base, keys=None, temperatures=None, repeats=1):
+    """Развёртывает сетку параметров в список настроек для заданий.
+
+    keys - список тональностей (None - тональность пресета, "all" - все из
+    SCALES), temperatures - список температур (None - температура пресета).
+    """
+    if keys == "all":
+        keys = list(SCALES)
+    keys = keys or [base['key']]
+    temperatures = temperatures or [base['temperature']]
+
+    settings_list = []
+    for key, temperature, _ in itertools.product(keys, temperatures, range(repeats)):
+        settings = dict(base)
+        settings['key'] = key
+        settings['temperature'] = temperature
+        settings_list.append(settings)
+    return settings_list
+
+
+class GenerationJob:
+    """Одно задание генерации: настройки, зерно, токен отмены и результат"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, settings, seed=None):
+        self.id = next(self._ids)
+        self.settings = settings
+        self.seed = seed
+        self.status = "pending"  # pending, running, done, failed, cancelled
+        self.path = None
+        self.error = None
+        self.seconds = None
+        self.truncated = False  # Бюджет времени истёк - нот может быть меньше заказанного
+        self.cancel_token = CancelToken(settings.get('time_budget'))
+
+    def cancel(self):
+        """Отменяет задание: ещё не начатое пропускается, текущее прерывается"""
+        self.cancel_token.cancel()
+
+
+class JobQueue:
+    """Очередь заданий, которую обрабатывает ограниченный пул потоков.
+
+    Все рабочие потоки используют один MusicGenerator (и одну загруженную
+    модель), результаты сохраняются через get_output_path /
+    reserve_unique_filename. on_job_done(job) вызывается из рабочего
+    потока после каждого задания. timings (sweep.TimingHistory) получает
+    время каждого выполненного задания - по нему оцениваются будущие планы.
+    """
+
+    def __init__(self, generator, workers=2, output_dir=None, on_job_done=None, timings=None):
+        self.generator = generator
+        self.output_dir = output_dir
+        self.on_job_done = on_job_done
+        self.timings = timings
+        self.workers = max(1, workers)
+        self.jobs = []
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._worker, daemon=True, name=f"generation-worker-{i + 1}")
+            for i in range(self.workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, settings, seed=None):
+        """Ставит задание в очередь и возвращает его"""
+        job = GenerationJob(settings, seed)
+        with self._lock:
+            self.jobs.append(job)
+        self._queue.put(job)
+        return job
+
+    def submit_many(self, settings_list, seed=None):
+        """Ставит в очередь задания по списку настроек.
+
+        При заданном seed у i-го задания зерно [seed, i] - пакет воспроизводим.
+        """
+        return [
+            self.submit(settings, None if seed is None else [seed, index])
+            for index, settings in enumerate(settings_list)
+        ]
+
+    def counts(self, jobs=None):
+        """Количество заданий по статусам: всех или только из списка jobs (один пакет)"""
+        with self._lock:
+            statuses = [job.status for job in (self.jobs if jobs is None else jobs)]
+        return {status: statuses.count(status) for status in ("pending", "running", "done", "failed", "cancelled")}
+
+    def idle(self):
+        """Нет ни ожидающих, ни выполняющихся заданий"""
+        counts = self.counts()
+        return counts['pending'] == 0 and counts['running'] == 0
+
+    def wait(self):
+        """Ждёт завершения всех поставленных заданий"""
+        self._queue.join()
+
+    def cancel_all(self):
+        """Отменяет все незавершённые задания, включая выполняющиеся"""
+        with self._lock:
+            jobs = [job for job in self.jobs if job.status in ("pending", "running")]
+        for job in jobs:
+            job.cancel()
+
+    def shutdown(self, cancel_pending=False):
+        """Останавливает рабочие потоки после текущих заданий.
+
+        cancel_pending=True - ещё не начатые задания отменяются, а текущие
+        прерываются.
+        """
+        if cancel_pending:
+            self.cancel_all()
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                job.status = "cancelled"
+                self._queue.task_done()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _run(self, job):
+        if job.cancel_token.cancelled:
+            job.status = "cancelled"
+            return
+        job.status = "running"
+        started = time.perf_counter()
+        cancel = job.cancel_token.start()
+        try:
+            rng = np.random.default_rng(job.seed)
+            if job.settings.get('stream'):
+                writer = self.generator.generate_to_file(job.settings, self.output_dir, rng=rng, cancel=cancel)
+                job.path = writer.filename
+            else:
+                notes = self.generator.generate(job.settings, rng=rng, cancel=cancel)
+                job.path = self.generator.save(notes, job.settings, self.output_dir)
+            job.truncated = cancel.expired
+            job.status = "done"
+        except GenerationCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        job.seconds = time.perf_counter() - started
+
+        if self.timings is not None and job.status == "done" and not job.truncated:
+            active = self.generator.active
+            try:
+                self.timings.record(job.settings, job.seconds, active.path if active is not None else '')
+            except OSError:
+                pass  # История замеров необязательна
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(job)
+                if self.on_job_done:
+                    self.on_job_done(job)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,219 @@
+"""Прямая запись стандартных MIDI-файлов из NoteBuffer"""
+import os
+import struct
+
+import numpy as np
+
+from .notes import EVENT_DTYPE, NoteBuffer
+from .timing import TICKS_PER_BEAT, DEFAULT_BPM, DEFAULT_TIME_SIGNATURE, bar_ticks, ticks_to_seconds
+
+# Каналы мелодических инструментов: 10-й канал (индекс 9) занят ударными
+MELODIC_CHANNELS = [channel for channel in range(16) if channel != 9]
+
+
+def encode_variable_length(values):
+    """Векторно кодирует числа в формат переменной длины MIDI.
+
+    Возвращает матрицу байтов (n, 4) и маску используемых байтов: число
+    выравнивается по правому краю, старшие байты несут бит продолжения.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    shifts = np.array([21, 14, 7, 0], dtype=np.int64)
+    data = ((values[:, None] >> shifts) & 0x7F).astype(np.uint8)
+    data[:, :3] |= 0x80
+
+    length = 1 + (values >= 1 << 7) + (values >= 1 << 14) + (values >= 1 << 21)
+    mask = np.arange(4)[None, :] >= (4 - length)[:, None]
+    return data, mask
+
+
+class MidiFileWriter:
+    """Потоковая запись стандартного MIDI-файла (SMF, формат 1) без pretty_midi.
+
+    События дорожки кодируются пакетами и сразу пишутся в файл, длина
+    дорожки дописывается в заголовок при её закрытии.
+    """
+
+    def __init__(self, target, num_tracks, resolution=TICKS_PER_BEAT):
+        if isinstance(target, (str, os.PathLike)):
+            self.file = open(target, 'wb')
+            self._owns_file = True
+        else:
+            self.file = target
+            self._owns_file = False
+
+        self.resolution = resolution
+        self._track_start = None
+        self._last_tick = 0
+        self._running_status = None
+
+        self.file.write(b'MThd' + struct.pack('>IHHH', 6, 1, num_tracks, resolution))
+
+    def begin_track(self):
+        """Начинает новую дорожку (MTrk) с пока неизвестной длиной"""
+        self.file.write(b'MTrk\x00\x00\x00\x00')
+        self._track_start = self.file.tell()
+        self._last_tick = 0
+        self._running_status = None
+
+    def _write_event(self, tick, payload, is_meta=False):
+        """Пишет одиночное событие с абсолютным временем tick"""
+        data, mask = encode_variable_length([tick - self._last_tick])
+        self.file.write(data[mask].tobytes() + payload)
+        self._last_tick = tick
+        if is_meta:
+            self._running_status = None
+        elif payload[0] < 0xF0:
+            self._running_status = payload[0]
+
+    def write_meta(self, tick, meta_type, data=b''):
+        """Пишет мета-событие (FF type len data)"""
+        length, mask = encode_variable_length([len(data)])
+        self._write_event(tick, bytes([0xFF, meta_type]) + length[mask].tobytes() + data, is_meta=True)
+
+    def write_tempo(self, bpm, numerator=4, denominator=4):
+        """Пишет темп и размер в начало текущей дорожки"""
+        tempo = int(60_000_000 / bpm)  # Усечение, как в PrettyMIDI.write
+        self.write_meta(0, 0x51, tempo.to_bytes(3, 'big'))
+        self.write_meta(0, 0x58, bytes([numerator, int(denominator).bit_length() - 1, 24, 8]))
+
+    def write_program_change(self, channel, program):
+        """Пишет смену программы инструмента в начало дорожки"""
+        self._write_event(0, bytes([0xC0 | channel, program & 0x7F]))
+
+    def write_notes(self, events, channel):
+        """Кодирует пакет отсортированных событий EVENT_DTYPE одним проходом"""
+        if not len(events):
+            return
+
+        ticks = events['tick']
+        deltas = np.diff(ticks, prepend=self._last_tick)
+        status = 0x90 | channel
+
+        rows = np.zeros((len(events), 7), dtype=np.uint8)
+        mask = np.zeros((len(events), 7), dtype=bool)
+        rows[:, :4], mask[:, :4] = encode_variable_length(deltas)
+        rows[:, 4] = status
+        # Бегущий статус: байт статуса пишется, только если он изменился
+        mask[0, 4] = status != self._running_status
+        rows[:, 5] = events['pitch']
+        rows[:, 6] = events['velocity']
+        mask[:, 5:] = True
+
+        self.file.write(rows[mask].tobytes())
+        self._last_tick = int(ticks[-1])
+        self._running_status = status
+
+    def end_track(self, end_tick=None):
+        """Закрывает дорожку и дописывает её длину в заголовок.
+
+        end_tick - конец дорожки; если он раньше последнего события,
+        дорожка заканчивается сразу после него.
+        """
+        if end_tick is None or end_tick < self._last_tick:
+            end_tick = self._last_tick + 1
+        self.write_meta(end_tick, 0x2F)
+        end = self.file.tell()
+        self.file.seek(self._track_start - 4)
+        self.file.write(struct.pack('>I', end - self._track_start))
+        self.file.seek(end)
+
+    def close(self):
+        if self._owns_file:
+            self.file.close()
+
+
+def write_midi(notes, target, chunk_size=65536):
+    """Записывает NoteBuffer в MIDI-файл, по смыслу идентичный PrettyMIDI.write.
+
+    Тики нот пишутся как есть, темп и размер берутся из буфера. Все дорожки
+    заканчиваются на границе такта, следующей за последней нотой.
+    """
+    events = notes.to_events()
+    bounds = np.searchsorted(events['track'], np.arange(len(notes.tracks) + 1))
+    bar = bar_ticks(notes.time_signature)
+    end_tick = -(-notes.get_end_tick() // bar) * bar
+
+    writer = MidiFileWriter(target, len(notes.tracks) + 1, TICKS_PER_BEAT)
+    try:
+        # Дорожка 0 - темп и размер
+        writer.begin_track()
+        writer.write_tempo(notes.bpm, *notes.time_signature)
+        writer.end_track(end_tick)
+
+        for track_id, track_info in enumerate(notes.tracks):
+            channel = 9 if track_info.get('is_drum') else MELODIC_CHANNELS[track_id % len(MELODIC_CHANNELS)]
+
+            writer.begin_track()
+            if track_info.get('name'):
+                writer.write_meta(0, 0x03, track_info['name'].encode('latin-1', errors='replace'))
+            writer.write_program_change(channel, track_info['program'])
+            for offset in range(bounds[track_id], bounds[track_id + 1], chunk_size):
+                writer.write_notes(events[offset:min(offset + chunk_size, bounds[track_id + 1])], channel)
+            writer.end_track(end_tick)
+    finally:
+        writer.close()
+
+
+class MidiStreamWriter:
+    """Потоковая запись одной партии: фрагменты нот пишутся в файл по мере генерации.
+
+    Фрагменты должны идти по возрастанию начала нот. Сразу пишутся события
+    раньше начала последней ноты фрагмента - следующие фрагменты начнутся
+    не раньше, а note-off, выходящие за эту границу, ждут следующего
+    фрагмента. Поэтому в памяти только текущий фрагмент и звучащие ноты.
+    """
+
+    def __init__(self, target, program, is_drum=False, name='', bpm=DEFAULT_BPM,
+                 time_signature=DEFAULT_TIME_SIGNATURE):
+        self.filename = target if isinstance(target, (str, os.PathLike)) else None
+        self.channel = 9 if is_drum else MELODIC_CHANNELS[0]
+        self.time_signature = tuple(time_signature)
+        self.bpm = float(bpm)
+        self.note_count = 0
+        self.end_tick = 0
+        self._pending = np.empty(0, dtype=EVENT_DTYPE)
+
+        self.writer = MidiFileWriter(target, 2, TICKS_PER_BEAT)
+        try:
+            # Дорожка 0 - темп и размер
+            self.writer.begin_track()
+            self.writer.write_tempo(self.bpm, *self.time_signature)
+            self.writer.end_track()
+
+            self.writer.begin_track()
+            if name:
+                self.writer.write_meta(0, 0x03, name.encode('latin-1', errors='replace'))
+            self.writer.write_program_change(self.channel, program)
+        except Exception:
+            self.writer.close()
+            raise
+
+    def write_chunk(self, notes):
+        """Пишет фрагмент нот NOTE_DTYPE"""
+        if not len(notes):
+            return
+        events = np.concatenate([self._pending, NoteBuffer.from_notes(notes).to_events()])
+        events = events[np.lexsort((events['velocity'], events['pitch'], events['tick']))]
+
+        ready = events['tick'] < notes['start'][-1]
+        self.writer.write_notes(events[ready], self.channel)
+        self._pending = events[~ready]
+
+        self.note_count += len(notes)
+        self.end_tick = max(self.end_tick, int(notes['end'].max()))
+
+    def get_end_time(self):
+        """Длительность записанной партии, с"""
+        return float(ticks_to_seconds(self.end_tick, self.bpm))
+
+    def close(self):
+        """Дописывает оставшиеся события и закрывает дорожку на границе такта"""
+        try:
+            self.writer.write_notes(self._pending, self.channel)
+            self._pending = self._pending[:0]
+            bar = bar_ticks(self.time_signature)
+            self.writer.end_track(-(-self.end_tick // bar) * bar)
+        finally:
+            self.writer.close()
+
@@ -0,0 +1,133 @@
+"""Загрузка моделей TensorFlow"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import tensorflow as tf
+
+from .paths import PROJECT_DIR, temp_path_for
+
+# Преобразованная копия модели лежит рядом с файлом: model.h5 -> model.h5.aimusic/
+CONVERTED_SUFFIX = '.aimusic'
+# Если рядом с моделью писать нельзя - в кэш проекта
+CONVERTED_CACHE_DIR = os.path.join(PROJECT_DIR, 'Cache', 'models')
+CONVERTED_FORMAT = 1
+
+
+def _custom_objects():
+    return {
+        'mse': tf.keras.losses.MeanSquaredError(),
+        'keras.metrics.mse': tf.keras.metrics.MeanSquaredError(),
+        'sparse_categorical_crossentropy': tf.keras.losses.SparseCategoricalCrossentropy(),
+        'accuracy': tf.keras.metrics.Accuracy(),
+    }
+
+
+def _source_record(model_path):
+    """Что должно совпасть, чтобы преобразованная копия считалась актуальной"""
+    stat = os.stat(model_path)
+    return {
+        'format': CONVERTED_FORMAT,
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime,
+        'tensorflow': tf.__version__,
+    }
+
+
+def converted_candidates(model_path):
+    """Папки преобразованной копии: рядом с моделью и в кэше проекта"""
+    model_path = os.path.abspath(model_path)
+    path_hash = hashlib.sha256(model_path.encode('utf-8')).hexdigest()[:16]
+    return [
+        model_path + CONVERTED_SUFFIX,
+        os.path.join(CONVERTED_CACHE_DIR, f"{os.path.basename(model_path)}-{path_hash}"),
+    ]
+
+
+def load_converted(model_path):
+    """Модель из преобразованной копии или None, если копии нет или она устарела.
+
+    Архитектура строится из architecture.json, веса отображаются в память
+    (np.load с mmap_mode) и копируются сразу в переменные модели.
+    """
+    expected = _source_record(model_path)
+    for directory in converted_candidates(model_path):
+        try:
+            with open(os.path.join(directory, 'manifest.json'), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if any(manifest.get(key) != value for key, value in expected.items()):
+            continue
+
+        with open(os.path.join(directory, 'architecture.json'), 'r', encoding='utf-8') as f:
+            model = tf.keras.models.model_from_json(f.read(), custom_objects=_custom_objects())
+        weights = [
+            np.load(os.path.join(directory, 'weights', name), mmap_mode='r')
+            for name in manifest['weights']
+        ]
+        model.set_weights(weights)
+        return model, manifest
+    return None, None
+
+
+def convert_model(model, model_path, strategy):
+    """Сохраняет инференсную копию модели: архитектура, веса .npy и манифест.
+
+    strategy - способ, которым удалось загрузить исходный файл. Копия
+    пишется во временную папку и переименовывается, так что читатели
+    не видят её недописанной. Возвращает папку копии или None.
+    """
+    architecture = model.to_json()
+    weights = model.get_weights()
+    manifest = dict(_source_record(model_path), strategy=strategy,
+                    weights=[f"{index:05d}.npy" for index in range(len(weights))])
+
+    for directory in converted_candidates(model_path):
+        temp_dir = temp_path_for(directory)
+        try:
+            os.makedirs(os.path.join(temp_dir, 'weights'))
+            with open(os.path.join(temp_dir, 'architecture.json'), 'w', encoding='utf-8') as f:
+                f.write(architecture)
+            for name, value in zip(manifest['weights'], weights):
+                np.save(os.path.join(temp_dir, 'weights', name), value)
+            with open(os.path.join(temp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=4, ensure_ascii=False)
+
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(temp_dir, directory)
+            return directory
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return None
+
+
+def load_model_safe(model_path):
+    """Загрузка модели для генерации: с пользовательскими объектами и без компиляции.
+
+    При первой загрузке рядом с файлом создаётся преобразованная копия,
+    следующие загрузки берут её и не разбирают .h5.
+    """
+    try:
+        model, manifest = load_converted(model_path)
+        if model is not None:
+            return model, f"✅ Модель загружена из преобразованной копии (исходно: {manifest['strategy']})"
+    except Exception:
+        pass  # Повреждённая копия - загружаем исходный файл и перезаписываем её
+
+    try:
+        # Для генерации модель не компилируется: функции потерь и метрики не
+        # восстанавливаются, поэтому файл читается один раз
+        model = tf.keras.models.load_model(model_path, custom_objects=_custom_objects(), compile=False)
+    except Exception as e:
+        raise Exception(f"Не удалось загрузить модель.\nОшибка: {str(e)[:200]}...")
+
+    status = "✅ Модель загружена (без компиляции - для генерации она не нужна)"
+    try:
+        if convert_model(model, model_path, "load_model(compile=False)"):
+            status += ", создана преобразованная копия"
+    except Exception:
+        pass  # Архитектуру не удалось сериализовать - копия не создаётся
+    return model, status
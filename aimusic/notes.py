@@ -0,0 +1,209 @@
+"""Представление нот: структурированные массивы и колоночный NoteBuffer"""
+import numpy as np
+
+from .timing import (
+    TICKS_PER_BEAT, DEFAULT_BPM, DEFAULT_TIME_SIGNATURE,
+    seconds_to_ticks, ticks_to_seconds,
+)
+
+# Структура ноты: одна строка массива - одна нота, время - в тиках (TICKS_PER_BEAT на долю)
+NOTE_DTYPE = np.dtype([
+    ('pitch', np.uint8),
+    ('start', np.int64),
+    ('end', np.int64),
+    ('velocity', np.uint8),
+])
+
+
+def make_notes(pitch, start, end, velocity):
+    """Собирает структурированный массив нот из столбцов"""
+    notes = np.empty(len(pitch), dtype=NOTE_DTYPE)
+    notes['pitch'] = np.clip(pitch, 0, 127)
+    notes['start'] = start
+    notes['end'] = end
+    notes['velocity'] = np.clip(velocity, 1, 127)
+    return notes
+
+
+def onsets_from_steps(steps, offset=0.0):
+    """Начала нот в тиках по интервалам между ними (в секундах при REFERENCE_BPM).
+
+    Первая нота звучит в момент offset (с). В тики округляется накопленное
+    время, а не каждый шаг, поэтому ошибка округления не копится.
+    """
+    starts = np.full(len(steps), offset, dtype=np.float64)
+    np.cumsum(steps[:-1], out=starts[1:])
+    starts[1:] += offset
+    return seconds_to_ticks(starts)
+
+
+def durations_to_ticks(durations):
+    """Длительности в секундах при REFERENCE_BPM -> тики, не меньше одного"""
+    return np.maximum(seconds_to_ticks(durations), 1)
+
+
+def sample_note_chunk(num_notes, scale, rhythm_params, rng, offset=0.0):
+    """Векторно выбирает высоту, длительность, шаг и громкость для всех нот сразу.
+
+    offset - начало первой ноты, с при REFERENCE_BPM. Возвращает ноты и
+    начало следующей ноты, чтобы продолжить последовательность фрагментом.
+    """
+    pitch = rng.choice(scale, size=num_notes)
+    duration = rng.uniform(rhythm_params['duration_min'], rhythm_params['duration_max'], size=num_notes)
+    step = rng.uniform(rhythm_params['step_min'], rhythm_params['step_max'], size=num_notes)
+    velocity = rng.integers(60, 100, size=num_notes)
+
+    start = onsets_from_steps(step, offset)
+    return make_notes(pitch, start, start + durations_to_ticks(duration), velocity), offset + float(step.sum())
+
+
+def sample_note_attributes(num_notes, scale, rhythm_params, rng):
+    """Векторно выбирает высоту, длительность, шаг и громкость для всех нот сразу"""
+    return sample_note_chunk(num_notes, scale, rhythm_params, rng)[0]
+
+
+def sample_drum_pattern(drum_notes, velocity, num_hits, rng, beat_duration=TICKS_PER_BEAT):
+    """Векторно генерирует паттерн ударных: случайные ноты и варьируемый ритм.
+
+    Удары ставятся через восьмую, четверть или половинную, beat_duration - в тиках.
+    """
+    pitch = rng.choice(drum_notes, size=num_hits)
+    hit_velocity = velocity + rng.integers(-10, 10, size=num_hits)
+    step = rng.choice([TICKS_PER_BEAT // 2, TICKS_PER_BEAT, 2 * TICKS_PER_BEAT], size=num_hits)
+
+    start = np.zeros(num_hits, dtype=np.int64)
+    np.cumsum(step[:-1], out=start[1:])
+    return make_notes(pitch, start, start + beat_duration, hit_velocity)
+
+
+# Событие MIDI: note-on, velocity 0 означает note-off (как в pretty_midi)
+EVENT_DTYPE = np.dtype([
+    ('tick', np.int64),
+    ('track', np.uint16),
+    ('pitch', np.uint8),
+    ('velocity', np.uint8),
+])
+
+
+class NoteBuffer:
+    """Колоночное хранилище нот композиции.
+
+    Каждый атрибут хранится отдельным массивом NumPy, track - номер дорожки
+    в списке tracks ({'program', 'is_drum', 'name'}). Начало и конец нот -
+    целые тики; темп bpm и размер time_signature переводят их в секунды
+    только при экспорте.
+    """
+
+    def __init__(self, pitch=(), start=(), end=(), velocity=(), track=(), tracks=None,
+                 bpm=DEFAULT_BPM, time_signature=DEFAULT_TIME_SIGNATURE):
+        self.pitch = np.asarray(pitch, dtype=np.uint8)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        self.velocity = np.asarray(velocity, dtype=np.uint8)
+        self.track = np.asarray(track, dtype=np.uint16)
+        self.tracks = list(tracks or [])
+        self.bpm = float(bpm)
+        self.time_signature = tuple(time_signature)
+
+    @classmethod
+    def from_notes(cls, notes, program=0, is_drum=False, name='', bpm=DEFAULT_BPM,
+                   time_signature=DEFAULT_TIME_SIGNATURE):
+        """Создаёт буфер с одной дорожкой из массива NOTE_DTYPE"""
+        return cls(
+            notes['pitch'], notes['start'], notes['end'], notes['velocity'],
+            np.zeros(len(notes), dtype=np.uint16),
+            [{'program': int(program), 'is_drum': bool(is_drum), 'name': name}],
+            bpm, time_signature,
+        )
+
+    @classmethod
+    def concatenate(cls, buffers):
+        """Объединяет буферы, перенумеровывая их дорожки подряд (темп - первого буфера)"""
+        buffers = list(buffers)
+        tracks = []
+        track_ids = []
+        for buffer in buffers:
+            track_ids.append(buffer.track.astype(np.uint16) + len(tracks))
+            tracks.extend(buffer.tracks)
+
+        if not buffers:
+            return cls()
+        return cls(
+            np.concatenate([b.pitch for b in buffers]),
+            np.concatenate([b.start for b in buffers]),
+            np.concatenate([b.end for b in buffers]),
+            np.concatenate([b.velocity for b in buffers]),
+            np.concatenate(track_ids),
+            tracks,
+            buffers[0].bpm,
+            buffers[0].time_signature,
+        )
+
+    def __len__(self):
+        return len(self.pitch)
+
+    def __getitem__(self, index):
+        """Срез, маска или массив индексов - новый буфер с теми же дорожками"""
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 or None)
+        return NoteBuffer(
+            self.pitch[index], self.start[index], self.end[index],
+            self.velocity[index], self.track[index], self.tracks,
+            self.bpm, self.time_signature,
+        )
+
+    def track_notes(self, track_id):
+        """Ноты одной дорожки"""
+        return self[self.track == track_id]
+
+    def get_end_tick(self):
+        """Тик окончания последней ноты"""
+        return int(self.end.max()) if len(self) else 0
+
+    def get_end_time(self):
+        """Время окончания последней ноты, с"""
+        return float(ticks_to_seconds(self.get_end_tick(), self.bpm))
+
+    def to_events(self):
+        """Преобразует ноты в отсортированный массив событий EVENT_DTYPE.
+
+        Порядок совпадает с pretty_midi: по дорожке, тику, высоте и громкости,
+        так что note-off (velocity 0) не окажется после note-on той же высоты.
+        """
+        count = len(self)
+
+        events = np.empty(2 * count, dtype=EVENT_DTYPE)
+        events['tick'][:count] = self.start
+        events['tick'][count:] = self.end
+        events['track'][:count] = self.track
+        events['track'][count:] = self.track
+        events['pitch'][:count] = self.pitch
+        events['pitch'][count:] = self.pitch
+        events['velocity'][:count] = self.velocity
+        events['velocity'][count:] = 0
+
+        order = np.lexsort((events['velocity'], events['pitch'], events['tick'], events['track']))
+        return events[order]
+
+    def to_pretty_midi(self):
+        """Собирает объект pretty_midi.PrettyMIDI (по дорожке на инструмент)"""
+        import pretty_midi
+
+        midi = pretty_midi.PrettyMIDI(resolution=TICKS_PER_BEAT, initial_tempo=self.bpm)
+        midi.time_signature_changes.append(pretty_midi.TimeSignature(*self.time_signature, 0.0))
+        for track_id, track_info in enumerate(self.tracks):
+            notes = self.track_notes(track_id)
+            instrument = pretty_midi.Instrument(
+                program=track_info['program'],
+                is_drum=track_info.get('is_drum', False),
+                name=track_info.get('name', ''),
+            )
+            instrument.notes = [
+                pretty_midi.Note(velocity=velocity, pitch=pitch, start=start, end=end)
+                for pitch, start, end, velocity in zip(
+                    notes.pitch.tolist(), ticks_to_seconds(notes.start, self.bpm).tolist(),
+                    ticks_to_seconds(notes.end, self.bpm).tolist(), notes.velocity.tolist()
+                )
+            ]
+            midi.instruments.append(instrument)
+        return midi
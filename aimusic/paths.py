@@ -0,0 +1,91 @@
+"""Пути проекта: папка результатов, уникальные имена файлов и атомарная запись"""
+import os
+import threading
+from datetime import datetime
+
+# Корень проекта - папка, в которой лежит main.py
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_output_path(base_dir=None):
+    """Создает и возвращает путь к папке для сохранения файлов"""
+    # По умолчанию - папка Outputs рядом с main.py
+    outputs_dir = base_dir or os.path.join(PROJECT_DIR, 'Outputs')
+    
+    # Получаем текущую дату в формате ДД.ММ.ГГГГ
+    current_date = datetime.now().strftime('%d.%m.%Y')
+    
+    # Создаем путь к папке с датой
+    date_dir = os.path.join(outputs_dir, current_date)
+    
+    # Создаем папки, если их не существует
+    os.makedirs(date_dir, exist_ok=True)
+    
+    return date_dir
+
+
+def generate_unique_filename(base_dir, prefix="music", extension=".mid"):
+    """Генерирует уникальное имя файла"""
+    timestamp = datetime.now().strftime('%H-%M-%S')
+    counter = 1
+    
+    while True:
+        if counter == 1:
+            filename = f"{prefix}_{timestamp}{extension}"
+        else:
+            filename = f"{prefix}_{timestamp}_{counter}{extension}"
+        
+        filepath = os.path.join(base_dir, filename)
+        
+        if not os.path.exists(filepath):
+            return filepath
+        
+        counter += 1
+
+
+def reserve_unique_filename(base_dir, prefix="music", extension=".mid"):
+    """Как generate_unique_filename, но сразу создаёт пустой файл.
+
+    Создание с флагом 'x' атомарно, поэтому параллельные задания не получат
+    одно и то же имя.
+    """
+    while True:
+        filepath = generate_unique_filename(base_dir, prefix, extension)
+        try:
+            with open(filepath, 'x'):
+                return filepath
+        except FileExistsError:
+            continue
+
+
+def temp_path_for(path):
+    """Временное имя рядом с path: своё у каждого процесса и потока.
+
+    Номер процесса в имени позволяет найти и удалить файлы упавших сессий.
+    """
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def atomic_write(path, data, binary=False):
+    """Записывает файл атомарно.
+
+    data - строка, байты или функция data(file), которая пишет в открытый
+    файл (binary - открыть его в двоичном режиме). Пишем во временный файл
+    рядом и переименовываем: читатель видит либо прежний, либо новый файл
+    целиком, но не недописанный. При ошибке временный файл удаляется.
+    """
+    binary = binary or isinstance(data, bytes)
+    temp_path = temp_path_for(path)
+    try:
+        with open(temp_path, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
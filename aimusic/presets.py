@@ -0,0 +1,138 @@
+"""Пресеты генерации: встроенные и пользовательские (presets.json)"""
+import json
+import os
+import threading
+
+from .constants import DEFAULT_PRESETS
+from .paths import PROJECT_DIR, atomic_write
+
+PRESETS_FILE = os.path.join(PROJECT_DIR, 'presets.json')
+
+# Префикс пользовательских пресетов в списке интерфейса
+USER_PRESET_MARK = "👤 "
+
+
+def load_user_presets(presets_file=PRESETS_FILE):
+    """Читает пользовательские пресеты, пустой словарь, если файла нет"""
+    if not os.path.exists(presets_file):
+        return {}
+    with open(presets_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_user_presets(user_presets, presets_file=PRESETS_FILE):
+    """Сохраняет пользовательские пресеты атомарно"""
+    atomic_write(presets_file, json.dumps(user_presets, indent=4, ensure_ascii=False))
+
+
+def _file_stamp(path):
+    """Отметка версии файла (mtime, размер) или None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class PresetStore:
+    """Пользовательские пресеты в памяти.
+
+    Файл читается один раз; дальше refresh() сравнивает его mtime и размер
+    и перечитывает, только если файл изменился (другим окном или процессом),
+    сохраняя прежние объекты неизменившихся пресетов. Изменения
+    записываются атомарно через save_user_presets.
+    """
+
+    def __init__(self, presets_file=PRESETS_FILE):
+        self.presets_file = presets_file
+        self._presets = {}  # Имя -> пресет, в порядке файла
+        self._stamp = None
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        """Перечитывает файл, если он изменился; True - набор пресетов изменился"""
+        with self._lock:
+            stamp = _file_stamp(self.presets_file)
+            if self._loaded and stamp == self._stamp:
+                return False
+
+            presets = load_user_presets(self.presets_file) if stamp is not None else {}
+            # Неизменившиеся пресеты остаются теми же объектами
+            presets = {name: self._presets[name] if self._presets.get(name) == preset else preset
+                       for name, preset in presets.items()}
+            changed = not self._loaded or list(presets.items()) != list(self._presets.items())
+            self._presets = presets
+            self._stamp = stamp
+            self._loaded = True
+            return changed
+
+    def names(self):
+        with self._lock:
+            self.refresh()
+            return list(self._presets)
+
+    def get(self, name):
+        with self._lock:
+            self.refresh()
+            return self._presets.get(name)
+
+    def save(self, name, preset):
+        """Добавляет или заменяет пресет и сохраняет файл"""
+        with self._lock:
+            self.refresh()  # Не затираем пресеты, сохранённые другим процессом
+            self._presets[name] = preset
+            self._write()
+
+    def delete(self, name):
+        """Удаляет пресет; False - такого пресета нет"""
+        with self._lock:
+            self.refresh()
+            if name not in self._presets:
+                return False
+            del self._presets[name]
+            self._write()
+            return True
+
+    def _write(self):
+        save_user_presets(self._presets, self.presets_file)
+        self._stamp = _file_stamp(self.presets_file)
+
+
+def find_preset(name, presets_file=PRESETS_FILE):
+    """Ищет пресет по имени: сначала встроенные, затем пользовательские.
+
+    Имя можно указывать без эмодзи в начале ("Бас-гитара").
+    """
+    if name.startswith(USER_PRESET_MARK):
+        name = name[len(USER_PRESET_MARK):]
+
+    user_presets = load_user_presets(presets_file)
+    for presets in (DEFAULT_PRESETS, user_presets):
+        if name in presets:
+            return presets[name]
+        for preset_name, preset in presets.items():
+            if preset_name.split(' ', 1)[-1] == name:
+                return preset
+    return None
+
+
+def load_preset_file(path, name=None):
+    """Читает пресет из JSON-файла.
+
+    Файл может содержать один пресет (как его сохраняет save_preset) или
+    словарь пресетов в формате presets.json - тогда нужен name, если
+    пресетов больше одного.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if 'instrument' in data and 'track_type' in data:
+        return data
+    if name is not None:
+        if name not in data:
+            raise KeyError(f"Пресет '{name}' не найден в {path}")
+        return data[name]
+    if len(data) == 1:
+        return next(iter(data.values()))
+    raise ValueError(f"В {path} несколько пресетов, укажите имя: {', '.join(data)}")
@@ -0,0 +1,242 @@
+"""Кэш прослушивания: MIDI и отрендеренный звук по хэшу содержимого композиции.
+
+MIDI для прослушивания и экспорта собирается в памяти (io.BytesIO). На диск
+попадает только отрендеренный звук в ограниченном кэше и, если нет вывода
+звука, файл для системного плеера - во временной папке под именем
+aimusic_preview_<pid>_..., чтобы файлы упавших сессий можно было найти
+и удалить (sweep_stale_previews).
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .midi_io import write_midi
+from .paths import PROJECT_DIR, atomic_write, temp_path_for
+
+PREVIEW_CACHE_DIR = os.path.join(PROJECT_DIR, 'Cache', 'previews')
+
+# Сколько места на диске может занимать кэш прослушивания, МБ
+PREVIEW_CACHE_MB = float(os.environ.get('AIMUSIC_PREVIEW_CACHE_MB', 512))
+
+# Меняется вместе со звучанием синтезатора, чтобы не играть устаревший рендер
+RENDER_VERSION = 1
+
+# Сколько последних дублей держать в памяти в виде байтов MIDI
+MIDI_MEMORY_ITEMS = 16
+
+# Файлы системного плеера: aimusic_preview_<pid>_<хэш>.mid во временной папке
+PREVIEW_FILE_PREFIX = 'aimusic_preview_'
+
+# Файлы прослушивания старше этого удаляются, даже если не удалось проверить процесс, с
+STALE_PREVIEW_SECONDS = 24 * 3600
+
+_PREVIEW_FILE_PID = re.compile(re.escape(PREVIEW_FILE_PREFIX) + r'(\d+)_')
+_CACHE_TEMP_PID = re.compile(r'\.(\d+)\.\d+\.tmp$')
+
+
+def notes_digest(notes, sample_rate=None):
+    """SHA-256 нот, дорожек (программ), темпа и размера NoteBuffer.
+
+    sample_rate добавляется в ключ отрендеренного звука.
+    """
+    digest = hashlib.sha256()
+    for column in (notes.pitch, notes.start, notes.end, notes.velocity, notes.track):
+        digest.update(np.ascontiguousarray(column).tobytes())
+    tracks = [(int(info['program']), bool(info.get('is_drum', False))) for info in notes.tracks]
+    digest.update(repr((tracks, notes.bpm, notes.time_signature)).encode())
+    if sample_rate is not None:
+        digest.update(repr((sample_rate, RENDER_VERSION)).encode())
+    return digest.hexdigest()
+
+
+class AudioCacheWriter:
+    """Звук, дописываемый в кэш по мере рендера.
+
+    Кадры пишутся в отображённый в память файл .npy под временным именем;
+    в кэш он попадает только целиком (close(complete=True)).
+    """
+
+    def __init__(self, cache, path, total_frames):
+        self.cache = cache
+        self.path = path
+        self.temp_path = temp_path_for(path)
+        self._audio = np.lib.format.open_memmap(self.temp_path, mode='w+', dtype=np.float32,
+                                                shape=(total_frames,))
+
+    def write(self, first_frame, block):
+        self._audio[first_frame:first_frame + len(block)] = block
+
+    def close(self, complete):
+        """Фиксирует файл в кэше (complete) или удаляет недописанный"""
+        self._audio.flush()
+        del self._audio
+        if complete:
+            os.replace(self.temp_path, self.path)
+            self.cache.evict()
+        else:
+            os.remove(self.temp_path)
+
+
+class PreviewCache:
+    """Дисковый кэш прослушивания с вытеснением LRU в пределах бюджета.
+
+    Ключ - хэш нот и программ инструментов, поэтому повторное открытие
+    плеера, повторное воспроизведение и возврат к прежнему дублю не
+    сериализуют MIDI и не рендерят звук заново. Звук хранится на диске,
+    давность использования - время изменения файла, оно обновляется при
+    каждом попадании; MIDI последних дублей - в памяти.
+    """
+
+    def __init__(self, cache_dir=PREVIEW_CACHE_DIR, budget_mb=PREVIEW_CACHE_MB, temp_dir=None):
+        self.cache_dir = cache_dir
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.temp_dir = temp_dir or tempfile.gettempdir()
+        self._midi = OrderedDict()  # Хэш нот -> байты MIDI, последний - самый свежий
+        self._lock = threading.Lock()
+
+    def _path(self, digest, extension):
+        return os.path.join(self.cache_dir, f"{digest}{extension}")
+
+    def _touch(self, path):
+        """Отмечает файл как только что использованный; False - файла нет"""
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def midi_bytes(self, notes):
+        """Байты MIDI-файла композиции: сериализуются в памяти один раз на дубль"""
+        digest = notes_digest(notes)
+        with self._lock:
+            content = self._midi.get(digest)
+            if content is not None:
+                self._midi.move_to_end(digest)
+                return content
+
+        buffer = io.BytesIO()
+        write_midi(notes, buffer)
+        content = buffer.getvalue()
+        with self._lock:
+            self._midi[digest] = content
+            while len(self._midi) > MIDI_MEMORY_ITEMS:
+                self._midi.popitem(last=False)
+        return content
+
+    def preview_file(self, notes):
+        """MIDI-файл для системного плеера (только когда нет встроенного вывода звука).
+
+        Файл помечен номером процесса и удаляется remove_preview_files при
+        выходе или sweep_stale_previews после аварийного завершения.
+        """
+        path = os.path.join(self.temp_dir, f"{PREVIEW_FILE_PREFIX}{os.getpid()}_{notes_digest(notes)[:16]}.mid")
+        if not os.path.exists(path):
+            atomic_write(path, self.midi_bytes(notes))
+        return path
+
+    def remove_preview_files(self):
+        """Удаляет файлы системного плеера этого процесса"""
+        prefix = f"{PREVIEW_FILE_PREFIX}{os.getpid()}_"
+        for entry in os.scandir(self.temp_dir):
+            if entry.name.startswith(prefix):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass  # Файл ещё открыт плеером (Windows) - его уберёт следующий запуск
+
+    def open_audio(self, digest):
+        """Отрендеренный звук (только для чтения, отображён в память) или None"""
+        path = self._path(digest, '.npy')
+        if not self._touch(path):
+            return None
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+    def audio_writer(self, digest, total_frames):
+        """AudioCacheWriter для звука, который сейчас будет отрендерен"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return AudioCacheWriter(self, self._path(digest, '.npy'), total_frames)
+
+    def evict(self):
+        """Удаляет давно использованные записи, пока кэш больше бюджета"""
+        with self._lock:
+            try:
+                entries = [entry for entry in os.scandir(self.cache_dir)
+                           if entry.is_file() and not entry.name.endswith('.tmp')]
+            except FileNotFoundError:
+                return
+            entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries)
+            used = sum(size for _, size, _ in entries)
+            for _, size, path in entries[:-1]:  # Самую свежую запись оставляем, даже если она больше бюджета
+                if used <= self.budget_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    used -= size
+                except OSError:
+                    pass  # Файл читается другим плеером (Windows) - удалим в следующий раз
+
+
+def _process_alive(pid):
+    """Жив ли процесс; None - проверить нельзя (на Windows os.kill завершает процесс)"""
+    if os.name == 'nt':
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Процесс другого пользователя
+    return True
+
+
+def _stale(path, pid, now, max_age):
+    if pid == os.getpid():
+        return False
+    alive = _process_alive(pid)
+    if alive is None:
+        try:
+            return now - os.path.getmtime(path) > max_age
+        except OSError:
+            return False
+    return not alive
+
+
+def sweep_stale_previews(cache_dir=PREVIEW_CACHE_DIR, temp_dir=None, max_age=STALE_PREVIEW_SECONDS):
+    """Удаляет файлы прослушивания, оставшиеся от завершившихся процессов.
+
+    Это файлы системного плеера во временной папке и недописанный звук
+    (*.tmp) в кэше. Файлы живых процессов не трогаются; если процесс
+    проверить нельзя, удаляются файлы старше max_age. Возвращает число
+    удалённых файлов.
+    """
+    now = time.time()
+    candidates = []
+    for directory, pattern in ((temp_dir or tempfile.gettempdir(), _PREVIEW_FILE_PID), (cache_dir, _CACHE_TEMP_PID)):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            match = pattern.match(entry.name) if pattern is _PREVIEW_FILE_PID else pattern.search(entry.name)
+            if match and entry.is_file():
+                candidates.append((entry.path, int(match.group(1))))
+
+    removed = 0
+    for path, pid in candidates:
+        if _stale(path, pid, now, max_age):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
@@ -0,0 +1,274 @@
+"""Реестр загруженных моделей: кэш LRU в пределах бюджета памяти"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from .paths import PROJECT_DIR, atomic_write
+
+# Имена моделей для пресетов и партий оркестра: {"имя": "путь к .h5"}
+MODELS_FILE = os.path.join(PROJECT_DIR, 'models.json')
+
+# Сколько памяти могут занимать веса загруженных моделей, МБ
+MODEL_CACHE_MB = float(os.environ.get('AIMUSIC_MODEL_CACHE_MB', 2048))
+
+
+def load_model_names(models_file=MODELS_FILE):
+    """Читает имена моделей, пустой словарь, если файла нет"""
+    if not os.path.exists(models_file):
+        return {}
+    with open(models_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_model_names(names, models_file=MODELS_FILE):
+    """Сохраняет имена моделей атомарно"""
+    atomic_write(models_file, json.dumps(names, indent=4, ensure_ascii=False))
+
+
+def model_name(path):
+    """Имя модели по умолчанию - имя файла без расширения"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class LoadedModel:
+    """Загруженная модель с подготовленным и прогретым сэмплером"""
+
+    def __init__(self, path, mtime, on_status=None, fast_cpu=None, threads=None):
+        from .models import load_model_safe
+        from .sampler import ModelSampler
+
+        self.path = path
+        self.mtime = mtime
+        self.name = model_name(path)
+        self.primed = {}  # Хэш MIDI-затравки -> PrimedContext этой модели
+
+        self.model, self.status = load_model_safe(path)
+        try:
+            self.size_bytes = self.model.count_params() * 4  # Веса float32
+        except Exception:
+            self.size_bytes = os.path.getsize(path)
+
+        # Подготавливаем авторегрессионный сэмплер
+        try:
+            self.sampler = ModelSampler(self.model)
+            self.sampler_info = (f"авторегрессия, окно {self.sampler.seq_length} нот, "
+                                 f"словарь {self.sampler.logits_size}")
+        except Exception as e:
+            self.sampler = None
+            self.sampler_info = f"недоступна ({str(e)[:100]}), используется генерация по правилам"
+
+        # Компилируем и прогреваем шаг, чтобы первая генерация не ждала трассировки
+        self.compile_info = ""
+        if self.sampler is not None:
+            if on_status:
+                on_status("Компиляция и прогрев модели...")
+            try:
+                self.sampler.compile()
+                self.compile_info = (
+                    f"⚡ Граф: tf.function{' + XLA' if self.sampler.xla_enabled else ''}\n"
+                    f"  • Прогрев: {self.sampler.warmup_seconds * 1000:.1f} мс\n"
+                    f"  • Шаг после прогрева: {self.sampler.step_seconds * 1000:.2f} мс\n"
+                )
+                decoder = self.sampler.decoder
+                if decoder is not None:
+                    if decoder.sliding:
+                        mode = "скользящий"
+                    else:
+                        mode = f"блоками по {decoder.restart_length}-{decoder.cache_length} нот"
+                    self.compile_info += (
+                        f"  • KV-кэш: слоёв внимания - {len(decoder.attention_layers)}, {mode}, "
+                        f"шаг {self.sampler.incremental_seconds * 1000:.2f} мс\n\n"
+                    )
+                else:
+                    self.compile_info += f"  • KV-кэш: нет, пересчёт окна ({self.sampler.incremental_error})\n\n"
+            except Exception as e:
+                self.compile_info = f"⚡ Граф: недоступен, шаги выполняются без компиляции ({str(e)[:100]})\n\n"
+
+        # Быстрый режим CPU: квантованная копия, если она не хуже float32
+        self.fast_cpu = fast_cpu
+        self.fast_cpu_info = ""
+        if fast_cpu and self.sampler is not None:
+            if on_status:
+                on_status("Квантование модели...")
+            try:
+                from .fastcpu import build_fast_sampler
+                fast_sampler, self.fast_cpu_info = build_fast_sampler(
+                    self.model, self.sampler, fast_cpu, path, threads
+                )
+                if fast_sampler is not None:
+                    self.sampler = fast_sampler
+            except Exception as e:
+                self.fast_cpu_info = f"🚀 Быстрый режим CPU: недоступен ({str(e)[:100]})\n\n"
+
+    def describe(self):
+        """Текстовое описание модели для панели информации"""
+        model = self.model
+        info_text = f"📁 Путь: {self.path}\n"
+        info_text += f"🏷 Имя: {self.name}\n\n"
+        info_text += f"🔧 Статус: {self.status}\n"
+        info_text += f"🎛 Генерация: {self.sampler_info}\n\n"
+        info_text += self.compile_info
+        info_text += self.fast_cpu_info
+        info_text += f"📊 Архитектура модели:\n"
+        info_text += f"  • Количество слоёв: {len(model.layers)}\n"
+
+        # Информация о входе и выходе
+        try:
+            info_text += f"  • Входная форма: {model.input_shape}\n"
+            info_text += f"  • Выходная форма: {model.output_shape}\n"
+        except:
+            info_text += f"  • Входная/выходная форма: недоступна\n"
+
+        # Параметры модели
+        try:
+            total_params = model.count_params()
+            info_text += f"  • Всего параметров: {total_params:,}\n"
+        except:
+            info_text += f"  • Параметры: недоступно\n"
+
+        info_text += f"\n📝 Слои модели:\n"
+        for i, layer in enumerate(model.layers[:10]):  # Показываем первые 10 слоев
+            info_text += f"  {i+1}. {layer.__class__.__name__}"
+            try:
+                info_text += f" - {layer.output_shape}\n"
+            except:
+                info_text += "\n"
+
+        if len(model.layers) > 10:
+            info_text += f"  ... и ещё {len(model.layers) - 10} слоёв\n"
+
+        return info_text
+
+
+class ModelRegistry:
+    """Загруженные модели по ключу (путь, mtime, режим, потоки) с вытеснением LRU.
+
+    Повторный запрос той же модели не читает файл заново; изменённый на
+    диске файл (другой mtime) загружается как новая модель. Когда веса
+    загруженных моделей превышают бюджет, вытесняются давно не
+    использованные. Загрузка идёт вне блокировки реестра, одновременные
+    запросы одной модели ждут одну загрузку. Модели можно называть по
+    имени: сохранённые имена берутся из models.json, имена на время
+    сеанса в файл не пишутся.
+    """
+
+    def __init__(self, budget_mb=MODEL_CACHE_MB, models_file=MODELS_FILE):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.models_file = models_file
+        self._saved_names = load_model_names(models_file)  # Имя -> путь, как в models.json
+        self.names = dict(self._saved_names)  # Все имена, включая имена сеанса
+        self._models = OrderedDict()  # (путь, mtime, режим, потоки) -> LoadedModel, последняя - самая свежая
+        self._loading = {}  # Ключ -> Future загрузки, которая идёт в другом потоке
+        self._lock = threading.RLock()
+
+    def register(self, name, path, save=True):
+        """Связывает имя с файлом модели; save - записать имя в models.json.
+
+        Имя, уже занятое другим файлом, не перезаписывается - выбрасывается
+        исключение.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            if self.names.get(name, path) != path:
+                raise Exception(f"Имя '{name}' уже занято моделью {self.names[name]}")
+            self.names[name] = path
+            if save and self._saved_names.get(name) != path:
+                self._saved_names[name] = path
+                save_model_names(self._saved_names, self.models_file)
+
+    def reference(self, name_or_path):
+        """Ссылка на модель для пресета: имя из models.json или абсолютный путь.
+
+        Имена сеанса в пресет не пишутся - в другом процессе их нет.
+        """
+        with self._lock:
+            if name_or_path in self._saved_names:
+                return name_or_path
+        return self.resolve(name_or_path)
+
+    def name_of(self, path):
+        """Имя, под которым файл модели известен реестру, или None"""
+        path = os.path.abspath(path)
+        with self._lock:
+            return next((name for name, named_path in self.names.items() if named_path == path), None)
+
+    def unique_name(self, name):
+        """name или name (2), name (3)... - первое имя, ещё не занятое"""
+        with self._lock:
+            candidate, number = name, 1
+            while candidate in self.names:
+                number += 1
+                candidate = f"{name} ({number})"
+            return candidate
+
+    def resolve(self, name_or_path):
+        """Путь к файлу модели по имени или пути"""
+        if name_or_path in self.names:
+            return self.names[name_or_path]
+        if os.path.isfile(name_or_path):
+            return os.path.abspath(name_or_path)
+        raise Exception(f"Модель '{name_or_path}' не найдена")
+
+    def get(self, name_or_path, on_status=None, fast_cpu=None, threads=None):
+        """LoadedModel по имени или пути; загружает, если её нет в кэше.
+
+        fast_cpu - режим квантования (см. fastcpu.FAST_CPU_MODES) или None,
+        threads - число потоков интерпретатора быстрого режима.
+        """
+        path = self.resolve(name_or_path)
+        # Потоки задаются интерпретатору быстрого режима при создании - другое
+        # число потоков означает другой сэмплер
+        key = (path, os.path.getmtime(path), fast_cpu, threads if fast_cpu else None)
+        with self._lock:
+            loaded = self._models.get(key)
+            if loaded is not None:
+                self._models.move_to_end(key)
+                return loaded
+            pending = self._loading.get(key)
+            loading_here = pending is None
+            if loading_here:
+                pending = self._loading[key] = Future()
+
+        if not loading_here:
+            # Эту модель уже загружает другой поток - ждём его результат
+            return pending.result()
+
+        # Загрузка и прогрев идут без блокировки: другие модели тем временем
+        # выдаются из кэша и загружаются параллельно
+        try:
+            loaded = LoadedModel(path, key[1], on_status, fast_cpu, threads)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            pending.set_exception(e)
+            raise
+
+        with self._lock:
+            # Прежняя версия изменённого файла больше не нужна
+            for stale_key in [k for k in self._models if k[0] == path and k[1] != key[1]]:
+                del self._models[stale_key]
+            self._models[key] = loaded
+            self._evict(keep=key)
+            del self._loading[key]
+        pending.set_result(loaded)
+        return loaded
+
+    def _evict(self, keep):
+        """Вытесняет давно не использованные модели сверх бюджета"""
+        while self.memory_used() > self.budget_bytes and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            del self._models[oldest]
+
+    def memory_used(self):
+        """Оценка памяти весов загруженных моделей, байт"""
+        with self._lock:
+            return sum(loaded.size_bytes for loaded in self._models.values())
+
+    def loaded(self):
+        """Загруженные модели, от давно использованной к последней"""
+        with self._lock:
+            return list(self._models.values())
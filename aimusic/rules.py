@@ -0,0 +1,205 @@
+"""Музыкальные правила: тональность, диапазон, плавность мелодии и квантизация ритма.
+
+Правила применяются сразу ко всему массиву нот (NOTE_DTYPE) и могут
+использоваться как маска логитов при выборке высот моделью. Ограничения
+высот (PitchConstraints) кэшируются по тональности и диапазону.
+"""
+import functools
+
+import numpy as np
+
+from .constants import SCALES, ROLE_RANGES
+from .timing import TICKS_PER_BEAT
+
+# Наибольший скачок плавной мелодии, полутонов (квинта); шире - переносится на октаву
+MAX_JUMP = 7
+
+# Сетка квантизации начала и длительности нот, тиков (шестнадцатая)
+QUANTIZE_GRID = TICKS_PER_BEAT // 4
+
+# Добавка к логитам запрещённых высот: такие высоты не выбираются никогда
+MASK_PENALTY = -1e9
+
+
+def _read_only(array):
+    """Массив, общий для всех генераций, защищается от записи"""
+    array.setflags(write=False)
+    return array
+
+
+def scale_mask(key):
+    """Высоты 0..127, классы которых входят в тональность key"""
+    pitch_classes = np.zeros(12, dtype=bool)
+    pitch_classes[np.asarray(SCALES[key]) % 12] = True
+    return pitch_classes[np.arange(128) % 12]
+
+
+def nearest_lookup(allowed):
+    """Таблица из 128 элементов: высота -> ближайшая разрешённая (при равенстве - нижняя)"""
+    allowed_pitches = np.flatnonzero(allowed)
+    pitches = np.arange(128)
+    index = np.searchsorted(allowed_pitches, pitches)
+    lower = allowed_pitches[np.clip(index - 1, 0, len(allowed_pitches) - 1)]
+    upper = allowed_pitches[np.clip(index, 0, len(allowed_pitches) - 1)]
+    use_upper = np.abs(upper - pitches) < np.abs(pitches - lower)
+    return np.where(use_upper, upper, lower).astype(np.uint8)
+
+
+# Заранее посчитанные таблицы привязки к тональности по всему диапазону MIDI
+SCALE_LOOKUP = {key: _read_only(nearest_lookup(scale_mask(key))) for key in SCALES}
+
+
+def pitch_range(settings, role=None, use_range=True):
+    """Диапазон высот (pitch_min, pitch_max).
+
+    С use_range - из настроек, иначе (или если в настройках диапазона нет) -
+    регистр роли партии (ROLE_RANGES), а для роли без регистра - весь MIDI.
+    """
+    if not use_range or ('pitch_min' not in settings and 'pitch_max' not in settings):
+        return ROLE_RANGES.get(role, (0, 127))
+    pitch_min = int(np.clip(settings.get('pitch_min', 0), 0, 127))
+    pitch_max = int(np.clip(settings.get('pitch_max', 127), 0, 127))
+    return min(pitch_min, pitch_max), max(pitch_min, pitch_max)
+
+
+class PitchConstraints:
+    """Ограничения высот для сочетания тональности и диапазона.
+
+    Разрешённые высоты, таблица привязки и маски логитов считаются один раз
+    и не изменяются (массивы только для чтения) - объект общий для всех
+    генераций с теми же ограничениями.
+    """
+
+    def __init__(self, key, pitch_min, pitch_max):
+        self.key = key  # None - тональность не учитывается
+        self.pitch_min = pitch_min
+        self.pitch_max = pitch_max
+
+        allowed = np.zeros(128, dtype=bool)
+        allowed[pitch_min:pitch_max + 1] = True
+        if key is not None:
+            in_scale = allowed & scale_mask(key)
+            if in_scale.any():  # В диапазоне уже полутона может не быть ни одной ступени
+                allowed = in_scale
+        self.allowed = _read_only(allowed)
+        self.pitches = _read_only(np.flatnonzero(allowed))
+
+        full_range = pitch_min == 0 and pitch_max == 127
+        self.unconstrained = key is None and full_range
+        if self.unconstrained:
+            self.lookup = None
+        elif full_range:
+            self.lookup = SCALE_LOOKUP[key]
+        else:
+            self.lookup = _read_only(nearest_lookup(allowed))
+        self._masks = {}  # Размер словаря модели -> маска логитов
+
+    def logits_mask(self, logits_size=128):
+        """Добавка к логитам высот: 0 для разрешённых, MASK_PENALTY для остальных.
+
+        None, если ограничений нет. Токены за пределами 0..127 при
+        ограничениях запрещаются.
+        """
+        if self.unconstrained:
+            return None
+        mask = self._masks.get(logits_size)
+        if mask is None:
+            allowed = np.zeros(logits_size, dtype=bool)
+            size = min(logits_size, 128)
+            allowed[:size] = self.allowed[:size]
+            if not allowed.any():
+                return None
+            mask = self._masks[logits_size] = _read_only(
+                np.where(allowed, 0.0, MASK_PENALTY).astype(np.float32)
+            )
+        return mask
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_constraints(key, pitch_min, pitch_max):
+    return PitchConstraints(key, pitch_min, pitch_max)
+
+
+def pitch_constraints(settings, role=None, use_range=True):
+    """Ограничения для настроек пресета и роли партии, из кэша.
+
+    Кэш ключуется тональностью и итоговым диапазоном, в который уже
+    входят pitch_min/pitch_max или регистр роли, - одинаковые ограничения
+    разных ролей делят одни и те же таблицы и маски.
+    """
+    pitch_min, pitch_max = pitch_range(settings, role, use_range)
+    key = settings.get('key') if settings.get('use_scale') and settings.get('key') in SCALES else None
+    return _cached_constraints(key, pitch_min, pitch_max)
+
+
+def fold_into_range(pitch, pitch_min=0, pitch_max=127):
+    """Переносит ноты вне диапазона на целое число октав внутрь него.
+
+    Класс высоты сохраняется; если диапазон уже октавы и ноте в нём нет
+    места, она прижимается к границе.
+    """
+    pitch = np.asarray(pitch, dtype=np.int64)
+    pitch = pitch + 12 * np.ceil(np.maximum(pitch_min - pitch, 0) / 12).astype(np.int64)
+    pitch = pitch - 12 * np.ceil(np.maximum(pitch - pitch_max, 0) / 12).astype(np.int64)
+    return np.clip(pitch, pitch_min, pitch_max)
+
+
+def limit_jumps(pitch, max_jump=MAX_JUMP, pitch_min=0, pitch_max=127):
+    """Сглаживает мелодию: скачки шире max_jump переносятся на октаву ближе.
+
+    Интервалы сворачиваются по модулю октавы (класс высоты сохраняется),
+    мелодия восстанавливается накопленной суммой, а ноты, ушедшие из
+    диапазона, возвращаются в него через fold_into_range.
+    """
+    pitch = np.asarray(pitch, dtype=np.int64)
+    if len(pitch) < 2:
+        return pitch
+
+    interval = np.diff(pitch)
+    folded = interval - 12 * np.round(interval / 12).astype(np.int64)
+    interval = np.where(np.abs(interval) > max_jump, folded, interval)
+
+    smoothed = np.empty_like(pitch)
+    smoothed[0] = pitch[0]
+    np.cumsum(interval, out=smoothed[1:])
+    smoothed[1:] += pitch[0]
+
+    # Накопленный дрейф возвращаем в диапазон переносом на октавы
+    return fold_into_range(smoothed, pitch_min, pitch_max)
+
+
+def quantize_timing(start, end, grid=QUANTIZE_GRID):
+    """Начала и длительности нот (тики) по сетке grid; длительность не меньше шага сетки.
+
+    Округление целочисленное, к ближайшему узлу (середина - вверх).
+    """
+    quantized_start = (start + grid // 2) // grid * grid
+    duration = np.maximum((end - start + grid // 2) // grid, 1) * grid
+    return quantized_start, quantized_start + duration
+
+
+def apply_rules(notes, settings, role=None, use_range=True, previous_pitch=None):
+    """Применяет правила из настроек пресета к массиву NOTE_DTYPE.
+
+    Учитываются диапазон (см. pitch_range), use_scale, smooth_melody и
+    quantize_rhythm; отсутствующие ключи правила отключают. previous_pitch -
+    последняя нота предыдущего фрагмента: от неё отсчитывается первый
+    скачок. Возвращает новый массив.
+    """
+    notes = notes.copy()
+    if not len(notes):
+        return notes
+
+    constraints = pitch_constraints(settings, role, use_range)
+    pitch = fold_into_range(notes['pitch'], constraints.pitch_min, constraints.pitch_max)
+    if settings.get('smooth_melody'):
+        if previous_pitch is None:
+            pitch = limit_jumps(pitch, MAX_JUMP, constraints.pitch_min, constraints.pitch_max)
+        else:
+            pitch = limit_jumps(np.concatenate([[previous_pitch], pitch]), MAX_JUMP,
+                                constraints.pitch_min, constraints.pitch_max)[1:]
+    notes['pitch'] = pitch if constraints.lookup is None else constraints.lookup[pitch]
+
+    if settings.get('quantize_rhythm'):
+        notes['start'], notes['end'] = quantize_timing(notes['start'], notes['end'])
+    return notes
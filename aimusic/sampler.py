@@ -0,0 +1,450 @@
+"""Авторегрессионная генерация нот загруженной Keras-моделью"""
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .incremental import IncrementalDecoder
+
+# Шагов в одном блоке заранее вытянутого шума: память шума не растёт с числом нот
+NOISE_BLOCK_STEPS = 256
+
+
+def _to_numpy(tensors):
+    """Тензоры шага -> массивы numpy (None остаётся None)"""
+    return tuple(None if tensor is None else np.asarray(tensor) for tensor in tensors)
+
+
+class PrimedContext:
+    """Затравка, уже пропущенная через модель.
+
+    Хранит окно контекста и предсказание модели для первого шага после него.
+    Первый шаг одинаков для всех продолжений одной затравки, поэтому он
+    считается один раз и переиспользуется всеми строками пакета.
+    """
+
+    def __init__(self, window, pitch_logits, step, duration, caches=None):
+        self.window = window              # (seq_length, 3)
+        self.pitch_logits = pitch_logits  # (vocab,)
+        self.step = step                  # float или None
+        self.duration = duration
+        self.caches = caches              # KV-кэш затравки для пакета из одной строки
+
+
+class ModelSampler:
+    """Авторегрессионная генерация нот загруженной моделью.
+
+    Модель получает окно из последних seq_length нот и предсказывает следующую.
+    За один вызов модели обрабатывается целый пакет последовательностей, а
+    температура и выборка применяются сразу ко всему тензору логитов.
+    """
+
+    def __init__(self, model, vocab_size=128):
+        self.model = model
+        self.vocab_size = vocab_size
+        self._step_fn = self._sample_step  # После compile() - скомпилированный граф
+        # Граф для пакетов из нескольких строк: без XLA, чтобы новый размер пакета
+        # (число партий оркестра) не вызывал повторную компиляцию
+        self._batch_step_fn = self._sample_step
+        self.compiled = False
+        self.xla_enabled = False
+        self.warmup_seconds = None
+        self.step_seconds = None
+
+        # Инкрементальное декодирование с KV-кэшем (после compile(), если модель его допускает)
+        self.decoder = None
+        self._incremental_fn = None
+        self._incremental_batch_fn = None
+        self._prefill_fn = None  # prefill сброса блока (если кэш не скользящий)
+        self.incremental_seconds = None
+        self.incremental_error = None
+
+        input_shape = model.input_shape
+        if isinstance(input_shape, list):
+            input_shape = input_shape[0]
+        if len(input_shape) not in (2, 3) or input_shape[1] is None:
+            raise ValueError(f"Неподдерживаемая входная форма модели: {input_shape}")
+
+        self.seq_length = int(input_shape[1])
+        # (batch, seq) - токены высот, (batch, seq, features) - [pitch, step, duration]
+        self.token_input = len(input_shape) == 2
+        self.num_features = 1 if self.token_input else int(input_shape[2] or 3)
+        self.output_names = list(getattr(model, 'output_names', None) or [])
+
+        # Пробный прогон: размер словаря и наличие предсказания ритма
+        self.outputs_are_probabilities = False
+        pitch_logits, step, _ = self._forward(self._model_input(self._dummy_window(1)))
+        pitch_logits = np.asarray(pitch_logits)
+        self.logits_size = int(pitch_logits.shape[-1])
+        self.predicts_timing = step is not None
+        self.outputs_are_probabilities = bool(
+            np.all(pitch_logits >= 0) and np.allclose(pitch_logits.sum(axis=-1), 1.0, atol=1e-3)
+        )
+
+    def _dummy_window(self, batch_size):
+        """Нейтральное окно контекста: средняя высота, шаг и длительность 0.5 с"""
+        window = np.zeros((batch_size, self.seq_length, 3), dtype=np.float32)
+        window[..., 0] = 60
+        window[..., 1:] = 0.5
+        return window
+
+    def _model_input(self, window):
+        """Преобразует окно [pitch, step, duration] во входной тензор модели"""
+        if self.token_input:
+            return tf.convert_to_tensor(window[..., 0].astype(np.int32))
+
+        features = window.copy()
+        features[..., 0] /= self.vocab_size
+        if self.num_features <= 3:
+            features = features[..., :self.num_features]
+        else:
+            pad = np.zeros(window.shape[:2] + (self.num_features - 3,), dtype=np.float32)
+            features = np.concatenate([features, pad], axis=-1)
+        return tf.convert_to_tensor(features)
+
+    def _last_position(self, tensor):
+        """Оставляет предсказание для последней позиции последовательности"""
+        if tensor is None:
+            return None
+        if len(tensor.shape) == 3:
+            tensor = tensor[:, -1, :]
+        return tensor
+
+    def _forward(self, inputs):
+        """Прямой проход: логиты высоты (batch, vocab), шаг и длительность (batch,)"""
+        return self._parse_outputs(self.model(inputs, training=False))
+
+    def _parse_outputs(self, outputs):
+        """Выходы модели -> логиты высоты, шаг и длительность для последней позиции"""
+        if isinstance(outputs, (list, tuple)):
+            if len(self.output_names) == len(outputs):
+                outputs = dict(zip(self.output_names, outputs))
+            else:
+                outputs = dict(zip(['pitch', 'step', 'duration'], outputs))
+
+        if isinstance(outputs, dict):
+            pitch = outputs.get('pitch', next(iter(outputs.values())))
+            step = outputs.get('step')
+            duration = outputs.get('duration')
+        else:
+            pitch, step, duration = outputs, None, None
+
+        pitch = self._last_position(pitch)
+        if self.outputs_are_probabilities:
+            pitch = tf.math.log(pitch + 1e-9)
+
+        if step is None or duration is None:
+            return pitch, None, None
+
+        step = tf.reshape(self._last_position(step), [-1])
+        duration = tf.reshape(self._last_position(duration), [-1])
+        return pitch, tf.maximum(step, 0.0), tf.maximum(duration, 0.0)
+
+    def _sample_step(self, inputs, temperature, noise, mask):
+        """Один шаг: прямой проход и выборка высот для всего пакета.
+
+        Выборка по категориальному распределению выполняется через
+        Gumbel-max: argmax((logits + mask) / T + g), где шум g подготовлен
+        заранее, а mask (0 или MASK_PENALTY из rules) запрещает высоты вне
+        тональности, диапазона и регистра партии.
+        """
+        pitch_logits, step, duration = self._forward(inputs)
+        pitch = tf.argmax((pitch_logits + mask) / temperature + noise, axis=-1, output_type=tf.int32)
+        return pitch, step, duration
+
+    def _incremental_step(self, token, caches, position, temperature, noise, mask):
+        """Шаг с KV-кэшем: прогоняется только последняя сгенерированная нота"""
+        outputs, caches = self.decoder.step(token, caches, position)
+        pitch_logits, step, duration = self._parse_outputs(outputs)
+        pitch = tf.argmax((pitch_logits + mask) / temperature + noise, axis=-1, output_type=tf.int32)
+        return pitch, step, duration, caches
+
+    def _token_spec(self, length=1):
+        """TensorSpec length нот на входе модели (по умолчанию - одной новой)"""
+        if self.token_input:
+            return tf.TensorSpec((None, length), tf.int32)
+        return tf.TensorSpec((None, length, self.num_features), tf.float32)
+
+    def _input_signature(self):
+        """Фиксированные сигнатуры входов шага: окно, температура, шум, маска"""
+        if self.token_input:
+            window_spec = tf.TensorSpec((None, self.seq_length), tf.int32)
+        else:
+            window_spec = tf.TensorSpec((None, self.seq_length, self.num_features), tf.float32)
+        return [
+            window_spec,
+            tf.TensorSpec((), tf.float32),
+            tf.TensorSpec((None, self.logits_size), tf.float32),
+            tf.TensorSpec((None, self.logits_size), tf.float32),
+        ]
+
+    def _time_steps(self, step_fn, batch_size, steps):
+        """Среднее время одного шага на фиктивном пакете, с"""
+        inputs = self._model_input(self._dummy_window(batch_size))
+        temperature = tf.constant(1.0, dtype=tf.float32)
+        noise = tf.zeros((batch_size, self.logits_size), dtype=tf.float32)
+
+        started = time.perf_counter()
+        for _ in range(steps):
+            pitch, _, _ = step_fn(inputs, temperature, noise, noise)
+            pitch.numpy()  # Дожидаемся фактического выполнения
+        return (time.perf_counter() - started) / steps
+
+    def compile(self, batch_size=1, steps=10):
+        """Трассирует шаг выборки в граф и прогревает его на фиктивном пакете.
+
+        Сначала пробуется компиляция XLA, при ошибке - обычный tf.function.
+        Замеряет время прогрева (трассировка и первая сборка графа) и
+        установившееся время одного шага. XLA собирает граф под каждый размер
+        пакета, поэтому с XLA только пакет из одной строки; для нескольких
+        строк прогревается обычный tf.function - одна трассировка на любой
+        размер пакета.
+        """
+        last_error = None
+        for jit_compile in (True, False):
+            step_fn = tf.function(
+                self._sample_step,
+                input_signature=self._input_signature(),
+                jit_compile=jit_compile,
+            )
+            try:
+                self.warmup_seconds = self._time_steps(step_fn, batch_size, 1)
+            except Exception as e:
+                last_error = e
+                continue
+
+            self.step_seconds = self._time_steps(step_fn, batch_size, steps)
+            self._step_fn = step_fn
+            self._batch_step_fn = step_fn
+            if jit_compile:
+                self._batch_step_fn = tf.function(self._sample_step, input_signature=self._input_signature())
+                self.warmup_seconds += self._time_steps(self._batch_step_fn, 2, 1)
+            self.compiled = True
+            self.xla_enabled = jit_compile
+            self._compile_incremental(batch_size, steps)
+            return
+
+        raise Exception(f"Не удалось скомпилировать шаг генерации: {str(last_error)[:100]}")
+
+    def _compile_incremental(self, batch_size, steps):
+        """Включает KV-кэш, если граф модели удаётся разобрать.
+
+        Кэш используется, только если шаг с ним быстрее пересчёта окна. Иначе
+        decoder остаётся None (причина - в incremental_error), и каждый шаг
+        пересчитывает окно целиком.
+        """
+        try:
+            decoder = IncrementalDecoder(self.model, self.seq_length)
+        except Exception as e:
+            self.incremental_error = str(e)[:100]
+            return
+
+        self.decoder = decoder
+        cache_specs = decoder.cache_signature()
+        signature = [
+            self._token_spec(),
+            cache_specs,
+            tf.TensorSpec((), tf.int32),
+            tf.TensorSpec((), tf.float32),
+            tf.TensorSpec((None, self.logits_size), tf.float32),
+            tf.TensorSpec((None, self.logits_size), tf.float32),
+        ]
+        inputs = self._dummy_incremental_inputs(cache_specs, batch_size)
+
+        # Сброс блока: prefill последних restart_length нот, его цена
+        # распределяется на шаги до следующего сброса
+        restart_seconds = 0.0
+        if not decoder.sliding:
+            self._prefill_fn = tf.function(decoder.prefill, input_signature=[self._token_spec(decoder.restart_length)])
+            window = self._model_input(self._dummy_window(batch_size)[:, :decoder.restart_length])
+            self._prefill_fn(window)
+            started = time.perf_counter()
+            self._prefill_fn(window)[1][0].numpy()
+            restart_seconds = (time.perf_counter() - started) / (decoder.cache_length - decoder.restart_length)
+
+        for jit_compile in ((True, False) if self.xla_enabled else (False,)):
+            step_fn = tf.function(self._incremental_step, input_signature=signature, jit_compile=jit_compile)
+            try:
+                step_fn(*inputs)[0].numpy()
+            except Exception as e:
+                self.incremental_error = str(e)[:100]
+                continue
+
+            started = time.perf_counter()
+            for _ in range(steps):
+                step_fn(*inputs)[0].numpy()
+            self.incremental_seconds = (time.perf_counter() - started) / steps + restart_seconds
+            if self.incremental_seconds >= self.step_seconds:
+                # Короткое окно дешевле пересчитать целиком
+                self.incremental_error = "медленнее пересчёта окна"
+                break
+            self._incremental_fn = step_fn
+            self._incremental_batch_fn = step_fn
+            if jit_compile:
+                self._incremental_batch_fn = tf.function(self._incremental_step, input_signature=signature)
+                self._incremental_batch_fn(*self._dummy_incremental_inputs(cache_specs, 2))[0].numpy()
+            self.incremental_error = None
+            return
+
+        self.decoder = None
+        self._prefill_fn = None
+
+    def _dummy_incremental_inputs(self, cache_specs, batch_size):
+        """Фиктивные входы шага с KV-кэшем: нота, кэши, позиция, температура, шум, маска"""
+        token = self._model_input(self._dummy_window(batch_size)[:, :1])
+        caches = [tf.zeros((batch_size,) + tuple(spec.shape[1:]), tf.float32) for spec in cache_specs]
+        noise = tf.zeros((batch_size, self.logits_size), dtype=tf.float32)
+        position = tf.constant(0, dtype=tf.int32)
+        return token, caches, position, tf.constant(1.0, dtype=tf.float32), noise, noise
+
+    def _fit_context(self, context):
+        """Приводит затравку к длине окна модели"""
+        context = np.asarray(context, dtype=np.float32)
+        if context.ndim == 2:
+            context = context[None]
+        if context.shape[1] >= self.seq_length:
+            return context[:, -self.seq_length:]
+        # Короткую затравку дополняем слева её первой нотой
+        pad = np.repeat(context[:, :1], self.seq_length - context.shape[1], axis=1)
+        return np.concatenate([pad, context], axis=1)
+
+    def prime(self, context):
+        """Прогоняет затравку (length, 3) через модель один раз"""
+        window = self._fit_context(context)[:1]
+        caches = None
+        if self.decoder is not None:
+            outputs, caches = self.decoder.prefill(self._model_input(window))
+            pitch_logits, step, duration = self._parse_outputs(outputs)
+        else:
+            pitch_logits, step, duration = self._forward(self._model_input(window))
+        pitch_logits, step, duration = _to_numpy((pitch_logits, step, duration))
+        return PrimedContext(
+            window[0],
+            pitch_logits[0].astype(np.float32),
+            None if step is None else float(step[0]),
+            None if duration is None else float(duration[0]),
+            caches,
+        )
+
+    def _draw_random(self, rngs, num_steps, rhythm):
+        """Заранее готовит шум Gumbel и, если нужно, ритм для блока шагов пакета.
+
+        У каждой последовательности свой генератор, поэтому результат строки
+        не зависит от того, с какими ещё строками она попала в пакет.
+        """
+        noise = np.stack(
+            [rng.gumbel(size=(num_steps, self.logits_size)) for rng in rngs], axis=1
+        ).astype(np.float32)
+
+        if self.predicts_timing:
+            return noise, None
+
+        rhythm = rhythm or {'step_min': 0.5, 'step_max': 0.5, 'duration_min': 0.5, 'duration_max': 0.5}
+        timing = np.stack([
+            np.stack([
+                rng.uniform(rhythm['step_min'], rhythm['step_max'], size=num_steps),
+                rng.uniform(rhythm['duration_min'], rhythm['duration_max'], size=num_steps),
+            ], axis=-1)
+            for rng in rngs
+        ], axis=1).astype(np.float32)
+        return noise, timing
+
+    def generate(self, context, num_steps, temperature=1.0, rhythm=None, rng=None, logits_mask=None, stop=None):
+        """Генерирует num_steps нот для каждой последовательности пакета.
+
+        context - массив (batch, length, 3) из строк [pitch, step, duration]
+        или PrimedContext (общая затравка для всех строк пакета), rhythm -
+        диапазоны шага и длительности на случай, если модель предсказывает
+        только высоту, rng - генератор или список генераторов
+        по одному на строку пакета. logits_mask - добавка к логитам высот
+        (PitchConstraints.logits_mask): общая (logits_size,) или своя для
+        каждой строки (batch, logits_size). Маска передаётся в граф один раз
+        и складывается с логитами на устройстве, так что шаг - это ровно один
+        прямой проход при любых ограничениях. stop() проверяется перед каждым
+        шагом: если он вернул True, генерация прерывается. Возвращает массив
+        (batch, число сгенерированных нот, 3) - num_steps, если не прервана.
+        """
+        primed = context if isinstance(context, PrimedContext) else None
+        if primed is not None:
+            batch_size = len(rng) if isinstance(rng, (list, tuple)) else 1
+            context = np.broadcast_to(primed.window, (batch_size,) + primed.window.shape)
+        else:
+            context = self._fit_context(context)
+            batch_size = context.shape[0]
+
+        if rng is None:
+            rng = np.random.default_rng()
+        rngs = list(rng) if isinstance(rng, (list, tuple)) else [rng] * batch_size
+        if len(rngs) != batch_size:
+            raise ValueError(f"Ожидалось {batch_size} генераторов случайных чисел, получено {len(rngs)}")
+
+        # Окно фиксированного размера скользит по заранее выделенному буферу
+        history = np.empty((batch_size, self.seq_length + num_steps, 3), dtype=np.float32)
+        history[:, :self.seq_length] = context
+
+        temperature = tf.constant(max(float(temperature), 1e-3), dtype=tf.float32)
+        if logits_mask is None:
+            mask = np.zeros((batch_size, self.logits_size), dtype=np.float32)
+        else:
+            mask = np.broadcast_to(np.asarray(logits_mask, dtype=np.float32), (batch_size, self.logits_size))
+        mask_tensor = tf.constant(mask)
+
+        # Предсказание для первой ноты: из затравки или из prefill кэша;
+        # position - место следующей ноты в блоке кэша
+        first, caches = None, None
+        position = self.seq_length
+        if primed is not None:
+            first = (primed.pitch_logits, primed.step, primed.duration)
+            if self._incremental_fn is not None and primed.caches is not None:
+                caches = [tf.repeat(cache, batch_size, axis=0) for cache in primed.caches]
+        elif self._incremental_fn is not None:
+            outputs, caches = self.decoder.prefill(self._model_input(context))
+            first = _to_numpy(self._parse_outputs(outputs))
+
+        step_fn = self._step_fn if batch_size == 1 else self._batch_step_fn
+        incremental_fn = self._incremental_fn if batch_size == 1 else self._incremental_batch_fn
+        generated = num_steps
+        for i in range(num_steps):
+            if stop is not None and stop():
+                generated = i
+                break
+
+            block_step = i % NOISE_BLOCK_STEPS
+            if block_step == 0:
+                noise, timing = self._draw_random(rngs, min(NOISE_BLOCK_STEPS, num_steps - i), rhythm)
+
+            row = history[:, self.seq_length + i]
+            if i == 0 and first is not None:
+                # Предсказание для затравки уже посчитано - остаётся только выборка
+                pitch_logits, step, duration = first
+                pitch = np.argmax((pitch_logits + mask) / temperature.numpy() + noise[0], axis=-1)
+            elif caches is not None and self.decoder.needs_restart(position):
+                # Блок кэша заполнен: заново заполняем его последними нотами
+                restart = self.decoder.restart_length
+                window = history[:, self.seq_length + i - restart:self.seq_length + i]
+                outputs, caches = self._prefill_fn(self._model_input(window))
+                pitch_logits, step, duration = _to_numpy(self._parse_outputs(outputs))
+                pitch = np.argmax((pitch_logits + mask) / temperature.numpy() + noise[block_step], axis=-1)
+                position = restart
+            elif caches is not None:
+                # KV-кэш: на вход идёт только предыдущая сгенерированная нота
+                token = self._model_input(history[:, self.seq_length + i - 1:self.seq_length + i])
+                *outputs, caches = incremental_fn(
+                    token, caches, tf.constant(position, dtype=tf.int32), temperature, noise[block_step], mask_tensor
+                )
+                pitch, step, duration = _to_numpy(outputs)
+                position += 1
+            else:
+                window = history[:, i:i + self.seq_length]
+                pitch, step, duration = _to_numpy(
+                    step_fn(self._model_input(window), temperature, noise[block_step], mask_tensor)
+                )
+
+            row[:, 0] = np.minimum(pitch, 127)
+            if timing is None:
+                row[:, 1] = step
+                row[:, 2] = duration
+            else:
+                row[:, 1:] = timing[block_step]
+
+        return history[:, self.seq_length:self.seq_length + generated]
@@ -0,0 +1,75 @@
+"""Затравка из MIDI-файла: разбор, токенизация и дисковый кэш"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from .paths import PROJECT_DIR, atomic_write
+
+# Токены затравок хранятся по хэшу содержимого MIDI-файла
+SEED_CACHE_DIR = os.path.join(PROJECT_DIR, 'Cache', 'seeds')
+
+_memory_cache = {}  # Хэш файла -> токены, на время работы процесса
+_memory_lock = threading.Lock()
+
+
+def file_digest(path):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenize_midi(path):
+    """Разбирает MIDI-файл в строки модели [pitch, step, duration].
+
+    Берутся ноты всех мелодических инструментов, упорядоченные по началу;
+    step - интервал от начала предыдущей ноты (у первой 0), как при обучении.
+    """
+    import pretty_midi
+
+    midi = pretty_midi.PrettyMIDI(path)
+    notes = [
+        (note.start, note.pitch, note.end)
+        for instrument in midi.instruments if not instrument.is_drum
+        for note in instrument.notes
+    ]
+    if not notes:
+        raise Exception(f"В файле затравки нет мелодических нот: {os.path.basename(path)}")
+
+    notes = np.array(sorted(notes), dtype=np.float64)
+    tokens = np.empty((len(notes), 3), dtype=np.float32)
+    tokens[:, 0] = notes[:, 1]
+    tokens[0, 1] = 0.0
+    tokens[1:, 1] = np.diff(notes[:, 0])
+    tokens[:, 2] = notes[:, 2] - notes[:, 0]
+    return tokens
+
+
+def load_seed_tokens(path, cache_dir=None):
+    """Токены затравки; файл разбирается только при первом обращении.
+
+    Возвращает (digest, tokens). Повторные вызовы для файла с тем же
+    содержимым берут токены из памяти или из cache_dir/<sha256>.npy.
+    """
+    digest = file_digest(path)
+    with _memory_lock:
+        tokens = _memory_cache.get(digest)
+    if tokens is not None:
+        return digest, tokens
+
+    cache_dir = cache_dir or SEED_CACHE_DIR
+    cache_path = os.path.join(cache_dir, f"{digest}.npy")
+    try:
+        tokens = np.load(cache_path)
+    except (OSError, ValueError):
+        tokens = tokenize_midi(path)
+        os.makedirs(cache_dir, exist_ok=True)
+        atomic_write(cache_path, lambda file: np.save(file, tokens), binary=True)
+
+    with _memory_lock:
+        _memory_cache[digest] = tokens
+    return digest, tokens
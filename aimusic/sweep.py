@@ -0,0 +1,241 @@
+"""Сетки пресетов: развёртывание в план заданий, дедупликация, порядок и оценка времени.
+
+Спецификация сетки - JSON-словарь: пресет и оси, по которым он
+развёртывается, например
+{"preset": "Бас-гитара", "keys": "all", "temperatures": {"start": 0.8, "stop": 1.2, "step": 0.2},
+ "tempos": ["Умеренно", "Быстро"], "num_notes": [200, 400], "pitch_ranges": [[28, 55], [36, 60]],
+ "repeat": 2}
+"""
+import itertools
+import json
+import math
+import os
+import threading
+
+from .constants import SCALES, RHYTHMS, DEFAULT_ORCHESTRA
+from .paths import PROJECT_DIR, atomic_write
+from .registry import load_model_names, model_name
+
+# Прошлые замеры времени заданий: секунды на ноту по модели и типу партии
+TIMINGS_FILE = os.path.join(PROJECT_DIR, 'Cache', 'timings.json')
+
+# Вес нового замера в скользящем среднем
+TIMING_SMOOTHING = 0.3
+
+
+def expand_values(value, choices=None):
+    """Значения одной оси сетки.
+
+    value - список, одно значение, "all" (все choices) или диапазон
+    {"start", "stop", "step"} с обоими концами. None - ось не задана.
+    """
+    if value is None:
+        return [None]
+    if value == "all" and choices is not None:
+        return list(choices)
+    if isinstance(value, dict):
+        start, stop, step = value['start'], value['stop'], value.get('step', 1)
+        if step <= 0:
+            raise Exception(f"Шаг диапазона должен быть больше нуля: {value}")
+        count = math.floor((stop - start) / step + 1e-9) + 1
+        return [round(start + index * step, 6) for index in range(max(count, 0))]
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _check_choices(values, choices, what):
+    for value in values:
+        if value is not None and value not in choices:
+            raise Exception(f"Неизвестное значение ({what}): {value}")
+
+
+def expand_sweep(base, spec):
+    """Развёртывает пресет base по осям spec в список настроек (без повторов repeat)"""
+    keys = expand_values(spec.get('keys'), SCALES)
+    temperatures = expand_values(spec.get('temperatures'))
+    tempos = expand_values(spec.get('tempos'), RHYTHMS)
+    num_notes = expand_values(spec.get('num_notes'))
+    pitch_ranges = spec.get('pitch_ranges') or [None]
+    if pitch_ranges[0] is not None and not isinstance(pitch_ranges[0], (list, tuple)):
+        pitch_ranges = [pitch_ranges]  # Один диапазон [от, до]
+    _check_choices(keys, SCALES, "тональность")
+    _check_choices(tempos, RHYTHMS, "темп")
+
+    settings_list = []
+    for key, temperature, tempo, notes, pitch_range in itertools.product(
+        keys, temperatures, tempos, num_notes, pitch_ranges
+    ):
+        settings = dict(base)
+        if key is not None:
+            settings['key'] = key
+        if temperature is not None:
+            settings['temperature'] = float(temperature)
+        if tempo is not None:
+            settings['tempo'] = tempo
+        if notes is not None:
+            settings['num_notes'] = settings['notes_per_instrument'] = int(notes)
+        if pitch_range is not None:
+            settings['pitch_min'], settings['pitch_max'] = int(min(pitch_range)), int(max(pitch_range))
+        settings_list.append(settings)
+    return settings_list
+
+
+def uses_model(settings, default_model=''):
+    """Генерирует ли задание хоть одну партию моделью.
+
+    default_model - модель, которая используется без ключа "model" в
+    настройках (активная). Ударные партии оркестра всегда по правилам.
+    """
+    model = settings.get('model') or default_model
+    orchestra = settings.get('orchestra')
+    if settings['track_type'] != "orchestra" or not orchestra:
+        return bool(model)  # Базовый состав оркестра - без ударных
+    return any(inst.get('model') or model for inst in orchestra if not inst.get('is_drum', False))
+
+
+def job_signature(settings, default_model=''):
+    """Канонический ключ задания: только настройки, которые влияют на результат"""
+    effective = dict(settings)
+    if not uses_model(settings, default_model):
+        # Генерация по правилам температуру не использует
+        effective.pop('temperature', None)
+    if settings['track_type'] == "orchestra":
+        # Партии оркестра берут регистр своей роли, а не диапазон и число нот пресета
+        for name in ('pitch_min', 'pitch_max', 'num_notes'):
+            effective.pop(name, None)
+    else:
+        effective.pop('notes_per_instrument', None)
+        effective.pop('orchestra', None)
+    if effective.get('seed_type') != "midi":
+        effective.pop('seed_file', None)
+    return json.dumps(effective, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def reuse_key(settings):
+    """Порядок в плане: сначала модель (не вытесняется из реестра), затем
+    ограничения высот (одни PitchConstraints из кэша rules), затем прочее"""
+    orchestra = settings['track_type'] == "orchestra"
+    return (
+        str(settings.get('model') or ''),
+        settings['track_type'],
+        settings['key'] if settings.get('use_scale') else '',
+        0 if orchestra else settings.get('pitch_min', 0),
+        0 if orchestra else settings.get('pitch_max', 127),
+        settings['key'],
+        settings['tempo'],
+        total_notes(settings),
+        settings['temperature'],
+    )
+
+
+def total_notes(settings):
+    """Сколько нот генерирует задание (для оркестра - по всем партиям)"""
+    if settings['track_type'] == "orchestra":
+        parts = len(settings.get('orchestra') or DEFAULT_ORCHESTRA)
+        return settings.get('notes_per_instrument', 150) * parts
+    return settings['num_notes']
+
+
+class TimingHistory:
+    """Прошлые замеры заданий: скользящее среднее секунд на ноту.
+
+    Ключ - модель, тип партии и режим записи; модель без имени в настройках
+    - default_model (активная), без модели - генерация по правилам. Имя
+    модели сводится к имени её файла через model_names (имя -> путь, по
+    умолчанию models.json), так что замер под именем и оценка по пути
+    попадают в один ключ.
+    """
+
+    def __init__(self, path=TIMINGS_FILE, model_names=None):
+        self.path = path
+        self.model_names = load_model_names() if model_names is None else model_names
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.per_note = json.load(f)
+        except (OSError, ValueError):
+            self.per_note = {}
+
+    def _key(self, settings, default_model=''):
+        model = settings.get('model') or default_model
+        model = model_name(self.model_names.get(model, str(model))) if model else "rules"
+        mode = "stream" if settings.get('stream') else "buffer"
+        return f"{model}|{settings['track_type']}|{mode}"
+
+    def record(self, settings, seconds, default_model=''):
+        """Добавляет замер выполненного задания и сохраняет историю"""
+        notes = total_notes(settings)
+        if not notes or seconds is None:
+            return
+        key = self._key(settings, default_model)
+        with self._lock:
+            previous = self.per_note.get(key)
+            value = seconds / notes
+            if previous is not None:
+                value = previous + TIMING_SMOOTHING * (value - previous)
+            self.per_note[key] = value
+
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            atomic_write(self.path, json.dumps(self.per_note, indent=4, ensure_ascii=False))
+
+    def estimate(self, settings, default_model=''):
+        """Ожидаемое время задания, с, или None, если замеров ещё не было"""
+        per_note = self.per_note.get(self._key(settings, default_model))
+        return None if per_note is None else per_note * total_notes(settings)
+
+
+class SweepPlan:
+    """План сетки: уникальные задания в порядке переиспользования модели и ограничений.
+
+    Одинаковые по job_signature точки сетки сливаются в одну, затем каждая
+    повторяется spec['repeat'] раз. settings_list передаётся в
+    JobQueue.submit_many - задания выполняются тем же путём генерации, что
+    и кнопка "Генерировать".
+    """
+
+    def __init__(self, base, spec, timings=None, default_model=''):
+        expanded = expand_sweep(base, spec)
+        unique = {}
+        for settings in expanded:
+            unique.setdefault(job_signature(settings, default_model), settings)
+
+        self.expanded = len(expanded)
+        self.duplicates = len(expanded) - len(unique)
+        self.repeat = max(1, int(spec.get('repeat', 1)))
+        points = sorted(unique.values(), key=reuse_key)
+        self.settings_list = [settings for settings in points for _ in range(self.repeat)]
+        self.estimates = [
+            timings.estimate(settings, default_model) if timings is not None else None
+            for settings in self.settings_list
+        ]
+
+    def __len__(self):
+        return len(self.settings_list)
+
+    def model_switches(self):
+        """Сколько раз задания подряд используют разные модели"""
+        models = [str(settings.get('model') or '') for settings in self.settings_list]
+        return sum(1 for previous, current in zip(models, models[1:]) if previous != current)
+
+    def estimated_seconds(self, workers=1):
+        """Оценка общего времени, с, или None без замеров.
+
+        Задания без замеров считаются по среднему известных; время делится
+        на число рабочих потоков, так что это оценка снизу.
+        """
+        known = [estimate for estimate in self.estimates if estimate is not None]
+        if not known:
+            return None
+        total = sum(known) / len(known) * len(self.estimates)
+        return total / max(1, workers)
+
+    def describe(self, workers=1):
+        """Сводка плана для вывода перед запуском"""
+        text = (f"📋 План: заданий {len(self)} (точек сетки {self.expanded}, "
+                f"дубликатов убрано {self.duplicates}, повторов {self.repeat}), "
+                f"смен модели {self.model_switches()}")
+        seconds = self.estimated_seconds(workers)
+        if seconds is None:
+            return text + "\n⏱ Оценка времени: нет прошлых замеров"
+        return text + f"\n⏱ Оценка времени: ~{seconds:.0f} с при {workers} рабочих потоках"
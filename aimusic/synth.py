@@ -0,0 +1,333 @@
+"""Встроенный синтезатор: волновые таблицы, рендер блоками в кольцевой буфер.
+
+Композиция (NoteBuffer) озвучивается без внешнего плеера: фоновый поток
+рендерит блоки звука в кольцевой буфер, а звуковое устройство забирает их
+оттуда. Вывод звука - через sounddevice, если он установлен.
+"""
+import threading
+import time
+
+import numpy as np
+
+from .preview import notes_digest
+from .timing import ticks_to_seconds
+
+SAMPLE_RATE = 44100
+
+# Кадров в блоке рендера: ~23 мс при 44.1 кГц - столько ждёт первый звук
+BLOCK_FRAMES = 1024
+
+# Ёмкость кольцевого буфера, с: рендер опережает воспроизведение не больше чем на столько
+RING_SECONDS = 2.0
+
+# Отсчётов в одном периоде волновой таблицы
+TABLE_SIZE = 2048
+
+# Атака и затухание после конца ноты, с
+ATTACK_SECONDS = 0.005
+RELEASE_SECONDS = 0.08
+
+# Громкость одной ноты при velocity 127: запас на многоголосие до мягкого ограничения
+NOTE_GAIN = 0.25
+
+# Гармоники тембров по семействам General MIDI (программа // 8) и время
+# затухания ноты, с (None - звучит ровно до конца ноты)
+FAMILY_TIMBRES = {
+    0: ((1.0, 0.5, 0.3, 0.2, 0.1, 0.05), 1.5),                  # Фортепиано
+    1: ((1.0, 0.0, 0.4, 0.0, 0.2), 0.6),                        # Хроматическая перкуссия
+    2: ((1.0, 1.0, 0.6, 0.8, 0.3, 0.4, 0.2, 0.3), None),        # Орган
+    3: ((1.0, 0.6, 0.4, 0.25, 0.15, 0.1), 1.0),                 # Гитара
+    4: ((1.0, 0.6, 0.2, 0.1), 1.2),                             # Бас
+    5: (tuple(1.0 / k for k in range(1, 13)), None),            # Струнные
+    6: (tuple(0.8 / k for k in range(1, 9)), None),             # Ансамбль
+    7: ((1.0, 0.8, 0.6, 0.5, 0.4, 0.3, 0.2), None),             # Медные
+    8: ((1.0, 0.0, 0.5, 0.0, 0.3, 0.0, 0.2), None),             # Язычковые
+    9: ((1.0, 0.1, 0.05), None),                                # Флейты
+    10: (tuple(1.0 / k if k % 2 else 0.0 for k in range(1, 16)), None),  # Синт-соло
+    11: ((1.0, 0.4, 0.2, 0.1), None),                           # Синт-пэды
+}
+DEFAULT_TIMBRE = ((1.0, 0.3, 0.1), None)
+
+# Ударные: шум с быстрым затуханием, бочка (35, 36) - низкий синус
+DRUM_DECAY_SECONDS = 0.12
+KICK_PITCHES = (35, 36)
+KICK_FREQUENCY = 55.0
+
+
+def _harmonic_table(amplitudes):
+    """Один период волны из гармоник с амплитудами amplitudes, пик - 1"""
+    phase = np.arange(TABLE_SIZE) * (2 * np.pi / TABLE_SIZE)
+    wave = sum(amplitude * np.sin((k + 1) * phase) for k, amplitude in enumerate(amplitudes))
+    return wave / np.abs(wave).max()
+
+
+def _build_tables():
+    """Таблицы всех тембров одним массивом (тембр, отсчёт) и их времена затухания"""
+    timbres = [FAMILY_TIMBRES.get(family, DEFAULT_TIMBRE) for family in range(16)]
+    tables = [_harmonic_table(harmonics) for harmonics, _ in timbres]
+    decays = [decay for _, decay in timbres]
+
+    # Шум ударных и синус бочки - две последние таблицы
+    tables.append(np.random.default_rng(0).uniform(-1.0, 1.0, TABLE_SIZE))
+    tables.append(_harmonic_table((1.0,)))
+    decays += [DRUM_DECAY_SECONDS, DRUM_DECAY_SECONDS * 2]
+
+    tables = np.stack(tables).astype(np.float32)
+    # Лишний отсчёт в конце - для линейной интерполяции без взятия по модулю
+    return np.concatenate([tables, tables[:, :1]], axis=1), decays
+
+
+WAVETABLES, TABLE_DECAYS = _build_tables()
+NOISE_TABLE = len(WAVETABLES) - 2
+KICK_TABLE = len(WAVETABLES) - 1
+
+
+class WavetableSynth:
+    """Векторный синтезатор на волновых таблицах.
+
+    Ноты заранее переводятся в кадры, частоты и номера таблиц; блок
+    рендерится одной матрицей (нота, кадр) из нот, звучащих в этом блоке.
+    """
+
+    def __init__(self, notes, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        order = np.argsort(notes.start, kind='stable')
+
+        seconds_start = ticks_to_seconds(notes.start[order], notes.bpm)
+        seconds_end = ticks_to_seconds(notes.end[order], notes.bpm)
+        self.start = np.rint(seconds_start * sample_rate).astype(np.int64)
+        self.end = np.maximum(np.rint(seconds_end * sample_rate).astype(np.int64), self.start + 1)
+
+        pitch = notes.pitch[order].astype(np.float64)
+        track = notes.track[order]
+        programs = np.array([info['program'] for info in notes.tracks] or [0], dtype=np.int64)
+        drums = np.array([info.get('is_drum', False) for info in notes.tracks] or [False])
+        is_drum = drums[track]
+
+        self.table = np.where(is_drum, NOISE_TABLE, programs[track] // 8)
+        self.table[is_drum & np.isin(pitch, KICK_PITCHES)] = KICK_TABLE
+        frequency = 440.0 * 2 ** ((pitch - 69) / 12)
+        frequency[is_drum] = np.where(self.table[is_drum] == KICK_TABLE, KICK_FREQUENCY, 1000.0)
+        self.increment = frequency * TABLE_SIZE / sample_rate  # Шаг по таблице за кадр
+        self.gain = notes.velocity[order] / 127.0 * NOTE_GAIN
+
+        # Затухание: у ударных и "щипковых" тембров нота гаснет и до своего конца
+        decay = np.array([np.inf if d is None else d for d in TABLE_DECAYS])[self.table]
+        self.decay_frames = decay * sample_rate
+        self.release_frames = RELEASE_SECONDS * sample_rate
+        self.attack_frames = max(ATTACK_SECONDS * sample_rate, 1.0)
+
+        # Нота слышна до конца затухания после её окончания
+        self.audible_end = self.end + int(5 * self.release_frames)
+        self.max_audible = int((self.audible_end - self.start).max()) if len(self.start) else 0
+        self.total_frames = int(self.audible_end.max()) if len(self.start) else 0
+
+    def render(self, first_frame, frames):
+        """Блок звука [first_frame, first_frame + frames): моно float32 в -1..1"""
+        block_end = first_frame + frames
+        low = np.searchsorted(self.start, first_frame - self.max_audible, side='left')
+        high = np.searchsorted(self.start, block_end, side='left')
+        active = np.arange(low, high)
+        active = active[self.audible_end[active] > first_frame]
+        if not len(active):
+            return np.zeros(frames, dtype=np.float32)
+
+        # Кадры блока относительно начала каждой ноты: матрица (нота, кадр)
+        offset = np.arange(first_frame, block_end, dtype=np.float64)[None, :] - self.start[active, None]
+        sounding = offset >= 0
+        offset = np.maximum(offset, 0.0)
+
+        position = offset * self.increment[active, None] % TABLE_SIZE
+        index = position.astype(np.int64)
+        fraction = (position - index).astype(np.float32)
+        table = WAVETABLES[self.table[active, None], index]
+        table_next = WAVETABLES[self.table[active, None], index + 1]
+        wave = table + (table_next - table) * fraction
+
+        envelope = np.minimum(offset / self.attack_frames, 1.0)
+        envelope *= np.exp(-offset / self.decay_frames[active, None])
+        after_end = offset - (self.end[active] - self.start[active])[:, None]
+        envelope *= np.where(after_end > 0, np.exp(-np.maximum(after_end, 0.0) / self.release_frames), 1.0)
+        envelope *= sounding
+
+        mix = (wave * (envelope * self.gain[active, None])).sum(axis=0)
+        return np.tanh(mix).astype(np.float32)  # Мягкое ограничение вместо щелчков при перегрузке
+
+
+class RingBuffer:
+    """Кольцевой буфер кадров между потоком рендера и звуковым устройством.
+
+    write() ждёт, пока освободится место; read() не ждёт никогда - если
+    данных не хватает, недостающие кадры заполняются тишиной.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity, dtype=np.float32)
+        self.written = 0  # Кадров записано всего
+        self.read_frames = 0  # Кадров прочитано всего
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def available(self):
+        with self._condition:
+            return self.written - self.read_frames
+
+    def write(self, block):
+        """Записывает блок, ожидая места; False - буфер закрыт"""
+        with self._condition:
+            while self.capacity - (self.written - self.read_frames) < len(block) and not self.closed:
+                self._condition.wait()
+            if self.closed:
+                return False
+            start = self.written % self.capacity
+            first = min(len(block), self.capacity - start)
+            self._data[start:start + first] = block[:first]
+            self._data[:len(block) - first] = block[first:]
+            self.written += len(block)
+            self._condition.notify_all()
+            return True
+
+    def read(self, out):
+        """Заполняет out доступными кадрами, остаток - тишиной; возвращает число кадров"""
+        with self._condition:
+            count = min(len(out), self.written - self.read_frames)
+            start = self.read_frames % self.capacity
+            first = min(count, self.capacity - start)
+            out[:first] = self._data[start:start + first]
+            out[first:count] = self._data[:count - first]
+            out[count:] = 0.0
+            self.read_frames += count
+            self._condition.notify_all()
+            return count
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+def _sounddevice():
+    """Модуль sounddevice или None, если он не установлен"""
+    try:
+        import sounddevice
+    except (ImportError, OSError):  # OSError - нет библиотеки PortAudio
+        return None
+    return sounddevice
+
+
+def audio_output_available():
+    """Есть ли вывод звука для встроенного синтезатора"""
+    return _sounddevice() is not None
+
+
+class SynthPlayer:
+    """Воспроизведение композиции встроенным синтезатором.
+
+    Поток рендера заполняет кольцевой буфер блоками BLOCK_FRAMES, поток
+    звукового устройства забирает их оттуда. Позиции воспроизведения и
+    рендера - настоящие, в кадрах (played_seconds, rendered_seconds);
+    first_sound_ms - сколько прошло от play() до первого блока со звуком.
+    cache - preview.PreviewCache: звук, уже отрендеренный для тех же нот,
+    берётся из него, а новый рендер дописывается туда по ходу.
+    """
+
+    def __init__(self, notes, sample_rate=SAMPLE_RATE, block_frames=BLOCK_FRAMES, ring_seconds=RING_SECONDS,
+                 cache=None):
+        self.synth = WavetableSynth(notes, sample_rate)
+        self.sample_rate = sample_rate
+        self.block_frames = block_frames
+        self.total_frames = self.synth.total_frames
+        self.ring = RingBuffer(int(ring_seconds * sample_rate))
+        self.first_sound_ms = None
+        self.error = None
+        self.cache = cache
+        self.digest = notes_digest(notes, sample_rate) if cache is not None else None
+        self.from_cache = False  # Звук взят из кэша, без рендера
+
+        self._stream = None
+        self._render_thread = None
+        self._started = None
+        self._stop = threading.Event()
+        self._played_end = False
+
+    @property
+    def duration(self):
+        return self.total_frames / self.sample_rate
+
+    @property
+    def rendered_seconds(self):
+        return self.ring.written / self.sample_rate
+
+    @property
+    def played_seconds(self):
+        return min(self.ring.read_frames, self.total_frames) / self.sample_rate
+
+    @property
+    def finished(self):
+        """Всё отрендерено и воспроизведено (или воспроизведение остановлено)"""
+        return self._stop.is_set() or self._played_end
+
+    def play(self):
+        """Начинает рендер и вывод звука; без sounddevice - исключение"""
+        sounddevice = _sounddevice()
+        if sounddevice is None:
+            raise Exception("Для встроенного синтезатора установите sounddevice: pip install sounddevice")
+
+        self._started = time.perf_counter()
+        self._render_thread = threading.Thread(target=self._render_loop, daemon=True, name="synth-render")
+        self._render_thread.start()
+
+        self._stream = sounddevice.OutputStream(
+            samplerate=self.sample_rate, channels=1, dtype='float32',
+            blocksize=self.block_frames, callback=self._callback,
+        )
+        self._stream.start()
+
+    def _render_loop(self):
+        cached = writer = None
+        complete = False
+        try:
+            if self.cache is not None and self.total_frames:
+                cached = self.cache.open_audio(self.digest)
+                if cached is not None and len(cached) != self.total_frames:
+                    cached = None
+                self.from_cache = cached is not None
+                if cached is None:
+                    writer = self.cache.audio_writer(self.digest, self.total_frames)
+
+            for first_frame in range(0, self.total_frames, self.block_frames):
+                if self._stop.is_set():
+                    return
+                frames = min(self.block_frames, self.total_frames - first_frame)
+                if cached is not None:
+                    block = np.asarray(cached[first_frame:first_frame + frames])
+                else:
+                    block = self.synth.render(first_frame, frames)
+                    if writer is not None:
+                        writer.write(first_frame, block)
+                if not self.ring.write(block):
+                    return
+            complete = True
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if writer is not None:
+                writer.close(complete)  # Прерванный рендер в кэш не попадает
+            self.ring.close()
+
+    def _callback(self, outdata, frames, time_info, status):
+        count = self.ring.read(outdata[:, 0])
+        if count and self.first_sound_ms is None:
+            self.first_sound_ms = (time.perf_counter() - self._started) * 1000
+        if self.ring.closed and self.ring.available() == 0:
+            self._played_end = True  # Рендер закончен (или прерван ошибкой) и всё отдано устройству
+
+    def stop(self):
+        """Останавливает рендер и вывод звука"""
+        self._stop.set()
+        self.ring.close()
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
@@ -0,0 +1,56 @@
+"""Время нот в целых тиках: сетка темпа и размера, перевод в секунды при экспорте"""
+import numpy as np
+
+# Тиков на долю (четверть): делится на 3 и 16, так что триоли и
+# шестнадцатые попадают точно в целые тики
+TICKS_PER_BEAT = 480
+
+# Темп и размер композиции, если пресет их не задаёт
+DEFAULT_BPM = 120.0
+DEFAULT_TIME_SIGNATURE = (4, 4)
+
+# Шаги и длительности модели и RHYTHMS заданы в секундах при этом темпе:
+# 0.5 с - одна доля. Темп пресета меняет скорость, но не рисунок ритма
+REFERENCE_BPM = 120.0
+
+
+def seconds_to_ticks(seconds, bpm=REFERENCE_BPM):
+    """Секунды при темпе bpm -> целые тики (округление к ближайшему)"""
+    return np.rint(np.asarray(seconds, dtype=np.float64) * (bpm / 60.0 * TICKS_PER_BEAT)).astype(np.int64)
+
+
+def ticks_to_seconds(ticks, bpm=DEFAULT_BPM):
+    """Тики -> секунды при темпе bpm"""
+    return np.asarray(ticks, dtype=np.float64) * (60.0 / (bpm * TICKS_PER_BEAT))
+
+
+def parse_time_signature(value):
+    """Размер из строки "3/4" или пары [3, 4] -> (числитель, знаменатель)"""
+    if isinstance(value, str):
+        parts = value.split('/')
+        if len(parts) != 2:
+            raise Exception(f"Неверный размер: {value} (ожидается, например, 3/4)")
+        value = parts
+    numerator, denominator = (int(part) for part in value)
+    if numerator < 1 or denominator < 1 or denominator & (denominator - 1):
+        raise Exception(f"Неверный размер: {numerator}/{denominator}")
+    return numerator, denominator
+
+
+def format_time_signature(time_signature):
+    """Размер для пресета и интерфейса: (3, 4) -> '3/4'"""
+    return f"{time_signature[0]}/{time_signature[1]}"
+
+
+def bar_ticks(time_signature):
+    """Длина такта в тиках"""
+    numerator, denominator = time_signature
+    return numerator * TICKS_PER_BEAT * 4 // denominator
+
+
+def tempo_from_settings(settings):
+    """Темп и размер из настроек пресета: (bpm, (числитель, знаменатель))"""
+    bpm = float(settings.get('bpm') or DEFAULT_BPM)
+    if bpm <= 0:
+        raise Exception(f"Неверный темп: {bpm} BPM")
+    return bpm, parse_time_signature(settings.get('time_signature') or DEFAULT_TIME_SIGNATURE)
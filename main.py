@@ -1,31 +1,121 @@
 # Импорт необходимых библиотек
-import numpy as np
-import tensorflow as tf
-import pandas as pd
-import pretty_midi
-from IPython import display
+import time
+_STARTUP_STARTED = time.perf_counter()  # Для отчёта о времени запуска
+
 import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 import threading
-import json
-from datetime import datetime
+import queue
 import sys
-import tempfile
 import subprocess
 
+# TensorFlow загружается при первой загрузке модели (в фоновом потоке),
+# pretty_midi - только там, где без него не обойтись
+from aimusic import (
+    SCALES, INSTRUMENTS, RHYTHMS, DRUM_PATTERNS, DEFAULT_PRESETS, FAST_CPU_MODES,
+    MusicGenerator, default_orchestra, drum_kit,
+    get_output_path, CancelToken, GenerationCancelled,
+)
+from aimusic.jobs import JobQueue
+from aimusic.sweep import SweepPlan, TimingHistory
+from aimusic.seeds import load_seed_tokens
+from aimusic.preview import PreviewCache, sweep_stale_previews
+from aimusic.synth import SynthPlayer, audio_output_available
+from aimusic.timing import DEFAULT_BPM, DEFAULT_TIME_SIGNATURE, format_time_signature
+from aimusic.presets import USER_PRESET_MARK, PresetStore
+
+_IMPORTS_DONE = time.perf_counter()
+
+# Целевое время до появления окна, мс (можно переопределить переменной окружения)
+STARTUP_TARGET_MS = float(os.environ.get('AIMUSIC_STARTUP_TARGET_MS', 1500))
+
+# Период обработки событий от рабочих потоков, мс (~30 кадров в секунду)
+UI_FRAME_MS = 33
+
+# Период проверки presets.json на изменения, мс
+PRESETS_POLL_MS = 2000
+
+
+class UIEventBridge:
+    """Канал обновления интерфейса из рабочих потоков.
+
+    Потоки не трогают виджеты: они публикуют события, а главный цикл Tk
+    разбирает их раз в кадр. Прогресс и статус хранятся в ячейках "последнее
+    значение", поэтому частые обновления не засоряют очередь; остальные
+    события (сообщения, результаты) выполняются по порядку.
+    """
+
+    def __init__(self, root, progress_bar, status_var, frame_ms=UI_FRAME_MS):
+        self.root = root
+        self.progress_bar = progress_bar
+        self.status_var = status_var
+        self.frame_ms = frame_ms
+
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._progress = None
+        self._status = None
+
+        self.root.after(self.frame_ms, self._drain)
+
+    def set_progress(self, value):
+        """Прогресс 0-100; до отрисовки сохраняется только последнее значение"""
+        with self._lock:
+            self._progress = value
+
+    def set_status(self, text):
+        """Текст статусной строки; до отрисовки сохраняется только последний"""
+        with self._lock:
+            self._status = text
+
+    def call(self, func, *args):
+        """Выполняет func(*args) в главном потоке в порядке публикации"""
+        self._events.put((func, args))
+
+    def _drain(self):
+        with self._lock:
+            progress, self._progress = self._progress, None
+            status, self._status = self._status, None
+
+        # Сначала последние значения, затем события: итоговый результат
+        # не перезаписывается промежуточным прогрессом того же кадра
+        if progress is not None:
+            self.progress_bar['value'] = progress
+        if status is not None:
+            self.status_var.set(status)
+
+        while True:
+            try:
+                func, args = self._events.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Ошибка обработки события интерфейса: {e}", file=sys.stderr)
+
+        self.root.after(self.frame_ms, self._drain)
+
+
+# Период обновления позиции в плеере, мс
+PLAYER_UPDATE_MS = 50
+
+
 class MusicPlayer:
-    """Класс для воспроизведения MIDI через системный плеер"""
+    """Плеер композиции: встроенный синтезатор, без sounddevice - системный плеер"""
     
-    def __init__(self, parent, midi_object, filename="Сгенерированная музыка", saved_file_path=None):
+    def __init__(self, parent, notes, filename="Сгенерированная музыка", saved_file_path=None,
+                 preview_cache=None):
         self.parent = parent
-        self.midi_object = midi_object
+        self.notes = notes  # NoteBuffer с композицией
+        self.preview_cache = preview_cache or PreviewCache()  # MIDI и звук по хэшу нот
         self.filename = filename
         self.saved_file_path = saved_file_path  # Путь к сохраненному файлу
         self.is_playing = False
         self.current_position = 0
         self.total_duration = 0
-        self.temp_file = None
+        self.synth_player = None  # SynthPlayer текущего воспроизведения
         
         # Создаем окно плеера
         self.player_window = tk.Toplevel(parent)
@@ -103,7 +193,7 @@ class MusicPlayer:
             orient='horizontal'
         )
         self.progress_scale.pack(fill='x')
-        self.progress_scale.config(state='disabled')  # Отключаем перемотку для системного плеера
+        self.progress_scale.config(state='disabled')  # Позиция только отображается, без перемотки
         
         # Кнопки управления
         controls_frame = ttk.Frame(self.player_window)
@@ -142,16 +232,8 @@ class MusicPlayer:
     def prepare_audio(self):
         """Подготавливает аудио для воспроизведения"""
         try:
-            # Создаем временный файл
-            self.temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mid')
-            self.temp_path = self.temp_file.name
-            self.temp_file.close()
-            
-            # Сохраняем MIDI
-            self.midi_object.write(self.temp_path)
-            
             # Получаем длительность
-            self.total_duration = self.midi_object.get_end_time()
+            self.total_duration = self.notes.get_end_time()
             
             # Обновляем информацию
             minutes = int(self.total_duration // 60)
@@ -159,7 +241,7 @@ class MusicPlayer:
             self.total_time_label.config(text=f"{minutes}:{seconds:02d}")
             
             # Получаем количество нот
-            total_notes = sum(len(instrument.notes) for instrument in self.midi_object.instruments)
+            total_notes = len(self.notes)
             
             self.info_label.config(
                 text=f"Нот: {total_notes} | Длительность: {minutes}:{seconds:02d}"
@@ -172,20 +254,26 @@ class MusicPlayer:
             self.player_window.destroy()
     
     def play(self):
-        """Начинает воспроизведение через системный плеер"""
+        """Начинает воспроизведение встроенным синтезатором или системным плеером"""
+        if audio_output_available():
+            self.play_synth()
+            return
+
         try:
+            # Без вывода звука - файл для системного плеера, удаляется при выходе
+            midi_path = self.preview_cache.preview_file(self.notes)
             if os.name == 'nt':  # Windows
-                os.startfile(self.temp_path)
+                os.startfile(midi_path)
             else:  # Linux/Mac
                 import subprocess
                 if sys.platform == 'darwin':
-                    subprocess.run(['open', self.temp_path])
+                    subprocess.run(['open', midi_path])
                 else:
-                    subprocess.run(['xdg-open', self.temp_path])
+                    subprocess.run(['xdg-open', midi_path])
             
             self.is_playing = True
             self.play_button.config(state='disabled')
-            self.status_label.config(text="▶ Файл открыт в системном плеере")
+            self.status_label.config(text="▶ Файл открыт в системном плеере (встроенный: pip install sounddevice)")
             
             # Запускаем симуляцию прогресса
             self.simulate_progress()
@@ -193,8 +281,59 @@ class MusicPlayer:
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось воспроизвести:\n{str(e)}")
     
+    def play_synth(self):
+        """Воспроизведение встроенным синтезатором: рендер блоками в фоновом потоке"""
+        try:
+            self.synth_player = SynthPlayer(self.notes, cache=self.preview_cache)
+            self.synth_player.play()
+        except Exception as e:
+            self.synth_player = None
+            messagebox.showerror("Ошибка", f"Не удалось воспроизвести:\n{str(e)}")
+            return
+
+        self.is_playing = True
+        self.play_button.config(text="⏹ Остановить", command=self.stop)
+        self.status_label.config(text="▶ Воспроизведение")
+        self.update_progress()
+
+    def stop(self):
+        """Останавливает встроенный синтезатор"""
+        if self.synth_player is not None:
+            self.synth_player.stop()
+        self.is_playing = False
+        self.play_button.config(text="▶ Воспроизвести", command=self.play)
+        self.status_label.config(text="⏹ Остановлено")
+
+    def update_progress(self):
+        """Показывает настоящую позицию воспроизведения и запас отрендеренного звука"""
+        player = self.synth_player
+        if not self.is_playing or player is None:
+            return
+
+        position = player.played_seconds
+        duration = player.duration or 1.0
+        self.progress_scale.set(100 * position / duration)
+        self.current_time_label.config(text=f"{int(position // 60)}:{int(position % 60):02d}")
+
+        if player.finished:
+            self.is_playing = False
+            self.play_button.config(text="▶ Воспроизвести", command=self.play)
+            if player.error:
+                self.status_label.config(text=f"❌ Ошибка синтезатора: {player.error}")
+            else:
+                self.status_label.config(text="✅ Воспроизведение завершено")
+            return
+
+        status = f"▶ Воспроизведение | буфер +{player.rendered_seconds - position:.1f} с"
+        if player.first_sound_ms is not None:
+            status += f" | первый звук через {player.first_sound_ms:.0f} мс"
+        if player.from_cache:
+            status += " | из кэша"
+        self.status_label.config(text=status)
+        self.player_window.after(PLAYER_UPDATE_MS, self.update_progress)
+
     def simulate_progress(self):
-        """Симулирует прогресс воспроизведения"""
+        """Симулирует прогресс воспроизведения (системный плеер позицию не сообщает)"""
         if not self.is_playing:
             return
         
@@ -255,78 +394,40 @@ class MusicPlayer:
     def on_closing(self):
         """Обработка закрытия окна"""
         self.is_playing = False
-        
-        # Удаляем временный файл
-        try:
-            if self.temp_file and os.path.exists(self.temp_path):
-                # Даем время системному плееру открыть файл
-                self.player_window.after(1000, lambda: self.cleanup_temp_file())
-        except:
-            pass
-        
+        if self.synth_player is not None:
+            self.synth_player.stop()
+        # Файл системного плеера удаляется при выходе из приложения: его может ещё читать плеер
         self.player_window.destroy()
-    
-    def cleanup_temp_file(self):
-        """Отложенная очистка временного файла"""
-        try:
-            if os.path.exists(self.temp_path):
-                os.remove(self.temp_path)
-        except:
-            pass  # Файл может быть занят плеером
 
 class MusicGeneratorGUI:
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("🎵 Генератор музыки с нейросетью")
         self.root.geometry(f'1000x700')
-        icon_image = tk.PhotoImage(file=os.path.dirname(os.path.abspath(__file__)) + '\Images\icon.png')
+        icon_image = tk.PhotoImage(file=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Images', 'icon.png'))
         self.root.iconphoto(True, icon_image)
         self.root.configure(bg='#2b2b2b')
 
-        self.model = None
-        self.model_path = ""
-        self.generated_notes = None
-        self.generated_midi = None
+        self.generator = MusicGenerator()  # Генерация без привязки к интерфейсу
+        self.generated_notes = None  # NoteBuffer с последней композицией
         self.generated_filename = ""
         self.generated_instrument = 0
+        self.job_queue = None  # Очередь пакетной генерации, создаётся при первом пакете
+        self.batch_jobs = []  # Задания текущего пакета - по ним строится строка состояния
+        self.preview_cache = PreviewCache()  # Общий для всех окон плеера: дубли не рендерятся заново
+        # Время прошлых заданий - для оценки пакетов; имена моделей - из реестра
+        self.timings = TimingHistory(model_names=self.generator.registry.names)
+        self.generation_token = None  # CancelToken текущей генерации; результаты других игнорируются
 
         # Переменные для оркестра
         self.orchestra_instruments = [] # Список выбранных инструментов
-        self.orchestra_parts = {} # Сгенерированные партии для каждого инструмента
-        self.drum_patterns = { # Паттерны для ударных
-            'kick': [36], 
-            'snare': [38, 40], 
-            'hihat': [42, 44], 
-            'crash': [49, 57], 
-            'ride': [51]
-        }
+        self.orchestra_parts = {} # Сгенерированные партии (NoteBuffer) по номеру инструмента
+        self.drum_patterns = DRUM_PATTERNS # Паттерны для ударных
 
         # Музыкальные константы
-        self.SCALES = {
-            'C Major': [60, 62, 64, 65, 67, 69, 71],
-            'A Minor': [57, 59, 60, 62, 64, 65, 67],
-            'G Major': [67, 69, 71, 72, 74, 76, 78],
-            'E Minor': [64, 66, 67, 69, 71, 72, 74],
-            'F Major': [65, 67, 69, 70, 72, 74, 76],
-            'D Minor': [62, 64, 65, 67, 69, 70, 72],
-            'Bb Major': [70, 72, 74, 75, 77, 79, 81],
-            'Chromatic': list(range(60, 73))
-        }
-
-        self.INSTRUMENTS = {
-            0: 'Acoustic Grand Piano', 1: 'Bright Acoustic Piano', 2: 'Electric Grand Piano',
-            24: 'Acoustic Guitar (nylon)', 25: 'Acoustic Guitar (steel)', 26: 'Electric Guitar (jazz)',
-            27: 'Electric Guitar (clean)', 32: 'Acoustic Bass', 33: 'Electric Bass (finger)',
-            40: 'Violin', 41: 'Viola', 42: 'Cello', 56: 'Trumpet', 57: 'Trombone',
-            64: 'Soprano Sax', 65: 'Alto Sax', 73: 'Flute', 80: 'Lead 1 (square)', 81: 'Lead 2 (sawtooth)'
-        }
-
-        self.RHYTHMS = {
-            'Медленно': {'step_min': 0.8, 'step_max': 2.0, 'duration_min': 1.0, 'duration_max': 3.0},
-            'Умеренно': {'step_min': 0.4, 'step_max': 1.2, 'duration_min': 0.6, 'duration_max': 2.0},
-            'Быстро': {'step_min': 0.2, 'step_max': 0.8, 'duration_min': 0.3, 'duration_max': 1.5},
-            'Пользовательский': {'step_min': 0.1, 'step_max': 4.0, 'duration_min': 0.1, 'duration_max': 4.0}
-        }
+        self.SCALES = SCALES
+        self.INSTRUMENTS = INSTRUMENTS
+        self.RHYTHMS = RHYTHMS
 
         self.setup_ui()
 
@@ -367,6 +468,9 @@ class MusicGeneratorGUI:
         status_label = ttk.Label(self.root, textvariable=self.status_var, style='Custom.TLabel')
         status_label.pack(pady=5)
 
+        # Единственный путь обновления виджетов из фоновых потоков
+        self.ui = UIEventBridge(self.root, self.progress, self.status_var)
+
     def update_model_info(self, text):
         """Обновляет информацию о модели в текстовом поле"""
         self.model_info_text.config(state='normal')  # Временно разрешаем редактирование
@@ -388,6 +492,37 @@ class MusicGeneratorGUI:
         ttk.Entry(model_frame_inner, textvariable=self.model_path_var, width=60).pack(side='left', fill='x', expand=True)
         ttk.Button(model_frame_inner, text="Обзор", command=self.load_model).pack(side='right', padx=(5, 0))
 
+        # Модели из реестра: переключение между загруженными - без чтения файла
+        names_frame = ttk.Frame(model_frame)
+        names_frame.pack(fill='x', padx=10, pady=5)
+
+        ttk.Label(names_frame, text="Модель по имени:", style='Custom.TLabel').pack(side='left')
+        self.model_name_var = tk.StringVar()
+        self.model_picked = False  # Модель выбрана по имени, а не через "Обзор"
+        self.model_name_combo = ttk.Combobox(names_frame, textvariable=self.model_name_var, width=30, state='readonly')
+        self.model_name_combo['values'] = sorted(self.generator.registry.names)
+        self.model_name_combo.pack(side='left', padx=5)
+        self.model_name_combo.bind('<<ComboboxSelected>>', lambda event: self.pick_model(self.model_name_var.get()))
+        ttk.Button(names_frame, text="🏷 Сохранить имя", command=self.name_model).pack(side='left', padx=5)
+
+        # Быстрый режим CPU: квантованная копия модели и число потоков
+        fast_frame = ttk.Frame(model_frame)
+        fast_frame.pack(fill='x', padx=10, pady=5)
+
+        self.fast_cpu_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(fast_frame, text="🚀 Быстрый режим CPU", variable=self.fast_cpu_var,
+                        command=self.apply_fast_cpu).pack(side='left')
+        self.fast_cpu_mode_var = tk.StringVar(value=FAST_CPU_MODES[0])
+        fast_mode_combo = ttk.Combobox(fast_frame, textvariable=self.fast_cpu_mode_var, width=10, state='readonly')
+        fast_mode_combo['values'] = FAST_CPU_MODES
+        fast_mode_combo.pack(side='left', padx=5)
+        fast_mode_combo.bind('<<ComboboxSelected>>', lambda event: self.apply_fast_cpu())
+
+        ttk.Label(fast_frame, text="Потоков:", style='Custom.TLabel').pack(side='left', padx=(10, 0))
+        self.cpu_threads_var = tk.IntVar(value=0)  # 0 - по умолчанию TensorFlow
+        ttk.Spinbox(fast_frame, from_=0, to=64, textvariable=self.cpu_threads_var, width=5,
+                    command=self.apply_fast_cpu).pack(side='left', padx=5)
+
         # Информация о модели (теперь только для чтения)
         self.model_info_text = tk.Text(model_frame, height=20, bg='#3b3b3b', fg='white', wrap='word', state='disabled')
         scrollbar_model = ttk.Scrollbar(model_frame, orient="vertical", command=self.model_info_text.yview)
@@ -441,9 +576,22 @@ class MusicGeneratorGUI:
         notes_frame.pack(fill='x', padx=10, pady=2)
         ttk.Label(notes_frame, text="Количество нот:", style='Custom.TLabel').pack(side='left')
         self.num_notes_var = tk.IntVar(value=200)
-        notes_spin = ttk.Spinbox(notes_frame, from_=50, to=1000, textvariable=self.num_notes_var, width=10)
+        notes_spin = ttk.Spinbox(notes_frame, from_=50, to=1000000, increment=50, textvariable=self.num_notes_var, width=10)
         notes_spin.pack(side='right')
 
+        # Потоковая запись: ноты пишутся в файл фрагментами, память не растёт с длиной пьесы
+        self.stream_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(gen_frame, text="Потоковая запись (длинные пьесы, одна партия)",
+                        variable=self.stream_var).pack(anchor='w', padx=10, pady=2)
+
+        # Бюджет времени: по истечении сохраняется то, что успело сгенерироваться
+        budget_frame = ttk.Frame(gen_frame)
+        budget_frame.pack(fill='x', padx=10, pady=2)
+        ttk.Label(budget_frame, text="Ограничение времени, с (0 - нет):", style='Custom.TLabel').pack(side='left')
+        self.time_budget_var = tk.IntVar(value=0)
+        ttk.Spinbox(budget_frame, from_=0, to=3600, increment=5, textvariable=self.time_budget_var,
+                    width=10).pack(side='right')
+
         # Температура
         temp_frame = ttk.Frame(gen_frame)
         temp_frame.pack(fill='x', padx=10, pady=2)
@@ -509,21 +657,7 @@ class MusicGeneratorGUI:
 
     def add_default_orchestra(self):
         """Добавляет базовый состав оркестра"""
-        default_instruments = [
-            (48, "String Ensemble 1", "strings"),
-            (0, "Acoustic Grand Piano", "piano"),
-            (56, "Trumpet", "brass"),
-            (40, "Violin", "strings"),
-            (33, "Electric Bass (finger)", "bass")
-        ]
-
-        for program, name, role in default_instruments:
-            self.orchestra_instruments.append({
-                'program': program,
-                'name': name,
-                'role': role,
-                'is_drum': False
-            })
+        self.orchestra_instruments.extend(default_orchestra())
 
         self.update_orchestra_listbox()
 
@@ -562,6 +696,16 @@ class MusicGeneratorGUI:
         role_combo['values'] = ["melody", "harmony", "bass", "rhythm", "solo"]
         role_combo.pack(side='right')
 
+        # Своя модель для партии (пусто - модель композиции)
+        model_frame = ttk.Frame(dialog)
+        model_frame.pack(fill='x', padx=10, pady=5)
+
+        ttk.Label(model_frame, text="Модель партии:", style='Custom.TLabel').pack(side='left')
+        part_model_var = tk.StringVar(value="")
+        model_combo = ttk.Combobox(model_frame, textvariable=part_model_var, width=15, state='readonly')
+        model_combo['values'] = [""] + sorted(self.generator.registry.names)
+        model_combo.pack(side='right')
+
         # Кнопки
         button_frame = ttk.Frame(dialog)
         button_frame.pack(fill='x', padx=10, pady=10)
@@ -573,12 +717,15 @@ class MusicGeneratorGUI:
                 program = int(item.split(':')[0])
                 name = item.split(': ', 1)[1]
 
-                self.orchestra_instruments.append({
+                instrument = {
                     'program': program,
                     'name': name,
                     'role': role_var.get(),
                     'is_drum': False
-                })
+                }
+                if part_model_var.get():
+                    instrument['model'] = self.generator.registry.reference(part_model_var.get())
+                self.orchestra_instruments.append(instrument)
 
                 self.update_orchestra_listbox()
                 dialog.destroy()
@@ -588,23 +735,7 @@ class MusicGeneratorGUI:
 
     def add_drums(self):
         """Добавляет ударную установку"""
-        drum_kit = [
-            {'program': 0, 'name': 'Kick Drum', 'role': 'drums', 'drum_notes': [36], 'velocity': 120},
-            {'program': 0, 'name': 'Snare Drum', 'role': 'drums', 'drum_notes': [38, 40], 'velocity': 110},
-            {'program': 0, 'name': 'Hi-Hat', 'role': 'drums', 'drum_notes': [42, 44], 'velocity': 100},
-            {'program': 0, 'name': 'Crash Cymbal', 'role': 'drums', 'drum_notes': [49, 57], 'velocity': 110},
-        ]
-
-        for drum in drum_kit:
-            drum_safe = {
-                'program': int(drum.get('program', 0)),
-                'name': str(drum.get('name', 'Drum')),
-                'role': str(drum.get('role', 'drums')),
-                'is_drum': True,
-                'drum_notes': list(drum.get('drum_notes', [36])),
-                'velocity': int(drum.get('velocity', 100))
-            }
-            self.orchestra_instruments.append(drum_safe)
+        self.orchestra_instruments.extend(drum_kit())
 
         self.update_orchestra_listbox()
 
@@ -633,7 +764,8 @@ class MusicGeneratorGUI:
                 "drums": "🥁"
             }.get(instrument['role'], "🎶")
             drum_mark = " [Drums]" if instrument.get('is_drum', False) else ""
-            self.orchestra_listbox.insert(tk.END, f"{role_icon} {instrument['name']}{drum_mark}")
+            model_mark = f" [{instrument['model']}]" if instrument.get('model') else ""
+            self.orchestra_listbox.insert(tk.END, f"{role_icon} {instrument['name']}{drum_mark}{model_mark}")
 
     def setup_advanced_tab(self, notebook):
         adv_frame = ttk.Frame(notebook)
@@ -651,6 +783,18 @@ class MusicGeneratorGUI:
         tempo_combo['values'] = list(self.RHYTHMS.keys())
         tempo_combo.pack(side='right')
 
+        # Темп в BPM и размер: время нот считается в тиках, в секунды - при сохранении
+        bpm_frame = ttk.Frame(adv_frame)
+        bpm_frame.pack(fill='x', padx=10, pady=2)
+        ttk.Label(bpm_frame, text="BPM:", style='Custom.TLabel').pack(side='left')
+        self.bpm_var = tk.IntVar(value=int(DEFAULT_BPM))
+        ttk.Spinbox(bpm_frame, from_=30, to=300, textvariable=self.bpm_var, width=5).pack(side='left', padx=(5,0))
+        ttk.Label(bpm_frame, text="Размер:", style='Custom.TLabel').pack(side='left', padx=(20,0))
+        self.time_signature_var = tk.StringVar(value=format_time_signature(DEFAULT_TIME_SIGNATURE))
+        time_signature_combo = ttk.Combobox(bpm_frame, textvariable=self.time_signature_var, width=6)
+        time_signature_combo['values'] = ["2/4", "3/4", "4/4", "5/4", "6/8", "7/8", "12/8"]
+        time_signature_combo.pack(side='left', padx=(5,0))
+
         # Диапазон высот
         ttk.Label(adv_frame, text="Диапазон высот:", style='Heading.TLabel').pack(anchor='w', padx=10, pady=(10,5))
 
@@ -725,153 +869,11 @@ class MusicGeneratorGUI:
                    command=self.delete_preset).pack(side='left', padx=2)
 
         # Предопределенные пресеты
-        self.default_presets = {
-            "🎹 Классическое пианино": {
-                "instrument": "0: Acoustic Grand Piano",
-                "track_type": "melody",
-                "key": "C Major",
-                "num_notes": 300,
-                "temperature": 0.8,
-                "tempo": "Умеренно",
-                "pitch_min": 60,
-                "pitch_max": 84,
-                "use_scale": True,
-                "smooth_melody": True,
-                "quantize_rhythm": True
-            },
-            "🎸 Блюзовая гитара": {
-                "instrument": "27: Electric Guitar (clean)",
-                "track_type": "melody",
-                "key": "A Minor",
-                "num_notes": 250,
-                "temperature": 1.2,
-                "tempo": "Умеренно",
-                "pitch_min": 48,
-                "pitch_max": 72,
-                "use_scale": True,
-                "smooth_melody": True,
-                "quantize_rhythm": False
-            },
-            "🎺 Джазовая труба": {
-                "instrument": "56: Trumpet",
-                "track_type": "melody",
-                "key": "Bb Major",
-                "num_notes": 200,
-                "temperature": 1.1,
-                "tempo": "Быстро",
-                "pitch_min": 60,
-                "pitch_max": 96,
-                "use_scale": False,
-                "smooth_melody": False,
-                "quantize_rhythm": True
-            },
-            "🎻 Лирическая скрипка": {
-                "instrument": "40: Violin",
-                "track_type": "melody",
-                "key": "G Major",
-                "num_notes": 350,
-                "temperature": 0.9,
-                "tempo": "Медленно",
-                "pitch_min": 67,
-                "pitch_max": 108,
-                "use_scale": True,
-                "smooth_melody": True,
-                "quantize_rhythm": True
-            },
-            "🎸 Бас-гитара": {
-                "instrument": "33: Electric Bass (finger)",
-                "track_type": "bass",
-                "key": "E Minor",
-                "num_notes": 150,
-                "temperature": 0.7,
-                "tempo": "Умеренно",
-                "pitch_min": 24,
-                "pitch_max": 48,
-                "use_scale": True,
-                "smooth_melody": False,
-                "quantize_rhythm": True
-            },
-            "🎹 Аккордовое сопровождение": {
-                "instrument": "0: Acoustic Grand Piano",
-                "track_type": "chords",
-                "key": "F Major",
-                "num_notes": 100,
-                "temperature": 0.6,
-                "tempo": "Медленно",
-                "pitch_min": 48,
-                "pitch_max": 72,
-                "use_scale": True,
-                "smooth_melody": False,
-                "quantize_rhythm": True
-            },
-            "🎷 Саксофон соло": {
-                "instrument": "65: Alto Sax",
-                "track_type": "melody",
-                "key": "D Minor",
-                "num_notes": 280,
-                "temperature": 1.3,
-                "tempo": "Умеренно",
-                "pitch_min": 55,
-                "pitch_max": 84,
-                "use_scale": False,
-                "smooth_melody": True,
-                "quantize_rhythm": False
-            },
-            "💫 Электронный синтез": {
-                "instrument": "80: Lead 1 (square)",
-                "track_type": "melody",
-                "key": "Chromatic",
-                "num_notes": 400,
-                "temperature": 1.5,
-                "tempo": "Быстро",
-                "pitch_min": 36,
-                "pitch_max": 96,
-                "use_scale": False,
-                "smooth_melody": False,
-                "quantize_rhythm": True
-            },
-            "🎼 Симфонический оркестр": {
-                "instrument": "48: String Ensemble 1",
-                "track_type": "orchestra",
-                "key": "C Major",
-                "num_notes": 500,
-                "temperature": 0.9,
-                "tempo": "Умеренно",
-                "pitch_min": 36,
-                "pitch_max": 108,
-                "use_scale": True,
-                "smooth_melody": True,
-                "quantize_rhythm": True
-            },
-            "🎭 Драматический оркестр": {
-                "instrument": "49: String Ensemble 2",
-                "track_type": "orchestra",
-                "key": "D Minor",
-                "num_notes": 600,
-                "temperature": 1.1,
-                "tempo": "Медленно",
-                "pitch_min": 24,
-                "pitch_max": 108,
-                "use_scale": True,
-                "smooth_melody": True,
-                "quantize_rhythm": True
-            },
-            "🌟 Торжественный марш": {
-                "instrument": "61: Brass Section",
-                "track_type": "orchestra",
-                "key": "Bb Major",
-                "num_notes": 400,
-                "temperature": 0.8,
-                "tempo": "Умеренно",
-                "pitch_min": 48,
-                "pitch_max": 96,
-                "use_scale": True,
-                "smooth_melody": False,
-                "quantize_rhythm": True
-            }
-        }
+        self.default_presets = DEFAULT_PRESETS
+        self.preset_store = PresetStore()  # Пользовательские пресеты: файл читается только при изменении
 
         self.load_presets()
+        self.root.after(PRESETS_POLL_MS, self.poll_presets)
 
     def setup_control_buttons(self):
         # Кнопки управления
@@ -886,6 +888,10 @@ class MusicGeneratorGUI:
                                          command=self.generate_music, width=30)
         self.generate_button.pack(side='left', padx=2)
 
+        self.stop_button = ttk.Button(generate_frame, text="⏹ Остановить",
+                                      command=self.stop_generation, width=14, state='disabled')
+        self.stop_button.pack(side='left', padx=2)
+
         self.play_button = ttk.Button(generate_frame, text="🔊 Воспроизвести", 
                                      command=self.play_music, width=20)
         self.play_button.pack(side='left', padx=2)
@@ -894,6 +900,10 @@ class MusicGeneratorGUI:
                                      command=self.save_music, width=20)
         self.save_button.pack(side='left', padx=2)
 
+        self.batch_button = ttk.Button(generate_frame, text="📦 Пакетная генерация", 
+                                      command=self.open_batch_dialog, width=22)
+        self.batch_button.pack(side='left', padx=2)
+
         # Прогресс бар
         self.progress = ttk.Progressbar(self.root, mode='determinate', maximum=100)
         self.progress.pack(fill='x', padx=10, pady=5)
@@ -901,64 +911,6 @@ class MusicGeneratorGUI:
     def update_temp_label(self, value):
         self.temp_label.config(text=f"{float(value):.1f}")
 
-    def get_output_path(self):
-        """Создает и возвращает путь к папке для сохранения файлов"""
-        # Получаем путь к директории, где находится скрипт
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # Создаем путь к папке Outputs
-        outputs_dir = os.path.join(script_dir, 'Outputs')
-        
-        # Получаем текущую дату в формате ДД.ММ.ГГГГ
-        current_date = datetime.now().strftime('%d.%m.%Y')
-        
-        # Создаем путь к папке с датой
-        date_dir = os.path.join(outputs_dir, current_date)
-        
-        # Создаем папки, если их не существует
-        os.makedirs(date_dir, exist_ok=True)
-        
-        return date_dir
-
-    def generate_unique_filename(self, base_dir, prefix="music", extension=".mid"):
-        """Генерирует уникальное имя файла"""
-        timestamp = datetime.now().strftime('%H-%M-%S')
-        counter = 1
-        
-        while True:
-            if counter == 1:
-                filename = f"{prefix}_{timestamp}{extension}"
-            else:
-                filename = f"{prefix}_{timestamp}_{counter}{extension}"
-            
-            filepath = os.path.join(base_dir, filename)
-            
-            if not os.path.exists(filepath):
-                return filepath
-            
-            counter += 1
-
-    def load_model_safe_gui(self, model_path):
-        """Безопасная загрузка модели для GUI"""
-        custom_objects = {
-            'mse': tf.keras.losses.MeanSquaredError(),
-            'keras.metrics.mse': tf.keras.metrics.MeanSquaredError(),
-            'sparse_categorical_crossentropy': tf.keras.losses.SparseCategoricalCrossentropy(),
-            'accuracy': tf.keras.metrics.Accuracy(),
-        }
-
-        try:
-            # Первая попытка - с пользовательскими объектами
-            model = tf.keras.models.load_model(model_path, custom_objects=custom_objects)
-            return model, "✅ Модель загружена с полной функциональностью"
-        except Exception as e1:
-            try:
-                # Вторая попытка - без компиляции
-                model = tf.keras.models.load_model(model_path, compile=False)
-                return model, "⚠️ Модель загружена без компиляции"
-            except Exception as e2:
-                raise Exception(f"Не удалось загрузить модель.\nОшибка 1: {str(e1)[:100]}...\nОшибка 2: {str(e2)[:100]}...")
-
     def load_model(self):
         """Обновленная функция загрузки модели с обработкой ошибок"""
         file_path = filedialog.askopenfilename(
@@ -968,145 +920,310 @@ class MusicGeneratorGUI:
         if file_path:
             self.model_path_var.set(file_path)
             self.model_path = file_path
+            self.model_picked = False
+            self.activate_model(file_path, announce=True)
 
-            # Показываем прогресс
-            self.status_var.set("Загрузка модели...")
-            self.progress.start()
+    def pick_model(self, name_or_path):
+        """Модель, явно выбранная по имени: на неё ссылаются пресеты и задания пакета"""
+        self.model_picked = True
+        self.activate_model(name_or_path)
 
-            def load_in_thread():
-                try:
-                    model, status = self.load_model_safe_gui(file_path)
-                    self.model = model
-                    
-                    # Получаем информацию о модели
-                    info_text = f"📁 Путь: {file_path}\n\n"
-                    info_text += f"🔧 Статус: {status}\n\n"
-                    info_text += f"📊 Архитектура модели:\n"
-                    info_text += f"  • Количество слоёв: {len(model.layers)}\n"
-                    
-                    # Информация о входе и выходе
-                    try:
-                        info_text += f"  • Входная форма: {model.input_shape}\n"
-                        info_text += f"  • Выходная форма: {model.output_shape}\n"
-                    except:
-                        info_text += f"  • Входная/выходная форма: недоступна\n"
-                    
-                    # Параметры модели
-                    try:
-                        total_params = model.count_params()
-                        info_text += f"  • Всего параметров: {total_params:,}\n"
-                    except:
-                        info_text += f"  • Параметры: недоступно\n"
-                    
-                    info_text += f"\n📝 Слои модели:\n"
-                    for i, layer in enumerate(model.layers[:10]):  # Показываем первые 10 слоев
-                        info_text += f"  {i+1}. {layer.__class__.__name__}"
-                        try:
-                            info_text += f" - {layer.output_shape}\n"
-                        except:
-                            info_text += "\n"
-                    
-                    if len(model.layers) > 10:
-                        info_text += f"  ... и ещё {len(model.layers) - 10} слоёв\n"
-                    
-                    # Обновляем UI
-                    self.root.after(0, lambda: self.update_model_info(info_text))
-                    self.root.after(0, lambda: self.status_var.set("✅ Модель успешно загружена"))
-                    self.root.after(0, lambda: messagebox.showinfo("Успех", "Модель успешно загружена!"))
-                    
-                except Exception as e:
-                    error_msg = f"Ошибка загрузки модели:\n{str(e)}"
-                    self.root.after(0, lambda: self.update_model_info(error_msg))
-                    self.root.after(0, lambda: self.status_var.set("❌ Ошибка загрузки модели"))
-                    self.root.after(0, lambda: messagebox.showerror("Ошибка", error_msg))
+    def activate_model(self, name_or_path, announce=False):
+        """Делает модель активной в фоновом потоке (из реестра - мгновенно)"""
+        # Показываем прогресс
+        self.status_var.set("Загрузка модели...")
+        self.progress.start()
+
+        def load_in_thread():
+            try:
+                info_text = self.generator.load_model(name_or_path, on_status=self.ui.set_status)
                 
-                finally:
-                    self.root.after(0, self.progress.stop)
+                # Обновляем UI
+                self.ui.call(self.update_model_info, info_text)
+                active_name = self.generator.registry.name_of(self.generator.model_path)
+                self.ui.call(self.update_model_names, active_name)
+                self.ui.set_status(f"✅ Модель '{active_name}' активна")
+                if announce:
+                    self.ui.call(messagebox.showinfo, "Успех", "Модель успешно загружена!")
+                
+            except Exception as e:
+                error_msg = f"Ошибка загрузки модели:\n{str(e)}"
+                self.ui.call(self.update_model_info, error_msg)
+                self.ui.set_status("❌ Ошибка загрузки модели")
+                self.ui.call(messagebox.showerror, "Ошибка", error_msg)
+            
+            finally:
+                self.ui.call(self.progress.stop)
 
-            thread = threading.Thread(target=load_in_thread, daemon=True)
-            thread.start()
+        thread = threading.Thread(target=load_in_thread, daemon=True)
+        thread.start()
+
+    def apply_fast_cpu(self):
+        """Переключает быстрый режим CPU и заново активирует текущую модель"""
+        self.generator.fast_cpu = self.fast_cpu_mode_var.get() if self.fast_cpu_var.get() else None
+        self.generator.cpu_threads = self.cpu_threads_var.get() or None
+        if self.generator.model_path:
+            self.activate_model(self.generator.model_path)
+
+    def name_model(self):
+        """Сохраняет имя активной модели в models.json (для пресетов и партий оркестра)"""
+        if self.generator.model is None:
+            messagebox.showerror("Ошибка", "Сначала загрузите модель!")
+            return
+
+        registry = self.generator.registry
+        name = simpledialog.askstring("Имя модели", "Введите имя модели:",
+                                      initialvalue=registry.name_of(self.generator.model_path))
+        if not name:
+            return
+        try:
+            registry.register(name.strip(), self.generator.model_path)
+        except Exception as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
+        self.update_model_names(name.strip())
+        self.status_var.set(f"🏷 Имя '{name.strip()}' сохранено")
+
+    def update_model_names(self, active_name=None):
+        """Обновляет список имён моделей"""
+        self.model_name_combo['values'] = sorted(self.generator.registry.names)
+        if active_name:
+            self.model_name_var.set(active_name)
+            self.model_path_var.set(self.generator.model_path)
 
     def generate_music(self):
-        if self.model is None:
+        # Читаем настройки в главном потоке, до запуска генерации
+        settings = self.current_settings()
+
+        if self.generator.model is None and not settings.get('model'):
             messagebox.showerror("Ошибка", "Сначала загрузите модель!")
             return
 
         self.status_var.set("Генерация музыки...")
         self.generate_button.config(state='disabled')
+        self.stop_button.config(state='normal')
         self.progress['value'] = 0
 
+        token = self.generation_token = CancelToken(settings.get('time_budget')).start()
+
+        def set_progress(value):
+            # Остановленная генерация не трогает прогресс следующей
+            if token is self.generation_token:
+                self.ui.set_progress(value)
+
         def generate_in_thread():
             try:
-                # Определяем тип генерации
-                track_type = self.track_type_var.get()
-                
-                if track_type == "orchestra":
-                    # Генерация оркестра
-                    self.generate_orchestra()
-                else:
-                    # Обычная генерация
-                    # Получаем параметры
-                    instrument_str = self.instrument_var.get()
-                    instrument = int(instrument_str.split(':')[0])
-                    
-                    num_notes = self.num_notes_var.get()
-                    temperature = self.temperature_var.get()
-                    key = self.key_var.get()
-                    tempo = self.tempo_var.get()
-                    
-                    # Генерируем ноты
-                    self.progress['value'] = 30
-                    self.generated_notes = self.generate_notes_with_model(
-                        num_notes, temperature, key, tempo, track_type
-                    )
-                    
-                    # Создаем MIDI
-                    self.progress['value'] = 60
-                    self.generated_midi = self.notes_to_midi(
-                        self.generated_notes, instrument, track_type
-                    )
-                    
-                    self.generated_instrument = instrument
+                if settings.get('stream'):
+                    # Фрагменты сразу пишутся в файл, в памяти композиция не хранится
+                    writer = self.generator.generate_to_file(settings, progress=set_progress, cancel=token)
+                    self.ui.call(self.on_generation_done, None, writer.filename, settings, writer.note_count, token)
+                    return
+
+                # Генерируем ноты
+                set_progress(30)
+                # Состав оркестра берётся из снимка settings, а не из списка интерфейса
+                notes = self.generator.generate(
+                    settings,
+                    progress=lambda value: set_progress(30 + value * 0.5),
+                    cancel=token
+                )
                 
                 # Автоматически сохраняем файл
-                self.progress['value'] = 80
-                output_dir = self.get_output_path()
-                
-                # Генерируем имя файла на основе параметров
-                track_name = track_type if track_type != "orchestra" else "orchestra"
-                instrument_name = self.instrument_var.get().split(': ')[1].replace(' ', '_') if track_type != "orchestra" else "ensemble"
-                key_name = self.key_var.get().replace(' ', '_')
-                
-                prefix = f"{track_name}_{instrument_name}_{key_name}"
-                self.generated_filename = self.generate_unique_filename(output_dir, prefix)
-                
-                # Сохраняем MIDI файл
-                self.generated_midi.write(self.generated_filename)
-                
-                self.progress['value'] = 100
-                self.status_var.set(f"✅ Музыка сгенерирована и сохранена: {os.path.basename(self.generated_filename)}")
-                
-                messagebox.showinfo("Успех", 
-                    f"Музыка успешно сгенерирована!\n\n"
-                    f"Сохранено в:\n{self.generated_filename}\n\n"
-                    f"Количество нот: {num_notes if track_type != 'orchestra' else 'множество'}\n"
-                    f"Инструмент: {self.instrument_var.get()}\n"
-                    f"Тональность: {key}")
+                set_progress(80)
+                filename = self.generator.save(notes, settings)
+                self.ui.call(self.on_generation_done, notes, filename, settings, len(notes), token)
 
+            except GenerationCancelled:
+                pass  # Интерфейс уже вернулся в исходное состояние в stop_generation
             except Exception as e:
-                self.status_var.set("❌ Ошибка при генерации")
-                messagebox.showerror("Ошибка", f"Не удалось сгенерировать музыку:\n{str(e)}")
-            
-            finally:
-                self.generate_button.config(state='normal')
-                self.progress['value'] = 0
+                self.ui.call(self.on_generation_failed, str(e), token)
 
         thread = threading.Thread(target=generate_in_thread, daemon=True)
         thread.start()
 
+    def stop_generation(self):
+        """Прерывает текущую генерацию и пакет; интерфейс освобождается сразу"""
+        if self.generation_token is not None:
+            self.generation_token.cancel()
+            self.generation_token = None
+        if self.job_queue is not None:
+            self.job_queue.cancel_all()
+
+        self.stop_button.config(state='disabled')
+        self.generate_button.config(state='normal')
+        self.progress['value'] = 0
+        self.status_var.set("⏹ Генерация остановлена")
+
+    def _finish_generation(self, token):
+        """Снимает отметку текущей генерации; False - результат уже не нужен"""
+        if token is not None and token is not self.generation_token:
+            return False
+        self.generation_token = None
+        self.stop_button.config(state='disabled')
+        self.generate_button.config(state='normal')
+        return True
+
+    def on_generation_done(self, notes, filename, settings, note_count=None, token=None):
+        """Результат генерации (выполняется в главном потоке).
+
+        notes - None при потоковой записи: композиция только в файле, note_count - число нот.
+        Результат остановленной генерации (token уже не текущий) игнорируется.
+        """
+        if not self._finish_generation(token):
+            return
+        track_type = settings['track_type']
+        self.generated_notes = notes
+        self.generated_filename = filename
+        if notes is not None and track_type == "orchestra":
+            self.orchestra_parts = {
+                index: notes.track_notes(index)
+                for index in range(len(notes.tracks))
+            }
+        elif notes is not None:
+            self.generated_instrument = notes.tracks[0]['program']
+
+        self.progress['value'] = 100
+        self.status_var.set(f"✅ Музыка сгенерирована и сохранена: {os.path.basename(filename)}")
+        notice = ""
+        if token is not None and token.expired:
+            notice = "⏱ Ограничение времени исчерпано - сохранено то, что успело сгенерироваться.\n\n"
+
+        messagebox.showinfo("Успех", 
+            f"Музыка успешно сгенерирована!\n\n"
+            f"{notice}"
+            f"Сохранено в:\n{filename}\n\n"
+            f"Количество нот: {len(notes) if notes is not None else note_count}\n"
+            f"Инструмент: {settings['instrument'] if track_type != 'orchestra' else 'ансамбль'}\n"
+            f"Тональность: {settings['key']}")
+        self.progress['value'] = 0
+
+    def on_generation_failed(self, error, token=None):
+        """Ошибка генерации (выполняется в главном потоке)"""
+        if not self._finish_generation(token):
+            return
+        self.status_var.set("❌ Ошибка при генерации")
+        self.progress['value'] = 0
+        messagebox.showerror("Ошибка", f"Не удалось сгенерировать музыку:\n{error}")
+
+    def open_batch_dialog(self):
+        """Диалог пакетной генерации: сетка тональностей и температур"""
+        if self.generator.model is None:
+            messagebox.showerror("Ошибка", "Сначала загрузите модель!")
+            return
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Пакетная генерация")
+        dialog.geometry("420x330")
+        dialog.configure(bg='#2b2b2b')
+
+        ttk.Label(dialog, text="Параметры пакета:", style='Heading.TLabel').pack(pady=5)
+
+        all_keys_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(dialog, text="Все тональности", variable=all_keys_var).pack(anchor='w', padx=10, pady=2)
+
+        temperatures_frame = ttk.Frame(dialog)
+        temperatures_frame.pack(fill='x', padx=10, pady=2)
+        ttk.Label(temperatures_frame, text="Температуры (через запятую):", style='Custom.TLabel').pack(side='left')
+        temperatures_var = tk.StringVar(value=f"{self.temperature_var.get():.1f}")
+        ttk.Entry(temperatures_frame, textvariable=temperatures_var, width=15).pack(side='right')
+
+        repeat_frame = ttk.Frame(dialog)
+        repeat_frame.pack(fill='x', padx=10, pady=2)
+        ttk.Label(repeat_frame, text="Файлов на вариант:", style='Custom.TLabel').pack(side='left')
+        repeat_var = tk.IntVar(value=1)
+        ttk.Spinbox(repeat_frame, from_=1, to=1000, textvariable=repeat_var, width=8).pack(side='right')
+
+        workers_frame = ttk.Frame(dialog)
+        workers_frame.pack(fill='x', padx=10, pady=2)
+        # Пока пакет выполняется, новые задания встают в тот же пул - его размер не меняется
+        busy = self.job_queue is not None and not self.job_queue.idle()
+        ttk.Label(workers_frame, text="Рабочих потоков (пакет выполняется):" if busy else "Рабочих потоков:",
+                  style='Custom.TLabel').pack(side='left')
+        workers_var = tk.IntVar(value=self.job_queue.workers if busy else 2)
+        ttk.Spinbox(workers_frame, from_=1, to=16, textvariable=workers_var, width=8,
+                    state='disabled' if busy else 'normal').pack(side='right')
+
+        # План пересчитывается при каждом изменении параметров
+        plan_var = tk.StringVar()
+        ttk.Label(dialog, textvariable=plan_var, style='Custom.TLabel', wraplength=400,
+                  justify='left').pack(fill='x', padx=10, pady=5)
+
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(fill='x', padx=10, pady=10)
+
+        def build_plan():
+            """План пакета или None, если параметры неверны"""
+            try:
+                temperatures = [float(value) for value in temperatures_var.get().replace(' ', '').split(',') if value]
+                # Тот же план, что у python -m aimusic sweep: без дубликатов, по порядку переиспользования
+                return SweepPlan(self.current_settings(), {
+                    "keys": "all" if all_keys_var.get() else None,
+                    "temperatures": temperatures or None,
+                    "repeat": repeat_var.get(),
+                }, self.timings, self.generator.active.path if self.generator.active else '')
+            except (ValueError, tk.TclError):
+                return None
+
+        def update_plan(*args):
+            plan = build_plan()
+            try:
+                workers = workers_var.get()
+            except tk.TclError:
+                workers = 1
+            plan_var.set("Неверные параметры пакета" if plan is None else plan.describe(workers))
+
+        for variable in (all_keys_var, temperatures_var, repeat_var, workers_var):
+            variable.trace_add('write', update_plan)
+        update_plan()
+
+        def start_batch():
+            plan = build_plan()
+            try:
+                workers = workers_var.get()
+            except tk.TclError:
+                plan = None
+            if plan is None:
+                messagebox.showerror("Ошибка", "Неверные параметры пакета")
+                return
+
+            self.submit_batch(plan.settings_list, workers)
+            dialog.destroy()
+
+        ttk.Button(button_frame, text="Запустить", command=start_batch).pack(side='right', padx=2)
+        ttk.Button(button_frame, text="Отмена", command=dialog.destroy).pack(side='right', padx=2)
+
+    def submit_batch(self, settings_list, workers):
+        """Ставит задания в очередь; рабочие потоки используют загруженную модель.
+
+        Свободный пул с другим числом потоков создаётся заново; если пакет
+        ещё выполняется, задания добавляются к нему.
+        """
+        if self.job_queue is not None and self.job_queue.idle():
+            self.batch_jobs = []
+            if self.job_queue.workers != workers:
+                self.job_queue.shutdown()
+                self.job_queue = None
+        if self.job_queue is None:
+            self.job_queue = JobQueue(self.generator, workers=workers,
+                                      on_job_done=lambda job: self.ui.set_status(self.batch_status_text()),
+                                      timings=self.timings)
+        self.batch_jobs = self.batch_jobs + self.job_queue.submit_many(settings_list)
+        self.stop_button.config(state='normal')  # Остановка отменяет и задания пакета
+        self.status_var.set(self.batch_status_text())
+
+    def batch_status_text(self):
+        counts = self.job_queue.counts(self.batch_jobs)
+        total = sum(counts.values())
+        finished = counts['done'] + counts['failed'] + counts['cancelled']
+        if finished < total:
+            return f"📦 Пакет: {finished}/{total}, ошибок: {counts['failed']}"
+        if counts['cancelled']:
+            return f"⏹ Пакет остановлен: {counts['done']} файлов, отменено: {counts['cancelled']}"
+        return f"✅ Пакет завершён: {counts['done']} файлов, ошибок: {counts['failed']}"
+
     def play_music(self):
         """Открывает плеер для воспроизведения музыки"""
-        if self.generated_midi is None:
+        if self.generated_notes is None:
             messagebox.showerror("Ошибка", "Сначала сгенерируйте музыку!")
             return
         
@@ -1120,7 +1237,7 @@ class MusicGeneratorGUI:
                 saved_path = None
             
             # Создаем и открываем плеер с передачей пути к сохраненному файлу
-            player = MusicPlayer(self.root, self.generated_midi, filename, saved_path)
+            player = MusicPlayer(self.root, self.generated_notes, filename, saved_path, self.preview_cache)
             
             self.status_var.set("🔊 Плеер открыт")
             
@@ -1132,7 +1249,7 @@ class MusicGeneratorGUI:
 
     def save_music(self):
         """Сохраняет сгенерированную музыку с выбором пути"""
-        if self.generated_midi is None:
+        if self.generated_notes is None:
             messagebox.showerror("Ошибка", "Сначала сгенерируйте музыку!")
             return
 
@@ -1142,7 +1259,7 @@ class MusicGeneratorGUI:
             initial_dir = os.path.dirname(self.generated_filename)
         else:
             initial_filename = "generated_music.mid"
-            initial_dir = self.get_output_path()
+            initial_dir = get_output_path()
 
         # Открываем диалог сохранения файла
         file_path = filedialog.asksaveasfilename(
@@ -1161,8 +1278,9 @@ class MusicGeneratorGUI:
                 # Создаем директорию, если её не существует
                 os.makedirs(os.path.dirname(file_path), exist_ok=True)
                 
-                # Сохраняем MIDI файл
-                self.generated_midi.write(file_path)
+                # Сохраняем MIDI файл: байты уже собраны в памяти для прослушивания
+                with open(file_path, 'wb') as f:
+                    f.write(self.preview_cache.midi_bytes(self.generated_notes))
                 
                 # Получаем информацию о файле
                 file_size = os.path.getsize(file_path)
@@ -1224,27 +1342,84 @@ class MusicGeneratorGUI:
         )
         if file_path:
             self.seed_file_var.set(file_path)
+            self.seed_type_var.set("midi")
+
+            # Разбираем файл заранее: генерация возьмёт токены из кэша
+            def tokenize_in_thread():
+                try:
+                    _, tokens = load_seed_tokens(file_path)
+                    self.ui.set_status(f"✅ Затравка: {os.path.basename(file_path)}, нот: {len(tokens)}")
+                except Exception as e:
+                    self.ui.set_status(f"❌ Ошибка чтения затравки: {str(e)[:100]}")
+
+            threading.Thread(target=tokenize_in_thread, daemon=True).start()
+
+    def current_settings(self):
+        """Текущие настройки генерации в формате пресета"""
+        settings = {
+            "instrument": self.instrument_var.get(),
+            "track_type": self.track_type_var.get(),
+            "key": self.key_var.get(),
+            "num_notes": self.num_notes_var.get(),
+            "temperature": self.temperature_var.get(),
+            "tempo": self.tempo_var.get(),
+            "bpm": self.bpm_var.get(),
+            "time_signature": self.time_signature_var.get(),
+            "pitch_min": self.pitch_min_var.get(),
+            "pitch_max": self.pitch_max_var.get(),
+            "use_scale": self.use_scale_var.get(),
+            "smooth_melody": self.smooth_melody_var.get(),
+            "quantize_rhythm": self.quantize_rhythm_var.get(),
+            "stream": self.stream_var.get(),
+            "time_budget": self.time_budget_var.get()
+        }
+        
+        # Для оркестра сохраняем состав, чтобы пресет был самодостаточным
+        if settings["track_type"] == "orchestra":
+            settings["orchestra"] = [dict(inst) for inst in self.orchestra_instruments]
+            settings["notes_per_instrument"] = self.notes_per_instrument.get()
+
+        # Модель, выбранная по имени, - пресет ссылается на неё именем из
+        # models.json или путём; загруженная через "Обзор" в пресет не пишется
+        if self.model_picked and self.model_name_var.get():
+            settings["model"] = self.generator.registry.reference(self.model_name_var.get())
+
+        # Затравка из MIDI файла
+        if self.seed_type_var.get() == "midi" and self.seed_file_var.get():
+            settings["seed_type"] = "midi"
+            settings["seed_file"] = self.seed_file_var.get()
+        
+        return settings
 
     def load_presets(self):
         """Загружает пресеты в список"""
-        self.presets_listbox.delete(0, tk.END)
-        
-        # Добавляем предопределенные пресеты
-        for preset_name in self.default_presets.keys():
-            self.presets_listbox.insert(tk.END, preset_name)
+        names = list(self.default_presets.keys())
         
         # Пытаемся загрузить пользовательские пресеты
         try:
-            presets_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets.json')
-            if os.path.exists(presets_file):
-                with open(presets_file, 'r', encoding='utf-8') as f:
-                    user_presets = json.load(f)
-                    for preset_name in user_presets.keys():
-                        if preset_name not in self.default_presets:
-                            self.presets_listbox.insert(tk.END, f"👤 {preset_name}")
+            names += [
+                f"{USER_PRESET_MARK}{preset_name}" for preset_name in self.preset_store.names()
+                if preset_name not in self.default_presets
+            ]
         except Exception as e:
             print(f"Не удалось загрузить пользовательские пресеты: {e}")
 
+        # Одна вставка на весь список: тысячи пресетов не подвешивают окно
+        selected = [self.presets_listbox.get(index) for index in self.presets_listbox.curselection()]
+        self.presets_listbox.delete(0, tk.END)
+        self.presets_listbox.insert(tk.END, *names)
+        if selected and selected[0] in names:
+            self.presets_listbox.selection_set(names.index(selected[0]))
+
+    def poll_presets(self):
+        """Обновляет список, если presets.json изменили извне (другое окно, командная строка)"""
+        try:
+            if self.preset_store.refresh():
+                self.load_presets()
+        except Exception as e:
+            print(f"Не удалось перечитать пользовательские пресеты: {e}")
+        self.root.after(PRESETS_POLL_MS, self.poll_presets)
+
     def apply_preset(self):
         """Применяет выбранный пресет"""
         selection = self.presets_listbox.curselection()
@@ -1255,8 +1430,8 @@ class MusicGeneratorGUI:
         preset_name = self.presets_listbox.get(selection[0])
         
         # Убираем эмодзи пользовательского пресета
-        if preset_name.startswith("👤 "):
-            preset_name = preset_name[2:]
+        if preset_name.startswith(USER_PRESET_MARK):
+            preset_name = preset_name[len(USER_PRESET_MARK):]
         
         # Получаем настройки пресета
         preset = None
@@ -1265,11 +1440,7 @@ class MusicGeneratorGUI:
         else:
             # Загружаем из пользовательских
             try:
-                presets_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets.json')
-                with open(presets_file, 'r', encoding='utf-8') as f:
-                    user_presets = json.load(f)
-                    if preset_name in user_presets:
-                        preset = user_presets[preset_name]
+                preset = self.preset_store.get(preset_name)
             except:
                 pass
         
@@ -1279,14 +1450,31 @@ class MusicGeneratorGUI:
             self.track_type_var.set(preset['track_type'])
             self.key_var.set(preset['key'])
             self.num_notes_var.set(preset['num_notes'])
+            self.stream_var.set(preset.get('stream', False))
+            self.time_budget_var.set(int(preset.get('time_budget') or 0))
             self.temperature_var.set(preset['temperature'])
             self.tempo_var.set(preset['tempo'])
+            self.bpm_var.set(int(preset.get('bpm', DEFAULT_BPM)))
+            self.time_signature_var.set(preset.get('time_signature', format_time_signature(DEFAULT_TIME_SIGNATURE)))
             self.pitch_min_var.set(preset['pitch_min'])
             self.pitch_max_var.set(preset['pitch_max'])
             self.use_scale_var.set(preset['use_scale'])
             self.smooth_melody_var.set(preset['smooth_melody'])
             self.quantize_rhythm_var.set(preset['quantize_rhythm'])
             
+            # Состав оркестра, если он сохранён в пресете
+            if preset.get('orchestra'):
+                self.orchestra_instruments = [dict(inst) for inst in preset['orchestra']]
+                self.update_orchestra_listbox()
+            if 'notes_per_instrument' in preset:
+                self.notes_per_instrument.set(preset['notes_per_instrument'])
+            self.seed_type_var.set(preset.get('seed_type', "random"))
+            if preset.get('model') and preset['model'] != self.model_name_var.get():
+                self.model_name_var.set(preset['model'])
+                self.pick_model(preset['model'])
+            if preset.get('seed_file'):
+                self.seed_file_var.set(preset['seed_file'])
+            
             # Обновляем отображение температуры
             self.update_temp_label(preset['temperature'])
             
@@ -1308,35 +1496,11 @@ class MusicGeneratorGUI:
             return
         
         # Создаем словарь с текущими настройками
-        preset = {
-            "instrument": self.instrument_var.get(),
-            "track_type": self.track_type_var.get(),
-            "key": self.key_var.get(),
-            "num_notes": self.num_notes_var.get(),
-            "temperature": self.temperature_var.get(),
-            "tempo": self.tempo_var.get(),
-            "pitch_min": self.pitch_min_var.get(),
-            "pitch_max": self.pitch_max_var.get(),
-            "use_scale": self.use_scale_var.get(),
-            "smooth_melody": self.smooth_melody_var.get(),
-            "quantize_rhythm": self.quantize_rhythm_var.get()
-        }
+        preset = self.current_settings()
         
         try:
-            presets_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets.json')
-            
-            # Загружаем существующие пресеты
-            user_presets = {}
-            if os.path.exists(presets_file):
-                with open(presets_file, 'r', encoding='utf-8') as f:
-                    user_presets = json.load(f)
-            
-            # Добавляем новый пресет
-            user_presets[preset_name] = preset
-            
-            # Сохраняем
-            with open(presets_file, 'w', encoding='utf-8') as f:
-                json.dump(user_presets, f, indent=4, ensure_ascii=False)
+            # Добавляем пресет и атомарно сохраняем файл
+            self.preset_store.save(preset_name, preset)
             
             # Обновляем список
             self.load_presets()
@@ -1357,27 +1521,17 @@ class MusicGeneratorGUI:
         preset_name = self.presets_listbox.get(selection[0])
         
         # Проверяем, что это пользовательский пресет
-        if not preset_name.startswith("👤 "):
+        if not preset_name.startswith(USER_PRESET_MARK):
             messagebox.showwarning("Предупреждение", 
                                  "Невозможно удалить предустановленный пресет")
             return
         
-        preset_name = preset_name[2:]
+        preset_name = preset_name[len(USER_PRESET_MARK):]
         
         if messagebox.askyesno("Подтверждение", 
                               f"Вы уверены, что хотите удалить пресет '{preset_name}'?"):
             try:
-                presets_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presets.json')
-                
-                with open(presets_file, 'r', encoding='utf-8') as f:
-                    user_presets = json.load(f)
-                
-                if preset_name in user_presets:
-                    del user_presets[preset_name]
-                    
-                    with open(presets_file, 'w', encoding='utf-8') as f:
-                        json.dump(user_presets, f, indent=4, ensure_ascii=False)
-                    
+                if self.preset_store.delete(preset_name):
                     self.load_presets()
                     self.status_var.set(f"✅ Пресет '{preset_name}' удалён")
                     messagebox.showinfo("Успех", f"Пресет '{preset_name}' удалён")
@@ -1385,155 +1539,42 @@ class MusicGeneratorGUI:
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось удалить пресет:\n{str(e)}")
 
-    # Заглушки для функций генерации (необходимо реализовать в соответствии с вашей моделью)
-    def generate_notes_with_model(self, num_notes, temperature, key, tempo, track_type):
-        """Генерирует ноты с помощью модели"""
-        # Здесь должна быть ваша логика генерации нот
-        # Это заглушка - замените на реальную реализацию
-        notes = []
-        scale = self.SCALES[key]
-        rhythm_params = self.RHYTHMS[tempo]
-        
-        current_time = 0
-        for i in range(num_notes):
-            pitch = np.random.choice(scale)
-            start = current_time
-            duration = np.random.uniform(rhythm_params['duration_min'], rhythm_params['duration_max'])
-            step = np.random.uniform(rhythm_params['step_min'], rhythm_params['step_max'])
-            velocity = np.random.randint(60, 100)
-            
-            notes.append({
-                'pitch': pitch,
-                'start': start,
-                'end': start + duration,
-                'velocity': velocity
-            })
-            
-            current_time += step
-        
-        return notes
-
-    def notes_to_midi(self, notes, instrument_program, track_type):
-        """Конвертирует ноты в MIDI объект"""
-        midi = pretty_midi.PrettyMIDI()
-        instrument = pretty_midi.Instrument(program=instrument_program)
-        
-        for note_data in notes:
-            note = pretty_midi.Note(
-                velocity=note_data['velocity'],
-                pitch=note_data['pitch'],
-                start=note_data['start'],
-                end=note_data['end']
-            )
-            instrument.notes.append(note)
-        
-        midi.instruments.append(instrument)
-        return midi
-
-    def generate_orchestra(self):
-        """Генерирует оркестровую композицию"""
-        if not self.orchestra_instruments:
-            messagebox.showerror("Ошибка", 
-                               "Добавьте инструменты в оркестр перед генерацией!")
-            return
-        
-        try:
-            # Создаем MIDI объект
-            self.generated_midi = pretty_midi.PrettyMIDI()
-            
-            # Получаем общие параметры
-            key = self.key_var.get()
-            tempo = self.tempo_var.get()
-            temperature = self.temperature_var.get()
-            notes_per_inst = self.notes_per_instrument.get()
-            
-            # Генерируем партию для каждого инструмента
-            for inst_data in self.orchestra_instruments:
-                is_drum = inst_data.get('is_drum', False)
-                
-                if is_drum:
-                    # Создаем ударный инструмент
-                    drum_instrument = pretty_midi.Instrument(
-                        program=inst_data['program'],
-                        is_drum=True
-                    )
-                    
-                    # Генерируем паттерн ударных
-                    drum_notes = self.generate_drum_pattern(
-                        inst_data.get('drum_notes', [36]),
-                        inst_data.get('velocity', 100),
-                        notes_per_inst
-                    )
-                    
-                    for note_data in drum_notes:
-                        note = pretty_midi.Note(
-                            velocity=note_data['velocity'],
-                            pitch=note_data['pitch'],
-                            start=note_data['start'],
-                            end=note_data['end']
-                        )
-                        drum_instrument.notes.append(note)
-                    
-                    self.generated_midi.instruments.append(drum_instrument)
-                    
-                else:
-                    # Создаем обычный инструмент
-                    instrument = pretty_midi.Instrument(program=inst_data['program'])
-                    
-                    # Генерируем ноты в зависимости от роли
-                    role = inst_data.get('role', 'melody')
-                    notes = self.generate_notes_with_model(
-                        notes_per_inst,
-                        temperature,
-                        key,
-                        tempo,
-                        role
-                    )
-                    
-                    for note_data in notes:
-                        note = pretty_midi.Note(
-                            velocity=note_data['velocity'],
-                            pitch=note_data['pitch'],
-                            start=note_data['start'],
-                            end=note_data['end']
-                        )
-                        instrument.notes.append(note)
-                    
-                    self.generated_midi.instruments.append(instrument)
-            
-            self.status_var.set("✅ Оркестровая композиция сгенерирована")
-            
-        except Exception as e:
-            raise Exception(f"Ошибка генерации оркестра: {str(e)}")
-
-    def generate_drum_pattern(self, drum_notes, velocity, num_hits):
-        """Генерирует паттерн для ударных инструментов"""
-        pattern = []
-        current_time = 0
-        beat_duration = 0.5  # Длительность одного удара
-        
-        for i in range(num_hits):
-            # Выбираем случайную ноту из доступных
-            pitch = np.random.choice(drum_notes)
-            
-            pattern.append({
-                'pitch': pitch,
-                'start': current_time,
-                'end': current_time + beat_duration,
-                'velocity': velocity + np.random.randint(-10, 10)
-            })
-            
-            # Варьируем ритм
-            current_time += np.random.choice([0.25, 0.5, 1.0])
-        
-        return pattern
-
-    def run(self):
-        """Запускает приложение"""
+    def report_startup_timing(self, exit_after=False):
+        """Печатает время импорта и первой отрисовки окна относительно цели"""
+        painted = time.perf_counter()
+        imports_ms = (_IMPORTS_DONE - _STARTUP_STARTED) * 1000
+        first_paint_ms = (painted - _STARTUP_STARTED) * 1000
+        within_target = first_paint_ms <= STARTUP_TARGET_MS
+
+        self.startup_timing = {
+            'imports_ms': imports_ms,
+            'first_paint_ms': first_paint_ms,
+            'target_ms': STARTUP_TARGET_MS,
+        }
+        print(f"⏱ Запуск: импорт {imports_ms:.0f} мс, первая отрисовка {first_paint_ms:.0f} мс "
+              f"(цель {STARTUP_TARGET_MS:.0f} мс) {'✅' if within_target else '⚠️ превышено'}")
+
+        if exit_after:
+            self.root.destroy()
+            sys.exit(0 if within_target else 1)
+
+    def run(self, startup_report=False):
+        """Запускает приложение.
+
+        startup_report=True - только замерить запуск и выйти (код 1 при превышении цели).
+        """
+        # Отложенные задачи выполняются после отрисовки созданных виджетов
+        self.root.after_idle(lambda: self.report_startup_timing(exit_after=startup_report))
+        # Файлы прослушивания упавших сессий убираются в фоне, не задерживая окно
+        threading.Thread(target=sweep_stale_previews, daemon=True).start()
         self.root.mainloop()
+        if self.job_queue is not None:
+            self.job_queue.shutdown(cancel_pending=True)
+        self.generator.close()
+        self.preview_cache.remove_preview_files()
 
 
 # Точка входа в программу
 if __name__ == "__main__":
     app = MusicGeneratorGUI()
-    app.run()
+    app.run(startup_report='--startup-report' in sys.argv)
@@ -0,0 +1,81 @@
+"""KV-кэш IncrementalDecoder против пересчёта окна целиком"""
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from aimusic.incremental import IncrementalDecoder
+
+SEQ_LENGTH = 16
+layers = tf.keras.layers
+
+
+class PositionEmbedding(layers.Layer):
+    """Эмбеддинг ноты плюс обучаемая позиция в окне"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tokens = layers.Embedding(128, 16)
+        self.positions = layers.Embedding(SEQ_LENGTH, 16)
+
+    def call(self, inputs):
+        return self.tokens(inputs) + self.positions(tf.range(tf.shape(inputs)[1]))
+
+
+def _causal_model(blocks, positional=False):
+    inputs = tf.keras.Input((SEQ_LENGTH,))
+    x = PositionEmbedding()(inputs) if positional else layers.Embedding(128, 16)(inputs)
+    for _ in range(blocks):
+        attended = layers.MultiHeadAttention(2, 8)(x, x, use_causal_mask=True)
+        x = layers.LayerNormalization()(layers.Add()([x, attended]))
+        x = layers.Dense(16, activation='relu')(x)
+    outputs = layers.Dense(128, name='pitch')(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def _decode(decoder, sequence):
+    """Выходы с кэшем для каждой следующей ноты и начало окна, от которого они считаются"""
+    outputs, caches = decoder.prefill(tf.constant(sequence[:, :SEQ_LENGTH]))
+    results, starts = [outputs.numpy()[:, -1]], [0]
+    position, start = SEQ_LENGTH, 0
+    for i in range(SEQ_LENGTH, sequence.shape[1] - SEQ_LENGTH):
+        if decoder.needs_restart(position):
+            start = i + 1 - decoder.restart_length
+            outputs, caches = decoder.prefill(tf.constant(sequence[:, start:i + 1]))
+            position = decoder.restart_length
+        else:
+            outputs, caches = decoder.step(tf.constant(sequence[:, i:i + 1]), caches, tf.constant(position))
+            position += 1
+            if decoder.sliding:
+                start = i + 1 - SEQ_LENGTH
+        results.append(outputs.numpy()[:, -1])
+        starts.append(start)
+    return np.stack(results), starts
+
+
+def _recompute(model, sequence, starts):
+    """Те же выходы, но окно от начала блока прогоняется через модель целиком"""
+    return np.stack([
+        model(tf.constant(sequence[:, start:start + SEQ_LENGTH]), training=False).numpy()[:, index - start]
+        for index, start in enumerate(starts, SEQ_LENGTH - 1)
+    ])
+
+
+@pytest.mark.parametrize('blocks, positional, sliding', [(1, False, True), (2, False, False), (2, True, False)])
+def test_decoder_matches_full_recompute(blocks, positional, sliding):
+    model = _causal_model(blocks, positional)
+    decoder = IncrementalDecoder(model, SEQ_LENGTH)
+    assert decoder.sliding == sliding
+    sequence = np.random.default_rng(1).integers(0, 128, size=(2, 5 * SEQ_LENGTH)).astype(np.int32)
+
+    decoded, starts = _decode(decoder, sequence)
+    np.testing.assert_allclose(decoded, _recompute(model, sequence, starts), rtol=1e-3, atol=1e-4)
+
+
+def test_non_causal_attention_falls_back_to_full_recompute():
+    inputs = tf.keras.Input((SEQ_LENGTH,))
+    x = layers.Embedding(128, 16)(inputs)
+    x = layers.MultiHeadAttention(2, 8)(x, x)
+    model = tf.keras.Model(inputs, layers.Dense(128)(x))
+    with pytest.raises(ValueError):
+        IncrementalDecoder(model, SEQ_LENGTH)
@@ -0,0 +1,63 @@
+"""write_midi против PrettyMIDI.write на одном и том же NoteBuffer"""
+import io
+
+import numpy as np
+import pytest
+
+pretty_midi = pytest.importorskip("pretty_midi")
+
+from aimusic.midi_io import write_midi
+from aimusic.notes import NoteBuffer, make_notes
+
+END_OF_TRACK = b'\xff\x2f\x00'
+
+
+def _note_buffer(bpm):
+    melody = NoteBuffer.from_notes(make_notes(
+        np.array([60, 64, 67, 72, 60]),
+        np.array([0, 480, 960, 960, 5000]),
+        np.array([480, 960, 1440, 1920, 5400]),
+        np.array([100, 90, 80, 70, 127]),
+    ), program=5, name='Melody', bpm=bpm, time_signature=(3, 4))
+    drums = NoteBuffer.from_notes(make_notes(
+        np.array([36, 42, 36, 38]),
+        np.array([0, 0, 240, 200000]),
+        np.array([120, 120, 360, 200120]),
+        np.array([110, 60, 110, 90]),
+    ), program=0, is_drum=True, name='Drums')
+    return NoteBuffer.concatenate([melody, drums])
+
+
+def _tracks_without_end(data):
+    """Байты событий каждой дорожки без завершающего end-of-track.
+
+    write_midi продлевает дорожки до границы такта, PrettyMIDI.write - на
+    тик после последнего события; всё остальное должно совпасть байт в байт.
+    """
+    assert data[:4] == b'MThd'
+    header_length = int.from_bytes(data[4:8], 'big')
+    header, position, tracks = data[8:8 + header_length], 8 + header_length, []
+    while position < len(data):
+        assert data[position:position + 4] == b'MTrk'
+        length = int.from_bytes(data[position + 4:position + 8], 'big')
+        track = data[position + 8:position + 8 + length]
+        assert track.endswith(END_OF_TRACK)
+        track = track[:-len(END_OF_TRACK)]
+        # Дельта-время end-of-track: последний байт < 0x80, перед ним - байты продолжения
+        track = track[:-1]
+        while track and track[-1] >= 0x80:
+            track = track[:-1]
+        tracks.append(track)
+        position += 8 + length
+    return header, tracks
+
+
+@pytest.mark.parametrize("bpm", [120.0, 97.0, 133.0, 72.5])
+def test_write_midi_matches_pretty_midi(bpm):
+    notes = _note_buffer(bpm)
+    ours = io.BytesIO()
+    write_midi(notes, ours)
+    reference = io.BytesIO()
+    notes.to_pretty_midi().write(reference)
+
+    assert _tracks_without_end(ours.getvalue()) == _tracks_without_end(reference.getvalue())